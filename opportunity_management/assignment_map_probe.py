@@ -0,0 +1,51 @@
+"""Query-count benchmark for api._get_assignment_map.
+
+    bench --site <site> execute opportunity_management.assignment_map_probe.run
+
+Runs the assignment map over growing opportunity samples with a cold party
+resolution cache and counts the SQL statements issued. The set-based
+resolver should keep the count flat as the sample grows.
+"""
+
+import time
+
+import frappe
+
+SIZES = (100, 1000, 5000, 20000)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._orig = None
+
+    def __enter__(self):
+        self._orig = frappe.db.sql
+
+        def _counting_sql(*args, **kwargs):
+            self.count += 1
+            return self._orig(*args, **kwargs)
+
+        frappe.db.sql = _counting_sql
+        return self
+
+    def __exit__(self, *exc):
+        frappe.db.sql = self._orig
+
+
+def run():
+    from opportunity_management.opportunity_management import api, notification_utils
+
+    all_names = frappe.get_all("Opportunity", pluck="name", order_by="creation desc")
+    print(f"{'opps':>7} {'queries':>8} {'ms':>9}")
+    results = []
+    for size in SIZES:
+        names = all_names[:size]
+        notification_utils.clear_party_resolution_cache()
+        started = time.perf_counter()
+        with _QueryCounter() as counter:
+            api._get_assignment_map(names)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{len(names):>7} {counter.count:>8} {elapsed:>9.1f}")
+        results.append({"opportunities": len(names), "queries": counter.count, "ms": round(elapsed, 1)})
+    return results
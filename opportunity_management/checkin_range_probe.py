@@ -0,0 +1,167 @@
+"""Benchmark: DATE(time) = day vs half-open time ranges on Employee Checkin.
+
+    bench --site <site> execute opportunity_management.checkin_range_probe.run
+
+Builds two scratch tables — EMPLOYEES synthetic employees and a year of
+their check-ins (an IN and an OUT per working day, ~EMPLOYEES × 520 rows)
+— indexed the way patches.add_employee_checkin_time_index indexes
+`tabEmployee Checkin`, then runs each per-day attendance query in its old
+`DATE(c.time) = %s` form and its `day_bounds` range form and prints, per
+variant, the access type MariaDB's EXPLAIN reports for the check-in table,
+the rows it expects to examine, and the median wall time of RUNS runs.
+The old form should show a full index/table scan with rows ≈ table size;
+the range form a ref/range access touching a handful of rows.
+
+The scratch tables are dropped afterwards; no site data is touched.
+"""
+
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+import frappe
+
+EMPLOYEES = 300
+DAYS = 365
+RUNS = 5
+
+_EMP = "_probe_employee"
+_CHK = "_probe_employee_checkin"
+
+# {variant: (sql, uses_range)} — copies of the production queries with the
+# table names swapped for the scratch tables.
+_QUERIES = {
+    "missing check-in": """
+        SELECT e.name FROM `{emp}` e
+        WHERE NOT EXISTS (
+            SELECT 1 FROM `{chk}` c
+            WHERE c.employee = e.name AND c.log_type = 'IN' AND {day_c}
+        )
+    """,
+    "still on the clock": """
+        SELECT e.name FROM `{emp}` e
+        WHERE EXISTS (
+            SELECT 1 FROM `{chk}` c
+            WHERE c.employee = e.name AND c.log_type = 'IN' AND {day_c}
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM `{chk}` c
+            WHERE c.employee = e.name AND c.log_type = 'OUT' AND {out_c}
+              AND c.time > (
+                  SELECT MAX(c2.time) FROM `{chk}` c2
+                  WHERE c2.employee = e.name AND c2.log_type = 'IN' AND {day_c2}
+              )
+        )
+    """,
+    "check-ins today": """
+        SELECT COUNT(*) FROM `{chk}` c WHERE {day_c}
+    """,
+}
+
+_OLD = {
+    "day_c": "DATE(c.time) = %(day)s",
+    "day_c2": "DATE(c2.time) = %(day)s",
+    "out_c": "DATE(c.time) = %(day)s",
+}
+_NEW = {
+    "day_c": "c.time >= %(day_start)s AND c.time < %(day_end)s",
+    "day_c2": "c2.time >= %(day_start)s AND c2.time < %(day_end)s",
+    "out_c": "c.time < %(day_end)s",
+}
+
+
+def _build(today):
+    frappe.db.sql_ddl(f"DROP TABLE IF EXISTS `{_CHK}`")
+    frappe.db.sql_ddl(f"DROP TABLE IF EXISTS `{_EMP}`")
+    frappe.db.sql_ddl(f"CREATE TABLE `{_EMP}` (name VARCHAR(140) PRIMARY KEY)")
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE `{_CHK}` (
+            name VARCHAR(140) PRIMARY KEY,
+            employee VARCHAR(140),
+            log_type VARCHAR(140),
+            time DATETIME(6),
+            KEY employee_log_type_time (employee, log_type, time),
+            KEY time (time)
+        )
+    """)
+    employees = [f"PROBE-EMP-{i:05d}" for i in range(EMPLOYEES)]
+    frappe.db.sql(
+        f"INSERT INTO `{_EMP}` (name) VALUES " + ", ".join(["(%s)"] * len(employees)),
+        employees,
+    )
+
+    rng = random.Random(42)
+    rows = []
+    for offset in range(DAYS, -1, -1):
+        day = today - timedelta(days=offset)
+        if day.weekday() in (4, 5):  # Fri / Sat off
+            continue
+        for emp in employees:
+            if rng.random() < 0.05:
+                continue  # absent
+            start = datetime.combine(day, datetime.min.time())
+            check_in = start + timedelta(hours=8, minutes=rng.randint(0, 120))
+            rows.append((emp, "IN", check_in))
+            # Today most people are still in; earlier days everyone left.
+            if offset or rng.random() < 0.3:
+                rows.append((emp, "OUT", check_in + timedelta(hours=8, minutes=rng.randint(0, 90))))
+
+    for start in range(0, len(rows), 5000):
+        chunk = rows[start:start + 5000]
+        values = []
+        for i, (emp, log_type, at) in enumerate(chunk, start):
+            values.extend((f"PROBE-CHK-{i:09d}", emp, log_type, at))
+        frappe.db.sql(
+            f"INSERT INTO `{_CHK}` (name, employee, log_type, time) VALUES "
+            + ", ".join(["(%s, %s, %s, %s)"] * len(chunk)),
+            values,
+        )
+    frappe.db.sql(f"ANALYZE TABLE `{_CHK}`")
+    return len(rows)
+
+
+def _explain(sql, params):
+    """(access type, expected rows) of the first plan row on the check-in
+    table."""
+    for row in frappe.db.sql("EXPLAIN " + sql, params, as_dict=True):
+        if row.get("table") in ("c", "c2"):
+            return row.get("type"), row.get("rows")
+    return None, None
+
+
+def _time(sql, params):
+    samples = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        frappe.db.sql(sql, params)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def run():
+    from opportunity_management.opportunity_management.utils.attendance import day_bounds
+
+    today = date.today()
+    day_start, day_end = day_bounds(today)
+    params = {"day": today, "day_start": day_start, "day_end": day_end}
+
+    try:
+        total = _build(today)
+        print(f"{total} synthetic check-ins, {EMPLOYEES} employees, {DAYS} days\n")
+        print(f"{'query':<20} {'form':<6} {'access':<8} {'rows':>9} {'ms':>9}")
+        results = []
+        for label, template in _QUERIES.items():
+            for form, parts in (("DATE()", _OLD), ("range", _NEW)):
+                sql = template.format(emp=_EMP, chk=_CHK, **parts)
+                access, rows = _explain(sql, params)
+                ms = _time(sql, params)
+                print(f"{label:<20} {form:<6} {access or '-':<8} {rows or 0:>9} {ms:>9.1f}")
+                results.append({
+                    "query": label, "form": form, "access": access,
+                    "rows": rows, "ms": round(ms, 1),
+                })
+    finally:
+        frappe.db.sql_ddl(f"DROP TABLE IF EXISTS `{_CHK}`")
+        frappe.db.sql_ddl(f"DROP TABLE IF EXISTS `{_EMP}`")
+    return results
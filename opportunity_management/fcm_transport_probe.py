@@ -0,0 +1,229 @@
+"""Stub FCM v1 server and transport check for fcm_utils.
+
+    bench --site <site> execute opportunity_management.fcm_transport_probe.run
+
+Starts a local stub of the FCM v1 `messages:send` endpoint (HTTP/2 with
+prior knowledge, plus an HTTP/1.1 twin for the requests transport) that
+answers after a fixed simulated latency, then pushes the same batch
+through both transports and checks:
+
+  ordering      — result i belongs to message i
+  error mapping — status and FCM errorCode per token prefix:
+                    unregistered-…  404 UNREGISTERED
+                    invalid-…       400 INVALID_ARGUMENT
+                    quota-…         429 QUOTA_EXCEEDED (Retry-After: 1)
+                    anything else   200
+  throughput    — messages per second for each transport
+
+No credentials or network access are needed; the probe drives the
+transport functions directly with a dummy bearer token.
+"""
+
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY = 0.05
+SIZES = (100, 1000, 5000)
+
+_ERRORS = {
+    "unregistered-": (404, "NOT_FOUND", "UNREGISTERED"),
+    "invalid-": (400, "INVALID_ARGUMENT", "INVALID_ARGUMENT"),
+    "quota-": (429, "RESOURCE_EXHAUSTED", "QUOTA_EXCEEDED"),
+}
+
+
+def _stub_response(body: bytes):
+    """(status, headers, body) the stub answers a send request with."""
+    token = json.loads(body or b"{}").get("message", {}).get("token", "")
+    for prefix, (status, rpc_status, error_code) in _ERRORS.items():
+        if token.startswith(prefix):
+            payload = {"error": {
+                "code": status,
+                "status": rpc_status,
+                "message": error_code,
+                "details": [{
+                    "@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+                    "errorCode": error_code,
+                }],
+            }}
+            headers = [("retry-after", "1")] if status == 429 else []
+            return status, headers, json.dumps(payload).encode()
+    return 200, [], json.dumps({"name": f"projects/stub/messages/{token}"}).encode()
+
+
+class _StubH2Server:
+    """Minimal HTTP/2 (h2c, prior knowledge) server. Each stream is answered
+    LATENCY seconds after its request ends, independently of the others, so
+    multiplexing shows up as throughput."""
+
+    def __init__(self, latency=LATENCY):
+        self.latency = latency
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        self._closed = False
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self._sock.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        h2conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        h2conn.initiate_connection()
+        conn.sendall(h2conn.data_to_send())
+        conn.settimeout(0.002)
+        bodies = {}
+        pending = []  # (due, stream_id, body)
+        while True:
+            try:
+                data = conn.recv(65535)
+                if not data:
+                    break
+                for event in h2conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        bodies[event.stream_id] = b""
+                    elif isinstance(event, h2.events.DataReceived):
+                        bodies[event.stream_id] = bodies.get(event.stream_id, b"") + event.data
+                        h2conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        pending.append((time.monotonic() + self.latency, event.stream_id, bodies.pop(event.stream_id, b"")))
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        conn.close()
+                        return
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+            now = time.monotonic()
+            due = [p for p in pending if p[0] <= now]
+            pending = [p for p in pending if p[0] > now]
+            for _, stream_id, body in due:
+                status, headers, payload = _stub_response(body)
+                h2conn.send_headers(stream_id, [
+                    (":status", str(status)),
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(payload))),
+                    *headers,
+                ])
+                h2conn.send_data(stream_id, payload, end_stream=True)
+            try:
+                outbound = h2conn.data_to_send()
+                if outbound:
+                    conn.sendall(outbound)
+            except OSError:
+                break
+        conn.close()
+
+
+class _StubH1Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = LATENCY
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.latency)
+        status, headers, payload = _stub_response(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _messages(n):
+    """n tokens, three in every seven mapped to an error."""
+    prefixes = list(_ERRORS) + [""] * 4
+    return [f"{prefixes[i % len(prefixes)]}tok{i}" for i in range(n)]
+
+
+def _expected(token):
+    for prefix, (status, _, error_code) in _ERRORS.items():
+        if token.startswith(prefix):
+            return status, error_code
+    return 200, None
+
+
+def _check(tokens, results):
+    """None if every result matches its token, else a description."""
+    if len(results) != len(tokens):
+        return f"{len(results)} results for {len(tokens)} messages"
+    for token, r in zip(tokens, results):
+        status, error_code = _expected(token)
+        if r["status"] != status or r["fcm_error"] != error_code:
+            return f"{token}: got {r['status']}/{r['fcm_error']}, want {status}/{error_code}"
+    return None
+
+
+def run():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from concurrent.futures import ThreadPoolExecutor
+
+    from opportunity_management.opportunity_management import fcm_utils
+
+    h2_server = _StubH2Server().start()
+    h1_server = ThreadingHTTPServer(("127.0.0.1", 0), _StubH1Handler)
+    threading.Thread(target=h1_server.serve_forever, daemon=True).start()
+    h2_url = f"http://127.0.0.1:{h2_server.port}/v1/projects/stub/messages:send"
+    h1_url = f"http://127.0.0.1:{h1_server.server_port}/v1/projects/stub/messages:send"
+
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=fcm_utils._FCM_POOL_SIZE))
+
+    print(f"{'transport':<10} {'msgs':>6} {'ok':>4} {'seconds':>8} {'msg/s':>8}")
+    results = []
+    try:
+        for size in SIZES:
+            tokens = _messages(size)
+            payloads = [fcm_utils._build_payload(t, "probe", "probe", {}, 1) for t in tokens]
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=fcm_utils._FANOUT_WORKERS) as pool:
+                h1 = list(pool.map(lambda p: fcm_utils._post(session, h1_url, p), payloads))
+            h1_secs = time.perf_counter() - started
+
+            started = time.perf_counter()
+            h2 = fcm_utils._post_many_http2(h2_url, "stub-token", payloads, fcm_utils._HTTP2_STREAMS)
+            h2_secs = time.perf_counter() - started
+
+            for name, out, secs in (("http1.1", h1, h1_secs), ("http2", h2, h2_secs)):
+                problem = _check(tokens, out)
+                print(f"{name:<10} {size:>6} {'yes' if not problem else 'NO':>4} {secs:>8.2f} {size / secs:>8.0f}")
+                if problem:
+                    print(f"  {problem}")
+                results.append({
+                    "transport": name,
+                    "messages": size,
+                    "correct": not problem,
+                    "seconds": round(secs, 2),
+                })
+    finally:
+        h1_server.shutdown()
+        h2_server.stop()
+    return results
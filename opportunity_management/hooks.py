@@ -14,7 +14,51 @@ doc_events = {
     "Opportunity": {
         # Keep assignment hooks disabled to avoid duplicates.
         "validate": "opportunity_management.opportunity_management.notification_utils.set_opportunity_notification_recipients",
-        "on_update": "opportunity_management.opportunity_management.notification_utils.send_closing_date_extended_notification",
+        "on_update": [
+            "opportunity_management.opportunity_management.notification_utils.send_closing_date_extended_notification",
+            # Cached opportunities dashboard (api.get_opportunities_dashboard).
+            "opportunity_management.opportunity_management.api.clear_dashboard_cache",
+        ],
+        "on_trash": "opportunity_management.opportunity_management.api.clear_dashboard_cache",
+    },
+    # Party → user resolution cache (notification_utils) is derived from
+    # these DocTypes; any edit invalidates it.
+    "Responsible Party": {
+        "on_update": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+        "on_trash": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+    },
+    "Employee": {
+        "on_update": [
+            "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+            # user ↔ employee ↔ FCM token cache (fcm_utils).
+            "opportunity_management.opportunity_management.fcm_utils.clear_push_target_cache",
+        ],
+        "on_trash": [
+            "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+            "opportunity_management.opportunity_management.fcm_utils.clear_push_target_cache",
+        ],
+    },
+    "Contact": {
+        "on_update": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+        "on_trash": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+    },
+    "User": {
+        "on_update": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+        "on_trash": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+    },
+    "Shareholder": {
+        "on_update": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+        "on_trash": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+    },
+    "Responsible Engineer": {
+        "on_update": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+        "on_trash": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+    },
+    # Contact ↔ Shareholder links; usually saved with their Contact, but
+    # edited directly too.
+    "Dynamic Link": {
+        "on_update": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
+        "on_trash": "opportunity_management.opportunity_management.notification_utils.clear_party_resolution_cache",
     },
     "Email Queue": {
         "after_insert": "opportunity_management.opportunity_management.notification_utils.log_opportunity_notification_from_email_queue",
@@ -26,6 +70,7 @@ doc_events = {
             "opportunity_management.quotation_handler.recalc_opportunity_amount",
             "opportunity_management.opportunity_management.business_hooks.on_quotation_after_insert",
         ],
+        "on_update": "opportunity_management.opportunity_management.api.clear_dashboard_cache",
         "on_update_after_submit": [
             "opportunity_management.quotation_handler.recalc_opportunity_amount",
             "opportunity_management.opportunity_management.business_hooks.on_quotation_update_after_submit",
@@ -33,9 +78,16 @@ doc_events = {
         "on_submit": [
             "opportunity_management.quotation_handler.recalc_opportunity_amount",
             "opportunity_management.opportunity_management.business_hooks.on_quotation_submit",
+            "opportunity_management.opportunity_management.api.clear_dashboard_cache",
+        ],
+        "on_cancel": [
+            "opportunity_management.quotation_handler.recalc_opportunity_amount",
+            "opportunity_management.opportunity_management.api.clear_dashboard_cache",
+        ],
+        "on_trash": [
+            "opportunity_management.quotation_handler.recalc_opportunity_amount",
+            "opportunity_management.opportunity_management.api.clear_dashboard_cache",
         ],
-        "on_cancel": "opportunity_management.quotation_handler.recalc_opportunity_amount",
-        "on_trash": "opportunity_management.quotation_handler.recalc_opportunity_amount",
     },
     "Purchase Order": {
         "on_submit": "opportunity_management.opportunity_management.business_hooks.on_purchase_order_submit",
@@ -67,6 +119,9 @@ doc_events = {
     "Employee Checkin": {
         "before_insert": "opportunity_management.opportunity_management.ess_hooks.before_checkin_insert",
         "after_insert": "opportunity_management.opportunity_management.ess_hooks.on_checkin_insert",
+        # Keep ESS Attendance Day in step when a punch is corrected or removed.
+        "on_update": "opportunity_management.opportunity_management.attendance_state.on_checkin_update",
+        "after_delete": "opportunity_management.opportunity_management.attendance_state.on_checkin_delete",
     },
     "Leave Application": {
         "after_insert": [
@@ -86,7 +141,13 @@ doc_events = {
         "after_insert": "opportunity_management.opportunity_management.ess_hooks.on_announcement_insert",
     },
     "Notification Log": {
-        "after_insert": "opportunity_management.opportunity_management.ess_hooks.on_notification_log_insert",
+        "after_insert": [
+            "opportunity_management.opportunity_management.ess_hooks.on_notification_log_insert",
+            # Per-user unread counters behind push badges (fcm_utils).
+            "opportunity_management.opportunity_management.fcm_utils.bump_unread_counter",
+        ],
+        "on_update": "opportunity_management.opportunity_management.fcm_utils.on_notification_log_change",
+        "on_trash": "opportunity_management.opportunity_management.fcm_utils.on_notification_log_change",
     },
     "Journal Entry": {
         "on_update": "opportunity_management.opportunity_management.business_hooks.on_journal_entry_workflow_change",
@@ -114,27 +175,28 @@ scheduler_events = {
         "30 7 * * *": [
             "opportunity_management.opportunity_management.tasks.send_management_daily_closing_summary"
         ],
+        # Nightly Opportunity KPI snapshots (00:30) — the KPI page sums these
+        # instead of recomputing from raw Opportunity rows.
+        "30 0 * * *": [
+            "opportunity_management.opportunity_management.kpi_snapshots.build_daily_kpi_snapshots"
+        ],
         # Weekly manager digest (Mondays at 9:00 AM)
         "0 9 * * 1": [
             "opportunity_management.opportunity_management.tasks.send_manager_weekly_digest"
         ],
-        # Every 5 minutes — process scheduled FCM broadcasts, send the
-        # configured daily check-in reminder, force auto-checkout any
-        # employees still checked in past the configured hour, and fire the
-        # attendance-window reminders (each of which self-gates on
-        # time-of-day + a per-day global flag so this cron can safely list
-        # them all — they no-op outside their window).
+        # Every minute — resend transient FCM failures whose backoff is up
+        # (ESS Push Retry outbox).
+        "* * * * *": [
+            "opportunity_management.opportunity_management.fcm_retry.process_push_retries"
+        ],
+        # Every 5 minutes — process scheduled FCM broadcasts, and run the
+        # attendance tick: it reads ESS Mobile Settings once and fires
+        # whichever attendance slots are due (daily check-in reminder,
+        # check-in-closing warnings, hourly checkout reminders, pre-auto-
+        # checkout warning, auto-checkout) — see attendance_reminders.
         "*/5 * * * *": [
             "opportunity_management.opportunity_management.api.process_scheduled_broadcasts",
-            "opportunity_management.opportunity_management.api.send_daily_checkin_reminders",
-            "opportunity_management.opportunity_management.api.auto_checkout_pending_employees",
-            # 15 min / 5 min before check-in window closes.
-            "opportunity_management.opportunity_management.attendance_reminders.send_checkin_closing_15min_warning",
-            "opportunity_management.opportunity_management.attendance_reminders.send_checkin_closing_5min_warning",
-            # Hourly 4/5/6/7 PM — remind checked-in-but-not-out employees.
-            "opportunity_management.opportunity_management.attendance_reminders.send_checkout_reminder_hourly",
-            # 5 min before auto-checkout — final warning before we clock people out.
-            "opportunity_management.opportunity_management.attendance_reminders.send_pre_auto_checkout_warning",
+            "opportunity_management.opportunity_management.attendance_reminders.attendance_tick",
         ],
     }
 }
@@ -6,10 +6,15 @@ Provides data for:
 2. KPI Dashboard - completion rate metrics
 """
 
+import base64
+import json
+import time
+
 import frappe
 from frappe import _
 from frappe.utils import nowdate, getdate, date_diff, flt, cint
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 from opportunity_management.opportunity_management import notification_utils
 
 
@@ -41,6 +46,163 @@ def _apply_status_display(rows):
     return rows
 
 
+# ── Opportunity row annotation ───────────────────────────────────────────────
+# Shared by get_personal_opportunities, get_team_opportunities_for_user and
+# get_team_opportunities. Urgency, card colour/label and the sort key only
+# depend on (days_remaining, has_quotation), so the classifier is memoised —
+# a team view of thousands of rows resolves to a few dozen distinct inputs.
+#
+# Open tab order:
+#   1. Undated (no_closing_date) — decision needed
+#   2. On-track (due_today → low) — nearest closing first
+#   3. Overdue — least overdue first
+# Completed tab: most recent expected closing first, undated at the bottom.
+_URGENCY_RANK = {
+    "no_closing_date": 0,
+    "due_today": 1, "critical": 2, "high": 3, "medium": 4, "low": 5,
+    "overdue": 6,
+    "completed": 7,
+    "unknown": 8,
+}
+_UNDATED = date(1, 1, 1)
+
+
+@lru_cache(maxsize=1024)
+def _classify_open(days_remaining, has_quotation):
+    """(urgency, status_color, status_label, sort_key) for an open-tab row."""
+    if days_remaining is None:
+        return "no_closing_date", "gray", "No closing date", (_URGENCY_RANK["no_closing_date"], 9999)
+
+    if has_quotation:
+        urgency = "low"
+    elif days_remaining < 0:
+        urgency = "overdue"
+    elif days_remaining == 0:
+        urgency = "due_today"
+    elif days_remaining == 1:
+        urgency = "critical"
+    elif days_remaining <= 3:
+        urgency = "high"
+    elif days_remaining <= 7:
+        urgency = "medium"
+    else:
+        urgency = "low"
+
+    if days_remaining <= 0:
+        status_color = "red"
+    elif days_remaining <= 3:
+        status_color = "orange"
+    elif days_remaining <= 7:
+        status_color = "yellow"
+    else:
+        status_color = "green"
+
+    if days_remaining < 0:
+        status_label = f"Overdue by {abs(days_remaining)} days"
+    elif days_remaining == 0:
+        status_label = "Due today"
+    else:
+        status_label = f"{days_remaining} days remaining"
+
+    # Inside the overdue bucket, least-overdue (closest to zero) on top.
+    secondary = -days_remaining if urgency == "overdue" else days_remaining
+    return urgency, status_color, status_label, (_URGENCY_RANK[urgency], secondary)
+
+
+def _opportunity_sort_pairs(rows, include_completed, today=None):
+    """Fill `days_remaining`, `urgency`, `status_color` and `status_label`
+    on opportunity row dicts in one pass and return `(key, row)` pairs in
+    tab order.
+
+    Each row needs `opportunity`, `closing_date` (date, ISO string or None)
+    and `has_quotation`. The key is the tab's sort key with the opportunity
+    name as tie-breaker, so it's a total order usable as a keyset cursor."""
+    today = today or getdate(nowdate())
+    keyed = []
+    for row in rows:
+        closing_date = getdate(row["closing_date"]) if row.get("closing_date") else None
+        days_remaining = date_diff(closing_date, today) if closing_date else None
+        urgency, status_color, status_label, sort_key = _classify_open(
+            days_remaining, bool(row.get("has_quotation"))
+        )
+        if include_completed:
+            urgency = "completed"
+            sort_key = closing_date or _UNDATED
+        row["days_remaining"] = days_remaining
+        row["urgency"] = urgency
+        row["status_color"] = status_color
+        row["status_label"] = status_label
+        keyed.append(((sort_key, row["opportunity"]), row))
+
+    keyed.sort(key=lambda pair: pair[0], reverse=include_completed)
+    return keyed
+
+
+def _annotate_opportunity_rows(rows, include_completed, today=None):
+    """`_opportunity_sort_pairs` without the keys — annotated rows in tab order."""
+    return [row for _, row in _opportunity_sort_pairs(rows, include_completed, today)]
+
+
+# ── Keyset pagination ────────────────────────────────────────────────────────
+# Cursors are the last row's sort key from `_opportunity_sort_pairs`,
+# JSON-encoded and base64'd so the client treats them as opaque. Open tab:
+# [urgency_rank, days, name]; completed tab: [closing_date, name].
+
+def _encode_cursor(key, include_completed):
+    sort_key, name = key
+    parts = [sort_key.isoformat()] if include_completed else list(sort_key)
+    return base64.urlsafe_b64encode(json.dumps(parts + [name]).encode()).decode()
+
+
+def _decode_cursor(cursor, include_completed):
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(str(cursor).encode()))
+        if include_completed:
+            # Not getdate(): frappe treats "0001-01-01" (_UNDATED) as invalid
+            # and returns None, which can't be compared against row keys.
+            return (date.fromisoformat(parts[0]), parts[1])
+        return ((int(parts[0]), int(parts[1])), parts[2])
+    except Exception:
+        frappe.throw(_("Invalid cursor"))
+
+
+def _page_opportunity_pairs(pairs, include_completed, limit, cursor=None):
+    """One page of tab-ordered `(key, row)` pairs strictly after `cursor`.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page."""
+    limit = max(cint(limit), 1)
+    if cursor:
+        after = _decode_cursor(cursor, include_completed)
+        if include_completed:
+            pairs = [p for p in pairs if p[0] < after]
+        else:
+            pairs = [p for p in pairs if p[0] > after]
+    page = pairs[:limit]
+    next_cursor = _encode_cursor(page[-1][0], include_completed) if len(pairs) > limit else None
+    return [row for _, row in page], next_cursor
+
+
+def _get_items_by_opp(opp_names):
+    """{opportunity: [item dicts]} for the given opportunities, one query."""
+    items_by_opp = {}
+    if not opp_names:
+        return items_by_opp
+    for r in frappe.get_all(
+        "Opportunity Item",
+        filters={"parent": ["in", list(opp_names)], "parenttype": "Opportunity"},
+        fields=["parent", "item_code", "item_name", "qty", "uom", "description"],
+        order_by="parent, idx",
+    ):
+        items_by_opp.setdefault(r["parent"], []).append({
+            "item_code": r["item_code"],
+            "item_name": r["item_name"],
+            "qty": r["qty"],
+            "uom": r["uom"],
+            "description": r["description"],
+        })
+    return items_by_opp
+
+
 def _get_party_display_name(party_name):
     """Resolve display name for Responsible Party/Employee/Shareholder."""
     if not party_name:
@@ -79,19 +241,6 @@ def _get_assignment_map(opportunity_names):
 
     meta = frappe.get_meta("Opportunity")
 
-    # Cache responsible party resolution
-    party_cache = {}
-
-    def _resolve_user_id(party_name):
-        if not party_name:
-            return None
-        if party_name in party_cache:
-            return party_cache[party_name]
-        info = notification_utils._get_responsible_party_info(party_name)
-        user_id = info.get("user_id")
-        party_cache[party_name] = user_id
-        return user_id
-
     resp_party_field = meta.get_field("custom_responsible_party")
     if resp_party_field and resp_party_field.options:
         rows = frappe.get_all(
@@ -103,8 +252,13 @@ def _get_assignment_map(opportunity_names):
             },
             fields=["parent", "responsible_party"],
         )
+        # Resolve every distinct party in one pass (served from the
+        # site-wide party resolution cache) instead of per row.
+        party_infos = notification_utils.get_responsible_party_infos(
+            [row.responsible_party for row in rows]
+        )
         for row in rows:
-            user_id = _resolve_user_id(row.responsible_party)
+            user_id = (party_infos.get(row.responsible_party) or {}).get("user_id")
             if user_id:
                 assignment_map[row.parent].add(user_id)
 
@@ -125,7 +279,7 @@ def _is_user_assigned(user, doc):
 
 
 @frappe.whitelist()
-def get_my_opportunities(user=None, include_completed=False, search=None):
+def get_my_opportunities(user=None, include_completed=False, search=None, limit=None, cursor=None):
     """
     Get opportunity tasks for the current user.
 
@@ -133,8 +287,12 @@ def get_my_opportunities(user=None, include_completed=False, search=None):
         user: Optional - user email (defaults to current user)
         include_completed: Boolean - if True, show only completed opportunities (Closed/Lost/Converted)
                                      if False, show only open opportunities
+        limit: Optional - page size. When set, the response is paginated
+        cursor: Optional - `next_cursor` from the previous page
 
     Returns a list of opportunities with their assignments and closing dates.
+    With `limit`, returns {"opportunities", "next_cursor", "total_count"}
+    instead; next_cursor is None on the last page.
     """
     # HTTP query params arrive as strings — "0" is truthy in Python, so coerce
     # to int before any truthiness check. Without this, /Open/ tab always
@@ -151,31 +309,23 @@ def get_my_opportunities(user=None, include_completed=False, search=None):
     # manager view. Previously this auto-routed Sales Managers to the team
     # view, which made every team opportunity show up under their "Mine"
     # tab (including ones assigned to their direct reports).
-    return get_personal_opportunities(user, include_completed, search=search)
+    return get_personal_opportunities(
+        user, include_completed, search=search, limit=limit, cursor=cursor
+    )
 
 
-def get_personal_opportunities(user, include_completed=False, search=None):
-    """
-    Get personal opportunity tasks for a user.
-
-    Batched-query version. Previously did one frappe.get_doc + two
-    frappe.db.exists per opportunity (N+1 pattern) which produced hundreds
-    of DB round-trips per call. Now:
-      1. One get_all for opportunities (all fields we need).
-      2. One _get_assignment_map for every assignment across all opps.
-      3. One get_all on Quotation for the has_quotation/has_draft flags.
-      4. One get_all on Opportunity Item for items belonging to the opps.
-    Then everything else is in-memory. Response time dropped from
-    seconds-per-load into the low-hundreds-of-ms range.
-    """
-    # HTTP query params come through as strings; coerce so "0" is False.
-    include_completed = bool(cint(include_completed))
+def _personal_opportunity_rows(user, include_completed, filters=None, search=None):
+    """Unannotated row dicts for the opportunities `user` is on the hook
+    for — steps 1–3 of get_personal_opportunities. `filters` narrows the
+    Opportunity query (e.g. by name for delta sync)."""
     # "Quotation" status = a Quotation has been raised → work is done from the
     # opportunity holder's perspective; treated as completed alongside the
     # explicit terminal statuses.
     completed_statuses = ["Closed", "Lost", "Converted", "Quotation"]
     status_filter = None if include_completed else ["not in", completed_statuses]
-    opp_filters = {"status": status_filter} if status_filter else {}
+    opp_filters = dict(filters or {})
+    if status_filter:
+        opp_filters["status"] = status_filter
 
     # (1) One query — fetch every field we'd otherwise pull via get_doc.
     # When a search term is provided, match it (case-insensitive substring)
@@ -223,28 +373,7 @@ def get_personal_opportunities(user, include_completed=False, search=None):
         if q["docstatus"] == 0:
             flags["has_draft"] = True
 
-    # (4) One query — items for every opp.
-    item_rows = frappe.get_all(
-        "Opportunity Item",
-        filters={
-            "parent": ["in", opp_names],
-            "parenttype": "Opportunity",
-        },
-        fields=["parent", "item_code", "item_name", "qty", "uom", "description"],
-        order_by="parent, idx",
-    )
-    items_by_opp = {}
-    for r in item_rows:
-        items_by_opp.setdefault(r["parent"], []).append({
-            "item_code": r["item_code"],
-            "item_name": r["item_name"],
-            "qty": r["qty"],
-            "uom": r["uom"],
-            "description": r["description"],
-        })
-
     opportunities = []
-    today = getdate(nowdate())
 
     for opp in opps:
         assigned_users = assignment_map.get(opp.name) or set()
@@ -271,33 +400,6 @@ def get_personal_opportunities(user, include_completed=False, search=None):
             if has_quotation:
                 continue
 
-        closing_date = getdate(opp.expected_closing) if opp.expected_closing else None
-        days_remaining = date_diff(closing_date, today) if closing_date else None
-
-        if include_completed:
-            urgency = "completed"
-        elif days_remaining is None:
-            # Undated: distinct from overdue — these need a decision made,
-            # not a deadline chased. Sorted FIRST in the list.
-            urgency = "no_closing_date"
-        elif has_quotation:
-            urgency = "low"
-        elif days_remaining < 0:
-            urgency = "overdue"
-        elif days_remaining == 0:
-            urgency = "due_today"
-        elif days_remaining == 1:
-            urgency = "critical"
-        elif days_remaining <= 3:
-            urgency = "high"
-        elif days_remaining <= 7:
-            urgency = "medium"
-        else:
-            urgency = "low"
-
-        status_color = "gray" if days_remaining is None else ("red" if days_remaining < 0 else ("red" if days_remaining == 0 else ("orange" if days_remaining <= 3 else ("yellow" if days_remaining <= 7 else "green"))))
-        status_label = "No closing date" if days_remaining is None else (f"Overdue by {abs(days_remaining)} days" if days_remaining < 0 else ("Due today" if days_remaining == 0 else f"{days_remaining} days remaining"))
-
         opportunities.append({
             "todo_name": None,
             "opportunity": opp.name,
@@ -308,14 +410,9 @@ def get_personal_opportunities(user, include_completed=False, search=None):
             "tender_title": opp.custom_tender_title,
             "closing_date": opp.expected_closing,
             "expected_closing": opp.expected_closing,
-            "days_remaining": days_remaining,
-            "urgency": urgency,
-            "items": items_by_opp.get(opp.name, []),
             "status": opp.status,
             "has_quotation": bool(has_quotation),
             "has_draft_quotation": bool(has_draft_quotation),
-            "status_color": status_color,
-            "status_label": status_label,
             "opportunity_status": opp.status,
             "priority": None,
             "assigned_by": opp.owner,
@@ -324,49 +421,216 @@ def get_personal_opportunities(user, include_completed=False, search=None):
             "opportunity_type": opp.opportunity_type,
         })
 
-    if include_completed:
-        # Completed tab: closest completion first (most recent expected
-        # closing at the top). Undated rows sink to the bottom. Coerce
-        # everything to `datetime.date` so the sort never mixes types
-        # (Frappe returns dates as `date` objects; a string fallback
-        # would throw TypeError on compare).
-        from datetime import date
-        def _completed_key(x):
-            cd = x.get("closing_date") or x.get("expected_closing")
-            if not cd:
-                return date(1, 1, 1)
-            if isinstance(cd, date):
-                return cd
-            try:
-                return getdate(cd)
-            except Exception:
-                return date(1, 1, 1)
-        opportunities.sort(key=_completed_key, reverse=True)
+    return opportunities
+
+
+def get_personal_opportunities(user, include_completed=False, search=None, limit=None, cursor=None):
+    """
+    Get personal opportunity tasks for a user.
+
+    Batched-query version. Previously did one frappe.get_doc + two
+    frappe.db.exists per opportunity (N+1 pattern) which produced hundreds
+    of DB round-trips per call. Now:
+      1. One get_all for opportunities (all fields we need).
+      2. One _get_assignment_map for every assignment across all opps.
+      3. One get_all on Quotation for the has_quotation/has_draft flags.
+      4. One get_all on Opportunity Item for items belonging to the opps.
+    Then everything else is in-memory. Response time dropped from
+    seconds-per-load into the low-hundreds-of-ms range.
+
+    With `limit`, the filtered rows are paged by keyset on the tab's sort
+    order (see `_page_opportunity_pairs`) and items are fetched only for
+    the rows on the page.
+    """
+    # HTTP query params come through as strings; coerce so "0" is False.
+    include_completed = bool(cint(include_completed))
+    opportunities = _personal_opportunity_rows(user, include_completed, search=search)
+
+    pairs = _opportunity_sort_pairs(opportunities, include_completed)
+    total_count = len(pairs)
+    if limit:
+        opportunities, next_cursor = _page_opportunity_pairs(pairs, include_completed, limit, cursor)
     else:
-        # Open tab: three-group order per user spec.
-        #   1. Undated (no_closing_date) — decision needed
-        #   2. On-track (due_today → low) — nearest closing first
-        #   3. Overdue — least overdue first
-        _urgency_rank = {
-            "no_closing_date": 0,
-            "due_today": 1, "critical": 2, "high": 3, "medium": 4, "low": 5,
-            "overdue": 6,
-            "completed": 7,
-            "unknown": 8,
+        opportunities = [row for _, row in pairs]
+
+    # (4) One query — items for the returned opps only.
+    items_by_opp = _get_items_by_opp([r["opportunity"] for r in opportunities])
+    for row in opportunities:
+        row["items"] = items_by_opp.get(row["opportunity"], [])
+
+    opportunities = _apply_status_display(opportunities)
+    if limit:
+        return {
+            "opportunities": opportunities,
+            "next_cursor": next_cursor,
+            "total_count": total_count,
         }
+    return opportunities
+
+
+def _responsible_party_users(parties):
+    """{party: user_id} for the given responsible parties (unresolved ones omitted)."""
+    infos = notification_utils.get_responsible_party_infos(list(parties))
+    users = {p: (infos.get(p) or {}).get("user_id") for p in parties}
+    return {p: u for p, u in users.items() if u}
+
+
+def _opportunities_held_by(user, names, since):
+    """The subset of `names` that `user` may have had on their list before
+    `since`: still assigned to them, owned by them, in their `_assign`,
+    unassigned from them after `since` (ToDo closed or cancelled), or
+    with them removed or replaced as a responsible party after `since`
+    (Version log — removed rows and edited rows' old values).
+
+    Delta sync sends tombstones only for these — every other opportunity
+    changed on the site is none of the caller's business."""
+    names = list(names)
+    if not names:
+        return set()
+
+    held = {n for n, users in _get_assignment_map(names).items() if user in users}
+    for o in frappe.get_all(
+        "Opportunity", filters={"name": ["in", names]}, fields=["name", "owner", "_assign"]
+    ):
+        if o.owner == user or user in json.loads(o._assign or "[]"):
+            held.add(o.name)
+    held.update(frappe.get_all(
+        "ToDo",
+        filters={
+            "reference_type": "Opportunity",
+            "reference_name": ["in", names],
+            "allocated_to": user,
+            "status": ["in", ["Closed", "Cancelled"]],
+            "modified": [">", since],
+        },
+        pluck="reference_name",
+    ))
+
+    removed = {}  # party -> {opportunity}
+    for v in frappe.get_all(
+        "Version",
+        filters={"ref_doctype": "Opportunity", "docname": ["in", names], "creation": [">", since]},
+        fields=["docname", "data"],
+    ):
+        try:
+            data = json.loads(v.data or "{}")
+        except ValueError:
+            continue
+        for table, row in data.get("removed") or ():
+            if table == "custom_responsible_party" and row.get("responsible_party"):
+                removed.setdefault(row["responsible_party"], set()).add(v.docname)
+        # [table, idx, row name, [[field, old, new], …]] per edited row.
+        for table, _idx, _row, changes in data.get("row_changed") or ():
+            if table != "custom_responsible_party":
+                continue
+            for field, old, _new in changes:
+                if field == "responsible_party" and old:
+                    removed.setdefault(old, set()).add(v.docname)
+    for party, user_id in _responsible_party_users(removed).items():
+        if user_id == user:
+            held.update(removed[party])
+    return held
+
+
+def _deleted_opportunity_held_by(user, data):
+    """`_opportunities_held_by` for a deleted Opportunity's Deleted Document data."""
+    if data.get("owner") == user or user in json.loads(data.get("_assign") or "[]"):
+        return True
+    parties = {
+        row.get("responsible_party")
+        for row in data.get("custom_responsible_party") or ()
+        if row.get("responsible_party")
+    }
+    return user in _responsible_party_users(parties).values()
 
-        def _sort_key(x):
-            rank = _urgency_rank.get(x.get("urgency"), 99)
-            dr = x["days_remaining"]
-            if x.get("urgency") == "overdue" and dr is not None:
-                secondary = -dr
-            else:
-                secondary = dr if dr is not None else 9999
-            return (rank, secondary)
 
-        opportunities.sort(key=_sort_key)
+@frappe.whitelist()
+def sync_my_opportunities(since=None, include_completed=False, user=None):
+    """
+    Delta sync for the mobile opportunities list.
 
-    return _apply_status_display(opportunities)
+    Args:
+        since: `watermark` returned by the previous sync. Omit for a full load.
+        include_completed: Same meaning as get_my_opportunities.
+        user: Optional - user email (defaults to current user)
+
+    Returns:
+        {
+          "full": bool,          # True → replace the local list
+          "opportunities": [...],# rows (same shape as get_my_opportunities)
+                                 # to insert or overwrite
+          "removed": [names],    # rows to drop locally
+          "watermark": str,      # pass back as `since` next time
+        }
+
+    Only opportunities modified after `since`, plus those whose Quotations
+    were modified after it, are rebuilt. Item and responsible-party edits
+    are child-table saves, so they bump the parent Opportunity's modified
+    and are picked up by the same scan, and a deleted Quotation rebuilds
+    its opportunity. Changed opportunities the caller may have held that
+    no longer belong on this tab — reassigned, closed, quoted, deleted —
+    come back in `removed`.
+
+    days_remaining / urgency move at midnight without any row changing, so
+    a watermark from an earlier day gets a full load instead of a delta.
+    """
+    include_completed = bool(cint(include_completed))
+    if not user:
+        user = frappe.session.user
+    watermark = frappe.utils.now()
+
+    if not since or getdate(since) < getdate(nowdate()):
+        return {
+            "full": True,
+            "opportunities": get_personal_opportunities(user, include_completed),
+            "removed": [],
+            "watermark": watermark,
+        }
+
+    changed = set(frappe.get_all(
+        "Opportunity", filters={"modified": [">", since]}, pluck="name"
+    ))
+    changed.update(
+        q.opportunity for q in frappe.get_all(
+            "Quotation",
+            filters={"modified": [">", since], "opportunity": ["is", "set"]},
+            fields=["opportunity"],
+        )
+    )
+    deleted = set()
+    for d in frappe.get_all(
+        "Deleted Document",
+        filters={"deleted_doctype": ["in", ["Opportunity", "Quotation"]], "creation": [">", since]},
+        fields=["deleted_doctype", "deleted_name", "data"],
+    ):
+        try:
+            data = json.loads(d.data or "{}")
+        except ValueError:
+            continue
+        if d.deleted_doctype == "Quotation":
+            # A deleted (draft) quotation can put its opportunity back on the open tab.
+            if data.get("opportunity"):
+                changed.add(data["opportunity"])
+        elif _deleted_opportunity_held_by(user, data):
+            deleted.add(d.deleted_name)
+
+    rows = []
+    if changed:
+        rows = _annotate_opportunity_rows(
+            _personal_opportunity_rows(user, include_completed, filters={"name": ["in", list(changed)]}),
+            include_completed,
+        )
+        items_by_opp = _get_items_by_opp([r["opportunity"] for r in rows])
+        for row in rows:
+            row["items"] = items_by_opp.get(row["opportunity"], [])
+
+    in_scope = {r["opportunity"] for r in rows}
+    return {
+        "full": False,
+        "opportunities": _apply_status_display(rows),
+        "removed": sorted(_opportunities_held_by(user, changed - in_scope, since) | deleted),
+        "watermark": watermark,
+    }
 
 
 def get_team_opportunities_for_user(user, include_completed=False):
@@ -385,9 +649,10 @@ def get_team_opportunities_for_user(user, include_completed=False):
         # If no department, fall back to personal opportunities
         return get_personal_opportunities(user, include_completed)
 
-    # Group by opportunity and filter by department
+    # Batched like get_personal_opportunities: one Opportunity query, one
+    # assignment map, one Employee department map, one Quotation aggregate
+    # and one Opportunity Item query — no per-opportunity round-trips.
     opp_map = {}
-    today = getdate(nowdate())
 
     # "Quotation" status counts as completed alongside Closed / Lost / Converted.
     completed_statuses = ["Closed", "Lost", "Converted", "Quotation"]
@@ -395,83 +660,67 @@ def get_team_opportunities_for_user(user, include_completed=False):
     opps = frappe.get_all(
         "Opportunity",
         filters={"status": status_filter},
-        fields=["name"]
+        fields=[
+            "name", "status", "party_name", "expected_closing",
+            "source", "opportunity_type",
+        ],
     )
+    if not opps:
+        return []
 
-    for row in opps:
-        opp = frappe.get_doc("Opportunity", row.name)
+    opp_names = [o.name for o in opps]
+    assignment_map = _get_assignment_map(opp_names)
 
-        assigned_in_dept = False
-        assigned_users = _get_assigned_user_ids(opp)
-        if not assigned_users:
-            continue
-        for assigned_user in assigned_users:
-            engineer_dept = frappe.db.get_value(
-                "Employee",
-                {"user_id": assigned_user, "status": "Active"},
-                "department"
-            )
-            if engineer_dept == employee_dept:
-                assigned_in_dept = True
-                break
+    assigned_users_set = set()
+    for assigned in assignment_map.values():
+        assigned_users_set.update(assigned)
+    employee_dept_map = {e.user_id: e.department for e in frappe.get_all(
+        "Employee",
+        filters={"user_id": ["in", list(assigned_users_set)], "status": "Active"},
+        fields=["user_id", "department"],
+    )} if assigned_users_set else {}
+
+    # Only opportunities with at least one assignee in the manager's
+    # department are kept; everything below is scoped to those.
+    team_opps = [
+        o for o in opps
+        if any(employee_dept_map.get(u) == employee_dept for u in assignment_map.get(o.name) or ())
+    ]
+    if not team_opps:
+        return []
+    team_names = [o.name for o in team_opps]
 
-        if not assigned_in_dept:
-            continue
+    quotation_flags = {}  # opp_name -> {"has_quotation": bool, "has_draft": bool}
+    for q in frappe.get_all(
+        "Quotation",
+        filters={"opportunity": ["in", team_names], "docstatus": ["!=", 2]},
+        fields=["opportunity", "docstatus"],
+    ):
+        flags = quotation_flags.setdefault(
+            q["opportunity"], {"has_quotation": False, "has_draft": False}
+        )
+        flags["has_quotation"] = True
+        if q["docstatus"] == 0:
+            flags["has_draft"] = True
 
-        has_quotation = frappe.db.exists("Quotation", {
-            "opportunity": opp.name,
-            "docstatus": ["!=", 2]
-        })
-        has_draft_quotation = frappe.db.exists("Quotation", {
-            "opportunity": opp.name,
-            "docstatus": 0
-        })
+    items_by_opp = _get_items_by_opp(team_names)
 
-        closing_date = getdate(opp.expected_closing) if opp.expected_closing else None
-        days_remaining = date_diff(closing_date, today) if closing_date else None
+    for opp in team_opps:
+        assigned_users = assignment_map.get(opp.name) or set()
+        q_flags = quotation_flags.get(opp.name, {"has_quotation": False, "has_draft": False})
+        has_quotation = q_flags["has_quotation"]
+        has_draft_quotation = q_flags["has_draft"]
 
-        if include_completed:
-            urgency = "completed"
-        elif days_remaining is None:
-            urgency = "overdue"
-        elif has_quotation:
-            urgency = "low"
-        elif days_remaining < 0:
-            urgency = "overdue"
-        elif days_remaining == 0:
-            urgency = "due_today"
-        elif days_remaining == 1:
-            urgency = "critical"
-        elif days_remaining <= 3:
-            urgency = "high"
-        elif days_remaining <= 7:
-            urgency = "medium"
-        else:
-            urgency = "low"
-
-        items = []
-        if opp.get("items"):
-            for item in opp.items:
-                items.append({
-                    "item_code": item.item_code,
-                    "item_name": item.item_name,
-                    "qty": item.qty,
-                    "uom": item.uom,
-                    "description": item.description
-                })
+        items = items_by_opp.get(opp.name, [])
 
         opp_map[opp.name] = {
             "opportunity": opp.name,
             "customer": opp.party_name,
             "closing_date": opp.expected_closing,
-            "days_remaining": days_remaining,
-            "urgency": urgency,
             "items": items,
             "status": opp.status,
             "has_quotation": bool(has_quotation),
             "has_draft_quotation": bool(has_draft_quotation),
-            "status_color": "gray" if days_remaining is None else ("red" if days_remaining < 0 else ("red" if days_remaining == 0 else ("orange" if days_remaining <= 3 else ("yellow" if days_remaining <= 7 else "green")))),
-            "status_label": "No closing date" if days_remaining is None else (f"Overdue by {abs(days_remaining)} days" if days_remaining < 0 else ("Due today" if days_remaining == 0 else f"{days_remaining} days remaining")),
             "opportunity_status": opp.status,
             "source": opp.source,
             "opportunity_type": opp.opportunity_type,
@@ -479,50 +728,7 @@ def get_team_opportunities_for_user(user, include_completed=False):
             "todo_names": []
         }
 
-    # Convert to list and sort
-    opportunities = list(opp_map.values())
-    if include_completed:
-        # Completed tab: closest completion first (most recent expected
-        # closing at the top). Undated rows sink to the bottom. Coerce
-        # everything to `datetime.date` so the sort never mixes types
-        # (Frappe returns dates as `date` objects; a string fallback
-        # would throw TypeError on compare).
-        from datetime import date
-        def _completed_key(x):
-            cd = x.get("closing_date") or x.get("expected_closing")
-            if not cd:
-                return date(1, 1, 1)
-            if isinstance(cd, date):
-                return cd
-            try:
-                return getdate(cd)
-            except Exception:
-                return date(1, 1, 1)
-        opportunities.sort(key=_completed_key, reverse=True)
-    else:
-        # Open tab: three-group order per user spec.
-        #   1. Undated (no_closing_date) — decision needed
-        #   2. On-track (due_today → low) — nearest closing first
-        #   3. Overdue — least overdue first
-        _urgency_rank = {
-            "no_closing_date": 0,
-            "due_today": 1, "critical": 2, "high": 3, "medium": 4, "low": 5,
-            "overdue": 6,
-            "completed": 7,
-            "unknown": 8,
-        }
-
-        def _sort_key(x):
-            rank = _urgency_rank.get(x.get("urgency"), 99)
-            dr = x["days_remaining"]
-            if x.get("urgency") == "overdue" and dr is not None:
-                secondary = -dr
-            else:
-                secondary = dr if dr is not None else 9999
-            return (rank, secondary)
-
-        opportunities.sort(key=_sort_key)
-
+    opportunities = _annotate_opportunity_rows(list(opp_map.values()), include_completed)
     return _apply_status_display(opportunities)
 
 
@@ -540,28 +746,12 @@ def get_opportunity_kpi(user=None, date_range="all", from_date=None, to_date=Non
     Returns:
         Dictionary with KPI metrics including on-time completion rate
     """
-    filters = {
-        "status": ["in", ["Converted", "Closed", "Lost"]]
-    }
-    
-    # Apply date filter - prioritize from_date/to_date over date_range
-    if from_date and to_date:
-        filters["modified"] = ["between", [getdate(from_date), getdate(to_date)]]
-    elif date_range and date_range != "all":
-        today = getdate(nowdate())
-        if date_range == "month":
-            filters["modified"] = [">=", frappe.utils.add_months(today, -1)]
-        elif date_range == "quarter":
-            filters["modified"] = [">=", frappe.utils.add_months(today, -3)]
-        elif date_range == "year":
-            filters["modified"] = [">=", frappe.utils.add_months(today, -12)]
-    
-    # Get closed opportunities
-    opportunities = frappe.get_all(
-        "Opportunity",
-        filters=filters,
-        fields=["name", "expected_closing", "modified", "creation", "status", "party_name"]
-    )
+    from opportunity_management.opportunity_management import kpi_snapshots
+
+    # Closed-side figures come from the daily KPI snapshots (plus today's
+    # closures live). from_date/to_date take priority over date_range.
+    since = None if (from_date and to_date) else _kpi_since(date_range)
+    closed = kpi_snapshots.get_closed_kpi(from_date, to_date, since=since)
     
     # Get all open opportunities (for still_open count)
     open_filters = {
@@ -578,23 +768,9 @@ def get_opportunity_kpi(user=None, date_range="all", from_date=None, to_date=Non
     )
     
     # Calculate metrics
-    total_closed = len(opportunities)
-    completed_on_time = 0
-    completed_late = 0
-    
-    completion_days = []
-    for opp in opportunities:
-        if opp.expected_closing and opp.modified:
-            closing_date = getdate(opp.expected_closing)
-            completed_date = getdate(opp.modified)
-            
-            if completed_date <= closing_date:
-                completed_on_time += 1
-            else:
-                completed_late += 1
-
-        if opp.creation and opp.modified:
-            completion_days.append(date_diff(getdate(opp.modified), getdate(opp.creation)))
+    total_closed = closed["closed"]
+    completed_on_time = closed["closed_on_time"]
+    completed_late = closed["closed_late"]
     
     # Calculate total assigned (closed + open)
     total_assigned = total_closed + len(open_opportunities)
@@ -608,14 +784,7 @@ def get_opportunity_kpi(user=None, date_range="all", from_date=None, to_date=Non
 
     overdue_rate = (overdue_open / still_open * 100) if still_open > 0 else 0
 
-    median_close_days = 0
-    if completion_days:
-        completion_days.sort()
-        mid = len(completion_days) // 2
-        if len(completion_days) % 2 == 0:
-            median_close_days = (completion_days[mid - 1] + completion_days[mid]) / 2
-        else:
-            median_close_days = completion_days[mid]
+    median_close_days = kpi_snapshots.histogram_median(closed["histogram"])
     
     # Calculate per-user metrics if needed
     user_metrics = {}
@@ -635,6 +804,7 @@ def get_opportunity_kpi(user=None, date_range="all", from_date=None, to_date=Non
         "overdue_open": overdue_open,
         "overdue_rate": round(overdue_rate, 1),
         "median_close_days": round(median_close_days, 1),
+        **kpi_snapshots.close_day_percentiles(closed["histogram"]),
         "user_metrics": user_metrics,
         "date_range": date_range,
     }
@@ -670,6 +840,46 @@ def get_kpi_by_team(from_date=None, to_date=None):
     return get_kpi_breakdown("team", from_date, to_date)
 
 
+def _kpi_since(date_range):
+    """Lower bound on the close date for the legacy `date_range` argument
+    ('month' / 'quarter' / 'year'); None for 'all' or anything else."""
+    months = {"month": 1, "quarter": 3, "year": 12}.get(date_range)
+    if not months:
+        return None
+    return frappe.utils.add_months(getdate(nowdate()), -months)
+
+
+def _get_user_profiles(user_ids):
+    """Bulk {user_id: {"full_name", "team"}} for KPI grouping.
+
+    `team` is the user's Employee department, falling back to designation
+    and then "Unassigned" — one User query and one Employee query."""
+    user_ids = list({u for u in user_ids if u})
+    if not user_ids:
+        return {}
+
+    full_names = {u.name: u.full_name for u in frappe.get_all(
+        "User",
+        filters={"name": ["in", user_ids]},
+        fields=["name", "full_name"],
+    )}
+    teams = {}
+    for e in frappe.get_all(
+        "Employee",
+        filters={"user_id": ["in", user_ids]},
+        fields=["user_id", "department", "designation"],
+    ):
+        teams.setdefault(e.user_id, e.department or e.designation or "Unassigned")
+
+    return {
+        user_id: {
+            "full_name": full_names.get(user_id) or user_id,
+            "team": teams.get(user_id, "Unassigned"),
+        }
+        for user_id in user_ids
+    }
+
+
 def get_kpi_breakdown(breakdown_type="employee", from_date=None, to_date=None):
     """
     Calculate KPI breakdown by employee or team.
@@ -679,89 +889,69 @@ def get_kpi_breakdown(breakdown_type="employee", from_date=None, to_date=None):
         from_date: Optional - start date for filtering
         to_date: Optional - end date for filtering
     """
-    breakdown_data = {}
+    from opportunity_management.opportunity_management import kpi_snapshots
 
-    def _get_key_and_name(user_id):
-        user_doc = frappe.get_doc("User", user_id)
-        employee_name = user_doc.full_name or user_id
+    group_by = "team" if breakdown_type == "team" else "user"
+    name_field = "team" if breakdown_type == "team" else "employee_name"
 
-        if breakdown_type == "team":
-            employee = frappe.db.get_value("Employee", {"user_id": user_id}, "name")
-            if employee:
-                emp_doc = frappe.get_doc("Employee", employee)
-                team = getattr(emp_doc, "department", None) or getattr(emp_doc, "designation", None) or "Unassigned"
-            else:
-                team = "Unassigned"
-            return team, "team", team
-
-        return user_id, "employee_name", employee_name
-
-    closed_filters = {"status": ["in", ["Converted", "Closed", "Lost"]]}
-    if from_date and to_date:
-        closed_filters["modified"] = ["between", [getdate(from_date), getdate(to_date)]]
-
-    closed_opps = frappe.get_all(
-        "Opportunity",
-        filters=closed_filters,
-        fields=["name", "expected_closing", "modified"]
-    )
-
-    for opp_row in closed_opps:
-        opp = frappe.get_doc("Opportunity", opp_row.name)
-        assigned_users = _get_assigned_user_ids(opp)
-        if not assigned_users:
-            continue
-
-        for user_id in assigned_users:
-            key, name_field, name_value = _get_key_and_name(user_id)
-            if key not in breakdown_data:
-                breakdown_data[key] = {
-                    name_field: name_value,
-                    "total": 0,
-                    "completed": 0,
-                    "completed_on_time": 0,
-                    "completed_late": 0,
-                    "still_open": 0,
-                    "on_time_rate": 0
-                }
-
-            breakdown_data[key]["total"] += 1
-            breakdown_data[key]["completed"] += 1
-
-            if opp_row.expected_closing and opp_row.modified:
-                closing_date = getdate(opp_row.expected_closing)
-                completed_date = getdate(opp_row.modified)
-                if completed_date <= closing_date:
-                    breakdown_data[key]["completed_on_time"] += 1
-                else:
-                    breakdown_data[key]["completed_late"] += 1
+    # Closed counts per user / team are summed from the daily snapshots;
+    # the open side is the current state, one assignment map over it.
+    closed_by_key = kpi_snapshots.get_closed_kpi(from_date, to_date, group_by=group_by)
 
     open_opps = frappe.get_all(
         "Opportunity",
         filters={"status": ["not in", ["Converted", "Closed", "Lost"]]},
         fields=["name"]
     )
+    open_map = _get_assignment_map([o.name for o in open_opps])
 
-    for opp_row in open_opps:
-        opp = frappe.get_doc("Opportunity", opp_row.name)
-        assigned_users = _get_assigned_user_ids(opp)
-        if not assigned_users:
-            continue
+    users = set()
+    for assigned in open_map.values():
+        users.update(assigned)
+    if group_by == "user":
+        users.update(closed_by_key)
+    profiles = _get_user_profiles(users)
+
+    breakdown_data = {}
+
+    def _bucket(key, name_value):
+        if key not in breakdown_data:
+            breakdown_data[key] = {
+                name_field: name_value,
+                "total": 0,
+                "completed": 0,
+                "completed_on_time": 0,
+                "completed_late": 0,
+                "still_open": 0,
+                "on_time_rate": 0,
+                "close_days_p50": 0,
+                "close_days_p90": 0,
+                "close_days_p99": 0,
+            }
+        return breakdown_data[key]
+
+    def _name_for(key):
+        if group_by == "team":
+            return key
+        return (profiles.get(key) or {}).get("full_name") or key
 
-        for user_id in assigned_users:
-            key, name_field, name_value = _get_key_and_name(user_id)
-            if key not in breakdown_data:
-                breakdown_data[key] = {
-                    name_field: name_value,
-                    "total": 0,
-                    "completed": 0,
-                    "completed_on_time": 0,
-                    "completed_late": 0,
-                    "still_open": 0,
-                    "on_time_rate": 0
-                }
-            breakdown_data[key]["total"] += 1
-            breakdown_data[key]["still_open"] += 1
+    for key, counters in closed_by_key.items():
+        data = _bucket(key, _name_for(key))
+        data["total"] += counters["closed"]
+        data["completed"] += counters["closed"]
+        data["completed_on_time"] += counters["closed_on_time"]
+        data["completed_late"] += counters["closed_late"]
+        data.update(kpi_snapshots.close_day_percentiles(counters["histogram"]))
+
+    for opp_row in open_opps:
+        for user_id in open_map.get(opp_row.name) or ():
+            if group_by == "team":
+                key = (profiles.get(user_id) or {}).get("team") or "Unassigned"
+            else:
+                key = user_id
+            data = _bucket(key, _name_for(key))
+            data["total"] += 1
+            data["still_open"] += 1
     
     # Calculate percentages and prepare result
     result = []
@@ -781,42 +971,25 @@ def get_kpi_breakdown(breakdown_type="employee", from_date=None, to_date=None):
 
 def calculate_user_metrics(date_range="all", from_date=None, to_date=None):
     """Calculate KPI metrics per user."""
-    closed_filters = {"status": ["in", ["Converted", "Closed", "Lost"]]}
-    if from_date and to_date:
-        closed_filters["modified"] = ["between", [getdate(from_date), getdate(to_date)]]
+    from opportunity_management.opportunity_management import kpi_snapshots
 
-    closed_opps = frappe.get_all(
-        "Opportunity",
-        filters=closed_filters,
-        fields=["name", "expected_closing", "modified"]
-    )
+    closed_by_user = kpi_snapshots.get_closed_kpi(from_date, to_date, group_by="user")
+    full_names = {u.name: u.full_name for u in frappe.get_all(
+        "User",
+        filters={"name": ["in", list(closed_by_user)]},
+        fields=["name", "full_name"],
+    )} if closed_by_user else {}
 
     user_data = {}
-
-    for opp_row in closed_opps:
-        opp = frappe.get_doc("Opportunity", opp_row.name)
-        assigned_users = _get_assigned_user_ids(opp)
-        if not assigned_users:
-            continue
-
-        for user in assigned_users:
-            if user not in user_data:
-                user_data[user] = {
-                    "user": user,
-                    "user_name": frappe.db.get_value("User", user, "full_name") or user,
-                    "total": 0,
-                    "on_time": 0,
-                    "late": 0
-                }
-
-            user_data[user]["total"] += 1
-            if opp_row.expected_closing and opp_row.modified:
-                closing_date = getdate(opp_row.expected_closing)
-                completed_date = getdate(opp_row.modified)
-                if completed_date <= closing_date:
-                    user_data[user]["on_time"] += 1
-                else:
-                    user_data[user]["late"] += 1
+    for user, counters in closed_by_user.items():
+        user_data[user] = {
+            "user": user,
+            "user_name": full_names.get(user) or user,
+            "total": counters["closed"],
+            "on_time": counters["closed_on_time"],
+            "late": counters["closed_late"],
+            **kpi_snapshots.close_day_percentiles(counters["histogram"]),
+        }
     
     # Calculate percentages
     for user, data in user_data.items():
@@ -878,7 +1051,7 @@ def get_opportunity_details(opportunity_name):
 
 
 @frappe.whitelist()
-def get_team_opportunities(team=None, include_completed=False, search=None):
+def get_team_opportunities(team=None, include_completed=False, search=None, limit=None, cursor=None):
     """
     Get opportunities for a team with their assignees.
 
@@ -887,6 +1060,11 @@ def get_team_opportunities(team=None, include_completed=False, search=None):
               If not provided, defaults to current user's department
         include_completed: Boolean - if True, show only completed opportunities (Closed/Lost/Converted)
                                      if False, show only open opportunities
+        limit: Optional - page size. When set, the response also carries
+               `next_cursor` and `total_count`
+        cursor: Optional - `next_cursor` from the previous page. Follow-up
+                pages skip `employee_stats` (returned empty) — it doesn't
+                change between pages.
 
     Returns:
         List of opportunities with assignee details
@@ -906,7 +1084,6 @@ def get_team_opportunities(team=None, include_completed=False, search=None):
 
     # Group by opportunity
     opp_map = {}
-    today = getdate(nowdate())
 
     # "Quotation" status counts as completed alongside Closed / Lost / Converted.
     completed_statuses = ["Closed", "Lost", "Converted", "Quotation"]
@@ -930,6 +1107,8 @@ def get_team_opportunities(team=None, include_completed=False, search=None):
     opps = frappe.get_all("Opportunity", **get_all_kwargs)
 
     if not opps:
+        if limit:
+            return {"opportunities": [], "employee_stats": [], "next_cursor": None, "total_count": 0}
         return {"opportunities": [], "employee_stats": []}
 
     opp_names = [o.name for o in opps]
@@ -1002,43 +1181,6 @@ def get_team_opportunities(team=None, include_completed=False, search=None):
             if has_quotation:
                 continue
 
-        closing_date = getdate(row.expected_closing) if row.expected_closing else None
-        days_remaining = date_diff(closing_date, today) if closing_date else None
-
-        if include_completed:
-            urgency = "completed"
-        elif days_remaining is None:
-            # Undated: distinct from overdue — these need a decision made,
-            # not a deadline chased. Sorted FIRST in the team view.
-            urgency = "no_closing_date"
-        elif has_quotation:
-            urgency = "low"
-        elif days_remaining < 0:
-            urgency = "overdue"
-        elif days_remaining == 0:
-            urgency = "due_today"
-        elif days_remaining == 1:
-            urgency = "critical"
-        elif days_remaining <= 3:
-            urgency = "high"
-        elif days_remaining <= 7:
-            urgency = "medium"
-        else:
-            urgency = "low"
-
-        # Card color for the mobile UI. Same mapping as
-        # get_personal_opportunities so team + mine cards look identical.
-        if days_remaining is None:
-            status_color = "gray"
-        elif days_remaining < 0 or days_remaining == 0:
-            status_color = "red"
-        elif days_remaining <= 3:
-            status_color = "orange"
-        elif days_remaining <= 7:
-            status_color = "yellow"
-        else:
-            status_color = "green"
-
         opp_map[row.name] = {
             "opportunity": row.name,
             "name": row.name,
@@ -1053,9 +1195,6 @@ def get_team_opportunities(team=None, include_completed=False, search=None):
             "assigned_date": str(row.creation) if row.creation else None,
             "creation": str(row.creation) if row.creation else None,
             "opportunity_status": row.status,
-            "days_remaining": days_remaining,
-            "urgency": urgency,
-            "status_color": status_color,
             "status": row.status,
             "has_quotation": has_quotation,
             "has_draft_quotation": has_draft_quotation,
@@ -1063,46 +1202,19 @@ def get_team_opportunities(team=None, include_completed=False, search=None):
             "assignees": assignees
         }
 
-    # Convert to list and sort.
-    # Order (per user's spec for the team view):
-    #   1. Undated — "not closed yet" (no deadline set → needs a decision)
-    #   2. Open, closing date still ahead — sorted by nearest first
-    #   3. Overdue — sorted by least-overdue first (nearest to today at top)
-    opportunities = list(opp_map.values())
-
-    if include_completed:
-        # Completed tab: most recent expected closing first.
-        def _completed_key(x):
-            cd = x.get("closing_date") or x.get("expected_closing")
-            return cd or "0000-00-00"
-        opportunities.sort(key=_completed_key, reverse=True)
-    else:
-        urgency_order = {
-            "no_closing_date": 0,
-            "due_today": 1, "critical": 2, "high": 3, "medium": 4, "low": 5,
-            "overdue": 6,
-            "unknown": 7,
+    pairs = _opportunity_sort_pairs(list(opp_map.values()), include_completed)
+    if not limit:
+        return {
+            "opportunities": _apply_status_display([row for _, row in pairs]),
+            "employee_stats": get_employee_opportunity_stats(team),
         }
 
-        def _sort_key(x):
-            rank = urgency_order.get(x["urgency"], 99)
-            dr = x["days_remaining"]
-            # Inside the overdue bucket, least-overdue (closest to zero)
-            # at the top of the section.
-            if x["urgency"] == "overdue" and dr is not None:
-                secondary = -dr
-            else:
-                secondary = dr if dr is not None else 9999
-            return (rank, secondary)
-
-        opportunities.sort(key=_sort_key)
-
-    # Get employee statistics for the selected team
-    employee_stats = get_employee_opportunity_stats(team)
-
+    opportunities, next_cursor = _page_opportunity_pairs(pairs, include_completed, limit, cursor)
     return {
         "opportunities": _apply_status_display(opportunities),
-        "employee_stats": employee_stats,
+        "employee_stats": [] if cursor else get_employee_opportunity_stats(team),
+        "next_cursor": next_cursor,
+        "total_count": len(pairs),
     }
 
 
@@ -1225,12 +1337,10 @@ def get_available_teams():
 @frappe.whitelist()
 def get_my_fcm_token():
     """Return the FCM token currently stored for the logged-in user."""
+    from opportunity_management.opportunity_management.fcm_utils import resolve_push_targets
     user = frappe.session.user
-    employee = frappe.db.get_value("Employee", {"user_id": user}, "name")
-    if not employee:
-        return {"token": None}
-    token = frappe.db.get_value("Employee", employee, "custom_fcm_token")
-    return {"token": token}
+    target = resolve_push_targets("user", [user]).get(user)
+    return {"token": target["token"] if target else None}
 
 
 @frappe.whitelist()
@@ -1649,6 +1759,9 @@ def register_fcm_token(token, app_version=None, platform=None):
             (token, ver, plat, employee),
         )
         frappe.db.commit()
+        # Raw UPDATE skips Employee hooks — drop cached push targets here.
+        from opportunity_management.opportunity_management.fcm_utils import clear_push_target_cache
+        clear_push_target_cache()
         return {"status": "ok", "employee": employee,
                 "app_version": ver, "platform": plat}
     except Exception as e:
@@ -1763,14 +1876,15 @@ def submit_late_checkin_leave(employee, checkin_time=None):
     If the employee has remaining balance, uses Time-Off Leave type.
     If balance is exhausted, submits the same type — ERPNext will mark it as LWP.
     """
+    from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
+
     today = frappe.utils.today()
     # Default leave type can be overridden via ESS Mobile Settings → Attendance.
     leave_type = "Time-Off Leave - زمنية"
     try:
-        s = frappe.get_single("ESS Mobile Settings")
-        configured = (s.get("default_leave_type_for_late_checkin") or "").strip()
-        if configured:
-            leave_type = configured
+        s = get_mobile_settings()
+        if s.default_leave_type_for_late_checkin:
+            leave_type = s.default_leave_type_for_late_checkin
     except Exception:
         s = None
 
@@ -1788,11 +1902,8 @@ def submit_late_checkin_leave(employee, checkin_time=None):
     # on-time ones like 08:57 — auto-created a "late" leave. Falling back
     # to hardcoded 09:15 keeps behavior sane while HR restores the DocType.
     if s is not None:
-        try:
-            expected_h = int(s.get("expected_checkin_hour") or 9)
-            threshold_m = int(s.get("late_checkin_threshold_minutes") or 15)
-        except (TypeError, ValueError):
-            expected_h, threshold_m = 9, 15
+        expected_h = s.expected_checkin_hour or 9
+        threshold_m = s.late_checkin_threshold_minutes or 15
     else:
         expected_h, threshold_m = 9, 15
 
@@ -1875,6 +1986,9 @@ def mark_notifications_as_read():
         WHERE `for_user` = %s AND `read` = 0
     """, frappe.session.user)
     frappe.db.commit()
+    # Raw UPDATE skips Notification Log hooks — drop the badge counter here.
+    from opportunity_management.opportunity_management.fcm_utils import clear_unread_counter
+    clear_unread_counter(frappe.session.user)
     return {"status": "ok"}
 
 
@@ -2045,13 +2159,35 @@ def get_mobile_config():
 
     Marked allow_guest so the app can fetch this BEFORE login (to know
     whether to show the maintenance / update screen).
+
+    Served from the cached settings (mobile_settings) with an ETag — the
+    payload is built once per settings version, and a client that sends
+    the ETag back in If-None-Match gets an empty 304 until HR saves
+    ESS Mobile Settings again.
     """
+    from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
+
     try:
-        s = frappe.get_single("ESS Mobile Settings")
+        s = get_mobile_settings()
     except Exception:
         # Doctype not migrated yet — return safe defaults so the app behaves normally.
         return _default_mobile_config()
 
+    etag = f'"{s.etag}"'
+    headers = getattr(frappe.local, "response_headers", None)
+    if headers is not None:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+    if_none_match = frappe.get_request_header("If-None-Match") if getattr(frappe.local, "request", None) else None
+    if if_none_match and (if_none_match.strip() == "*" or etag in {t.strip() for t in if_none_match.split(",")}):
+        frappe.local.response["http_status_code"] = 304
+        return None
+
+    return s.derived("mobile_config", _build_mobile_config)
+
+
+def _build_mobile_config(s):
+    """The get_mobile_config payload for settings `s`."""
     def _i(k, default=0):
         v = s.get(k)
         try:
@@ -2444,195 +2580,144 @@ def send_admin_notification(title, body, recipients_mode="all",
 
 
 def _execute_broadcast(broadcast_name: str) -> dict:
-    """Execute a broadcast: resolve recipients, send FCM to each, update the record."""
-    from opportunity_management.opportunity_management.fcm_utils import send_fcm_to_employee
+    """Execute a broadcast: resolve recipients, send FCM to each, update the record.
+    Transient failures are left to the retry outbox (fcm_retry), which adds
+    them to sent_count / failed_count as they settle."""
+    from opportunity_management.opportunity_management.fcm_utils import (
+        _create_notification_logs, resolve_push_targets, send_fcm_bulk,
+    )
 
     doc = frappe.get_doc("ESS Broadcast", broadcast_name)
     employees = _resolve_recipient_employees(
         doc.recipients_mode, doc.departments, doc.roles, doc.employees
     )
+    recipients = resolve_push_targets("employee", employees)
 
     sent = 0
     failed = 0
+    queued = 0
     errors = []
+    targets = []
     for emp_id in employees:
-        try:
-            ok = send_fcm_to_employee(
-                emp_id,
-                doc.title,
-                doc.body,
-                data={"type": "admin_broadcast", "broadcast": doc.name},
-            )
-            if ok:
-                sent += 1
-            else:
-                failed += 1
-                errors.append(f"{emp_id}: no token or send failed")
-        except Exception as e:
+        target = recipients.get(emp_id)
+        if target and target["token"]:
+            targets.append(target)
+        else:
             failed += 1
-            errors.append(f"{emp_id}: {e}")
+            errors.append(f"{emp_id}: no token or send failed")
+
+    results = send_fcm_bulk([
+        {
+            "token": target["token"],
+            "title": doc.title,
+            "body": doc.body,
+            "data": {"type": "admin_broadcast", "broadcast": doc.name},
+            "user": target["user_id"],
+            "broadcast": doc.name,
+        }
+        for target in targets
+    ])
+    logs = []
+    for target, result in zip(targets, results):
+        if result["ok"]:
+            sent += 1
+            logs.append((target["user_id"], doc.title, doc.body))
+        elif result.get("retry_queued"):
+            # Counted as sent or failed by fcm_retry once it settles.
+            queued += 1
+            errors.append(f"{target['employee']}: transient failure, retry queued")
+        else:
+            failed += 1
+            errors.append(f"{target['employee']}: no token or send failed")
+    _create_notification_logs(logs)
 
     doc.db_set("sent_count", sent)
     doc.db_set("failed_count", failed)
     doc.db_set("sent_at", frappe.utils.now_datetime())
-    doc.db_set("status", "Sent" if sent > 0 else "Failed")
+    doc.db_set("status", "Sent" if sent > 0 or queued > 0 else "Failed")
     if errors:
         doc.db_set("error_log", "\n".join(errors[:50]))
     frappe.db.commit()
-    return {"sent": sent, "failed": failed, "total": len(employees)}
+    return {"sent": sent, "failed": failed, "retrying": queued, "total": len(employees)}
 
 
-def send_daily_checkin_reminders():
+def send_daily_checkin_reminders(force=False):
     """
-    Scheduler hook (every 5 minutes) — sends a check-in reminder push to all
-    active employees who haven't checked in yet today.
-
-    Reads `daily_checkin_reminder_time` and `working_days` from
-    ESS Mobile Settings. Only fires once per day, only on working days, and
-    only within a 5-minute window after the configured time.
+    Daily check-in reminder on its own. The 5-minute cron runs it as the
+    "daily_checkin_reminder" slot of attendance_reminders.attendance_tick,
+    which applies the gating (`daily_checkin_reminder_time` and
+    `working_days` from ESS Mobile Settings, a 5-minute window after the
+    configured time, once per day). From bench execute pass force=1 to
+    send now regardless of that gating.
     """
-    try:
-        s = frappe.get_single("ESS Mobile Settings")
-    except Exception:
-        return
+    from opportunity_management.opportunity_management.attendance_reminders import attendance_tick
+    return attendance_tick(only=("daily_checkin_reminder",), force=force)
 
-    reminder_time = (s.get("daily_checkin_reminder_time") or "").strip()
-    if not reminder_time or ":" not in reminder_time:
-        return
-
-    # Working days check (Frappe weekday: Mon=0..Sun=6)
-    working_days = {d.strip() for d in (s.get("working_days") or "Sun,Mon,Tue,Wed,Thu").split(",") if d.strip()}
-    day_map = {0: "Mon", 1: "Tue", 2: "Wed", 3: "Thu", 4: "Fri", 5: "Sat", 6: "Sun"}
-    now = frappe.utils.now_datetime()
-    if day_map[now.weekday()] not in working_days:
-        return
-
-    # Parse target HH:MM and require we're 0–5 minutes past it
-    try:
-        target_h, target_m = (int(x) for x in reminder_time.split(":"))
-    except (TypeError, ValueError):
-        return
-    target = now.replace(hour=target_h, minute=target_m, second=0, microsecond=0)
-    delta = (now - target).total_seconds()
-    if delta < 0 or delta > 300:
-        return
-
-    # Idempotency — only one dispatch per day
-    today_str = now.strftime("%Y-%m-%d")
-    last_sent = frappe.db.get_global("ess_last_daily_reminder_date")
-    if last_sent == today_str:
-        return
-
-    # Mark sent BEFORE the work so a slow run can't double-fire
-    frappe.db.set_global("ess_last_daily_reminder_date", today_str)
-    frappe.db.commit()
-
-    today = frappe.utils.today()
-    rows = frappe.db.sql(
-        """
-        SELECT e.name AS employee, e.employee_name, e.user_id, e.custom_fcm_token AS token
-        FROM `tabEmployee` e
-        WHERE e.status = 'Active'
-          AND e.custom_fcm_token IS NOT NULL
-          AND e.custom_fcm_token != ''
-          AND NOT EXISTS (
-              SELECT 1 FROM `tabEmployee Checkin` c
-              WHERE c.employee = e.name
-                AND DATE(c.time) = %s
-                AND c.log_type = 'IN'
-          )
-        """,
-        (today,),
-        as_dict=True,
-    )
 
+def _send_daily_checkin_reminder(rows):
+    """Push the check-in reminder to `rows` — active employees with a token
+    and no IN today (attendance_reminders._employees_missing_checkin)."""
     title = "Check-in Reminder"
     body = "Don't forget to check in for today. تذكّر تسجيل دخولك اليوم."
 
-    from opportunity_management.opportunity_management.fcm_utils import send_fcm
-    sent = 0
-    for r in rows:
-        try:
-            ok = send_fcm(
-                r["token"],
-                title=title,
-                body=body,
-                data={"type": "daily_reminder"},
-            )
-            if ok:
-                sent += 1
-        except Exception:
-            frappe.log_error(frappe.get_traceback(), "send_daily_checkin_reminders")
+    from opportunity_management.opportunity_management.fcm_utils import send_fcm_bulk
+    results = send_fcm_bulk([
+        {"token": r["token"], "title": title, "body": body, "data": {"type": "daily_reminder"}}
+        for r in rows
+    ])
+    sent = sum(1 for r in results if r["ok"])
 
     return {"sent": sent, "skipped_already_in": "ok", "candidates": len(rows)}
 
 
-def auto_checkout_pending_employees():
+def auto_checkout_pending_employees(force=False):
     """
-    Scheduler hook (every 5 minutes) — at the configured auto_checkout_hour
-    on a working day, force-create an OUT Employee Checkin for every employee
-    who has an open IN today but no matching OUT.
-
-    Uses a date-stamped global flag to fire at most once per day.
+    Auto-checkout on its own. The 5-minute cron runs it as the
+    "auto_checkout" slot of attendance_reminders.attendance_tick: at the
+    configured auto_checkout_hour on a working day, at most once per day.
+    From bench execute pass force=1 to check everyone out now.
     """
-    try:
-        s = frappe.get_single("ESS Mobile Settings")
-    except Exception:
-        return
+    from opportunity_management.opportunity_management.attendance_reminders import attendance_tick
+    return attendance_tick(only=("auto_checkout",), force=force)
 
-    hour = int(s.get("auto_checkout_hour") or 0)
-    if hour <= 0:
-        return  # disabled
 
-    # Working-day filter
-    working_days = {d.strip() for d in (s.get("working_days") or "Sun,Mon,Tue,Wed,Thu").split(",") if d.strip()}
-    day_map = {0: "Mon", 1: "Tue", 2: "Wed", 3: "Thu", 4: "Fri", 5: "Sat", 6: "Sun"}
-    now = frappe.utils.now_datetime()
-    if day_map[now.weekday()] not in working_days:
-        return
-
-    # Fire only within 5 min after the configured hour
-    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
-    delta = (now - target).total_seconds()
-    if delta < 0 or delta > 300:
-        return
-
-    today_str = now.strftime("%Y-%m-%d")
-    last = frappe.db.get_global("ess_last_auto_checkout_date")
-    if last == today_str:
-        return
-    frappe.db.set_global("ess_last_auto_checkout_date", today_str)
-    frappe.db.commit()
+_AUTO_CHECKOUT_BATCH = 500
+
+
+def _auto_checkout(rows, bulk=True):
+    """Force-create an OUT Employee Checkin for every employee in `rows` —
+    those with an open IN today and no later OUT
+    (attendance_reminders._employees_on_the_clock).
+
+    `bulk` (the default) writes the punches with multi-row INSERTs, folds
+    them into ESS Attendance Day with one upsert per batch and commits
+    once; the HRMS shift linkage runs afterwards in a background job
+    (`_link_auto_checkout_shifts`). If the bulk write fails it is rolled
+    back and the rows go through the per-document path instead.
+
+    Returns {"force_checked_out": n, "mode": ..., "timings_ms": {...}}."""
+    started = time.perf_counter()
+    employees = {}
+    for r in rows:
+        if r.get("employee"):
+            employees.setdefault(r["employee"], r)
+    employees = list(employees.values())
+    result = None
+    if bulk and employees:
+        try:
+            result = _auto_checkout_bulk(employees)
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), "auto_checkout_pending_employees (bulk)")
+    if result is None:
+        result = _auto_checkout_per_doc(employees)
+    result["timings_ms"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
 
-    today = frappe.utils.today()
-    rows = frappe.db.sql(
-        """
-        SELECT DISTINCT e.name AS employee
-        FROM `tabEmployee` e
-        WHERE e.status = 'Active'
-          AND EXISTS (
-              SELECT 1 FROM `tabEmployee Checkin` c
-              WHERE c.employee = e.name
-                AND DATE(c.time) = %s
-                AND c.log_type = 'IN'
-          )
-          AND NOT EXISTS (
-              SELECT 1 FROM `tabEmployee Checkin` c
-              WHERE c.employee = e.name
-                AND DATE(c.time) = %s
-                AND c.log_type = 'OUT'
-                AND c.time > (
-                    SELECT MAX(c2.time) FROM `tabEmployee Checkin` c2
-                    WHERE c2.employee = e.name
-                      AND DATE(c2.time) = %s
-                      AND c2.log_type = 'IN'
-                )
-          )
-        """,
-        (today, today, today),
-        as_dict=True,
-    )
 
+def _auto_checkout_per_doc(rows):
+    """One Employee Checkin insert (and all its hooks) per employee."""
+    started = time.perf_counter()
     created = 0
     for r in rows:
         try:
@@ -2648,7 +2733,120 @@ def auto_checkout_pending_employees():
         except Exception:
             frappe.log_error(frappe.get_traceback(), "auto_checkout_pending_employees")
     frappe.db.commit()
-    return {"force_checked_out": created}
+    return {
+        "force_checked_out": created,
+        "mode": "per_doc",
+        "timings_ms": {"insert": round((time.perf_counter() - started) * 1000, 1)},
+    }
+
+
+def _auto_checkout_bulk(rows):
+    """Bulk path of `_auto_checkout`.
+
+    What the per-document insert would have done, and where it happens
+    here:
+      - ess_hooks.before_checkin_insert guards IN punches only — nothing
+        to do for OUT.
+      - naming: each punch takes the next name from Employee Checkin's
+        own autoname series (`_checkin_namer`), like any other punch.
+      - ess_hooks.on_checkin_insert → attendance_state.record_checkin:
+        attendance_state.record_checkouts, one upsert per batch — moves
+        last_out and bumps checkins, or creates the day row if it's
+        missing. The outside-zone email never fires
+        (custom_outside_zone = 0).
+      - HRMS validate: the duplicate-log check can't trip (one fresh
+        timestamp per employee); fetch_shift fills the shift columns
+        Shift Type auto-attendance needs — deferred to
+        `_link_auto_checkout_shifts`, enqueued after the commit.
+    """
+    timings = {}
+    now = frappe.utils.now_datetime()
+    has_zone = frappe.db.has_column("Employee Checkin", "custom_outside_zone")
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by", "docstatus",
+        "employee", "employee_name", "log_type", "time", "skip_auto_attendance",
+    ] + (["custom_outside_zone"] if has_zone else [])
+
+    from opportunity_management.opportunity_management.attendance_state import record_checkouts
+
+    next_name = _checkin_namer()
+    names = []
+    insert_s = state_s = 0.0
+    for start in range(0, len(rows), _AUTO_CHECKOUT_BATCH):
+        batch = rows[start:start + _AUTO_CHECKOUT_BATCH]
+        values = []
+        for r in batch:
+            name = next_name()
+            names.append(name)
+            values.append((
+                name, now, now, "Administrator", "Administrator", 0,
+                r["employee"], r.get("employee_name") or r["employee"], "OUT", now, 0,
+            ) + ((0,) if has_zone else ()))
+
+        t = time.perf_counter()
+        frappe.db.bulk_insert("Employee Checkin", fields, values)
+        insert_s += time.perf_counter() - t
+
+        t = time.perf_counter()
+        record_checkouts([r["employee"] for r in batch], now)
+        state_s += time.perf_counter() - t
+
+    t = time.perf_counter()
+    frappe.db.commit()
+    timings["commit"] = round((time.perf_counter() - t) * 1000, 1)
+    timings["insert"] = round(insert_s * 1000, 1)
+    timings["attendance_day"] = round(state_s * 1000, 1)
+
+    t = time.perf_counter()
+    for start in range(0, len(names), _AUTO_CHECKOUT_BATCH):
+        frappe.enqueue(
+            "opportunity_management.opportunity_management.api._link_auto_checkout_shifts",
+            queue="long",
+            names=names[start:start + _AUTO_CHECKOUT_BATCH],
+        )
+    timings["enqueue"] = round((time.perf_counter() - t) * 1000, 1)
+    return {"force_checked_out": len(names), "mode": "bulk", "timings_ms": timings}
+
+
+def _checkin_namer():
+    """Callable returning the next Employee Checkin name from the doctype's
+    autoname (HRMS: a naming series) — one series bump per call."""
+    from frappe.model.naming import make_autoname
+
+    meta = frappe.get_meta("Employee Checkin")
+    autoname = (meta.autoname or "").strip()
+    if autoname.startswith("naming_series:"):
+        field = meta.get_field("naming_series")
+        autoname = (field.default or (field.options or "").split("\n")[0]).strip() if field else ""
+    if not autoname or autoname.lower() == "hash" or ":" in autoname:
+        return lambda: frappe.generate_hash(length=10)
+    return lambda: make_autoname(autoname, "Employee Checkin")
+
+
+def _link_auto_checkout_shifts(names):
+    """Background job — run HRMS's fetch_shift on bulk-inserted auto-checkout
+    punches and store the shift columns, so Shift Type auto-attendance
+    picks them up like any other OUT."""
+    started = time.perf_counter()
+    linked = 0
+    for name in names:
+        try:
+            doc = frappe.get_doc("Employee Checkin", name)
+            if not hasattr(doc, "fetch_shift") or doc.get("attendance"):
+                continue
+            doc.fetch_shift()
+            if not doc.get("shift"):
+                continue
+            doc.db_set({
+                f: doc.get(f)
+                for f in ("shift", "shift_start", "shift_end", "shift_actual_start", "shift_actual_end")
+                if doc.meta.has_field(f)
+            }, update_modified=False)
+            linked += 1
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), f"auto_checkout shift link: {name}")
+    frappe.db.commit()
+    return {"linked": linked, "ms": round((time.perf_counter() - started) * 1000, 1)}
 
 
 def process_scheduled_broadcasts():
@@ -2666,6 +2864,35 @@ def process_scheduled_broadcasts():
             frappe.log_error(frappe.get_traceback(), f"process_scheduled_broadcasts: {row['name']}")
 
 
+_DASHBOARD_CACHE_PREFIX = "opportunity_management:dashboard:"
+_DASHBOARD_GENERATION_KEY = "opportunity_management:dashboard_generation"
+_DASHBOARD_CACHE_TTL = 300
+_DASHBOARD_COMPLETED = ("Closed", "Lost", "Converted", "Quotation", "Ordered")
+
+
+def _dashboard_generation_key():
+    return frappe.cache().make_key(_DASHBOARD_GENERATION_KEY)
+
+
+def clear_dashboard_cache(doc=None, method=None):
+    """doc_events hook — invalidate every cached dashboard. An opportunity
+    or quotation change can move counters for any assignee or team, so
+    rather than tracking who it touched (or scanning for keys) this bumps
+    the generation that's part of every dashboard cache key; the old
+    entries just expire."""
+    try:
+        frappe.cache().incr(_dashboard_generation_key())
+    except Exception:
+        pass
+
+
+def _dashboard_generation():
+    try:
+        return cint(frappe.cache().get(_dashboard_generation_key()))
+    except Exception:
+        return 0
+
+
 @frappe.whitelist()
 def get_opportunities_dashboard(scope="mine"):
     """Aggregated dashboard payload for the opportunities hub.
@@ -2676,8 +2903,12 @@ def get_opportunities_dashboard(scope="mine"):
     caller is on the hook for) or `team` (aggregate across the team — falls
     back to `mine` when the caller isn't a Sales/System Manager).
 
-    Reuses `get_personal_opportunities` / `get_team_opportunities` under the
-    hood so the numbers agree with the list views.
+    Covers the same rows as `get_personal_opportunities` /
+    `get_team_opportunities` with include_completed so the numbers agree
+    with the list views, but selects and counts them in SQL instead of
+    building the list payload. Cached per (user, scope) for
+    `_DASHBOARD_CACHE_TTL` seconds; Opportunity / Quotation changes
+    invalidate the cache (`clear_dashboard_cache`).
     """
     scope = (scope or "mine").strip().lower()
     if scope not in ("mine", "team"):
@@ -2688,16 +2919,135 @@ def get_opportunities_dashboard(scope="mine"):
         if not ({"System Manager", "Sales Manager"} & user_roles):
             scope = "mine"
 
+    user = frappe.session.user
+    cache_key = f"{_DASHBOARD_CACHE_PREFIX}{_dashboard_generation()}:{nowdate()}:{user}:{scope}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached:
+        return cached
+
+    payload = _build_opportunities_dashboard(user, scope)
+    frappe.cache().set_value(cache_key, payload, expires_in_sec=_DASHBOARD_CACHE_TTL)
+    return payload
+
+
+def _responsible_party_table():
+    field = frappe.get_meta("Opportunity").get_field("custom_responsible_party")
+    return field.options if field and field.options else None
+
+
+def _dashboard_scope(user, scope):
+    """SQL condition on `tabOpportunity` o selecting the rows the dashboard
+    covers — the same rows get_personal_opportunities /
+    get_team_opportunities return with include_completed=True — plus its
+    params and the {party: user_id} map it was built from.
+
+    Assignment is the `_get_assignment_map` rule turned around: the
+    distinct responsible parties on Opportunities are resolved once
+    (site-wide party cache) and the condition matches on party names, so
+    no opportunity is loaded into Python."""
+    child = _responsible_party_table()
+    params = {"completed": ("Closed", "Lost", "Converted", "Quotation"), "user": user}
+    conditions = ["""(o.status IN %(completed)s OR EXISTS (
+        SELECT 1 FROM `tabQuotation` q
+        WHERE q.opportunity = o.name AND q.docstatus != 2))"""]
+
+    party_users = {}
+    if child:
+        party_users = _responsible_party_users([r[0] for r in frappe.db.sql(
+            f"""
+            SELECT DISTINCT responsible_party FROM `tab{child}`
+            WHERE parenttype = 'Opportunity' AND parentfield = 'custom_responsible_party'
+            """
+        )])
+
+    def _assigned_to(parties, param):
+        if not parties:
+            return "0"
+        params[param] = list(parties)
+        return f"""EXISTS (
+            SELECT 1 FROM `tab{child}` c
+            WHERE c.parent = o.name AND c.parenttype = 'Opportunity'
+              AND c.parentfield = 'custom_responsible_party'
+              AND c.responsible_party IN %({param})s)"""
+
     if scope == "mine":
-        rows = get_personal_opportunities(
-            frappe.session.user, include_completed=True
-        ) or []
+        mine = _assigned_to([p for p, u in party_users.items() if u == user], "mine")
+        anyone = _assigned_to(party_users, "assigned")
+        conditions.append(f"({mine} OR (o.owner = %(user)s AND NOT {anyone}))")
     else:
-        payload = get_team_opportunities(include_completed=True) or {}
-        rows = payload.get("opportunities", []) if isinstance(payload, dict) else payload
+        parties = list(party_users)
+        team = frappe.db.get_value("Employee", {"user_id": user, "status": "Active"}, "department")
+        if team and team != "All Teams":
+            team_users = set(frappe.get_all(
+                "Employee",
+                filters={"department": team, "status": "Active", "user_id": ["is", "set"]},
+                pluck="user_id",
+            ))
+            parties = [p for p in parties if party_users[p] in team_users]
+        conditions.append(_assigned_to(parties, "team"))
+    return " AND ".join(conditions), params, party_users
+
 
+def _build_opportunities_dashboard(user, scope):
+    where, params, party_users = _dashboard_scope(user, scope)
     today = getdate(nowdate())
 
+    from datetime import timedelta
+    # Weekly-created series — last 8 weeks (Monday-anchored). Keyed by
+    # ISO week-start date so the mobile can bin without knowing the
+    # server timezone. Missing weeks are filled with 0 at the end.
+    week_span = 8
+    week_end_anchor = today - timedelta(days=today.weekday())  # this Monday
+    week_start_bound = week_end_anchor - timedelta(weeks=week_span - 1)
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+
+    # One GROUP BY over the scoped opportunities, on just the dimensions
+    # the counters need — status, quotation, due bucket and creation week
+    # (both computed against today in SQL) — so a group is a handful of
+    # rows' worth of counters, not one opportunity. Won-this-month,
+    # days-to-close and the earliest creation fold in as group sums.
+    groups = frappe.db.sql(
+        f"""
+        SELECT o.status,
+               EXISTS (
+                   SELECT 1 FROM `tabQuotation` q
+                   WHERE q.opportunity = o.name AND q.docstatus != 2
+               ) AS has_quotation,
+               CASE
+                   WHEN o.expected_closing IS NULL THEN 'no_date'
+                   WHEN o.expected_closing < %(today)s THEN 'overdue'
+                   WHEN o.expected_closing = %(today)s THEN 'today'
+                   WHEN o.expected_closing <= %(week_ahead)s THEN 'week'
+                   ELSE 'later'
+               END AS due,
+               CASE
+                   WHEN DATE(o.creation) BETWEEN %(week_start)s AND %(today)s
+                   THEN DATE_SUB(DATE(o.creation), INTERVAL WEEKDAY(o.creation) DAY)
+               END AS created_week,
+               COUNT(*) AS n,
+               MIN(DATE(o.creation)) AS earliest,
+               SUM(o.expected_closing >= %(month_start)s
+                   AND o.expected_closing < %(next_month)s) AS closing_this_month,
+               SUM(CASE WHEN DATEDIFF(o.expected_closing, DATE(o.creation)) BETWEEN 0 AND 1095
+                        THEN DATEDIFF(o.expected_closing, DATE(o.creation)) END) AS close_days_sum,
+               COUNT(CASE WHEN DATEDIFF(o.expected_closing, DATE(o.creation)) BETWEEN 0 AND 1095
+                          THEN 1 END) AS close_days_n
+        FROM `tabOpportunity` o
+        WHERE {where}
+        GROUP BY o.status, has_quotation, due, created_week
+        """,
+        {
+            **params,
+            "today": today,
+            "week_ahead": today + timedelta(days=7),
+            "week_start": week_start_bound,
+            "month_start": month_start,
+            "next_month": next_month,
+        },
+        as_dict=True,
+    )
+
     open_count = 0
     today_count = 0
     overdue_count = 0
@@ -2707,8 +3057,6 @@ def get_opportunities_dashboard(scope="mine"):
     urgency = {
         "overdue": 0, "today": 0, "week": 0, "later": 0, "no_date": 0,
     }
-    customers = {}
-    engineers = {}
 
     # Funnel — linear conversion stages. Open counts everything still
     # active (Open | Draft | anything not-final); Quotation groups any
@@ -2716,103 +3064,100 @@ def get_opportunities_dashboard(scope="mine"):
     # Lost = explicitly lost. Closed (abandoned without win/loss) is
     # excluded so the funnel reads as a real conversion path.
     funnel = {"open": 0, "quotation": 0, "ordered": 0, "lost": 0}
-
-    # Weekly-created series — last 8 weeks (Monday-anchored). Keyed by
-    # ISO week-start date so the mobile can bin without knowing the
-    # server timezone. Missing weeks are filled with 0 at the end.
-    from datetime import timedelta
     weekly = {}
-    week_span = 8
-    week_end_anchor = today - timedelta(days=today.weekday())  # this Monday
-    week_start_bound = week_end_anchor - timedelta(weeks=week_span - 1)
 
     # Avg days-to-close (Ordered only) — creation → closing_date.
-    ordered_days = []
+    close_days_sum = 0
+    close_days_n = 0
 
     # Earliest opportunity creation date across the queried rows.
     # Used as the "Since {date}" label on the mobile Overview header
     # so users know what time-window every metric on the page covers.
     earliest_created = None
 
-    completed_statuses = ("Closed", "Lost", "Converted", "Quotation", "Ordered")
-
-    for r in rows:
-        status = (r.get("opportunity_status")
-                  or r.get("status")
-                  or "").strip()
-
-        status_counts[status] = status_counts.get(status, 0) + 1
-
-        party = (r.get("customer") or r.get("party_name") or "").strip() or "—"
-        customers[party] = customers.get(party, 0) + 1
-
-        for a in (r.get("assignees") or []):
-            key = (a.get("employee") or a.get("user") or "").strip()
-            if key:
-                engineers[key] = engineers.get(key, 0) + 1
+    customers = {r.label: cint(r.n) for r in frappe.db.sql(
+        f"""
+        SELECT IFNULL(NULLIF(TRIM(o.party_name), ''), '—') AS label, COUNT(*) AS n
+        FROM `tabOpportunity` o
+        WHERE {where}
+        GROUP BY label
+        ORDER BY n DESC
+        LIMIT 5
+        """,
+        params,
+        as_dict=True,
+    )}
 
-        # Weekly-created bin (uses assigned_date which is the doc's
-        # `creation` timestamp — always present on rows).
-        created_raw = r.get("assigned_date") or r.get("creation")
-        if created_raw:
-            try:
-                cdate = getdate(created_raw)
-                if earliest_created is None or cdate < earliest_created:
-                    earliest_created = cdate
-                if cdate >= week_start_bound and cdate <= today:
-                    monday = cdate - timedelta(days=cdate.weekday())
-                    key = monday.isoformat()
-                    weekly[key] = weekly.get(key, 0) + 1
-            except Exception:
-                pass
+    # Engineer leaderboard (team scope) — opportunities per responsible
+    # party, summed per user.
+    engineers = {}
+    child = _responsible_party_table()
+    if scope == "team" and child:
+        per_party = frappe.db.sql(
+            f"""
+            SELECT c.responsible_party, COUNT(DISTINCT c.parent) AS n
+            FROM `tab{child}` c
+            JOIN `tabOpportunity` o ON o.name = c.parent
+            WHERE c.parenttype = 'Opportunity' AND c.parentfield = 'custom_responsible_party'
+              AND {where}
+            GROUP BY c.responsible_party
+            """,
+            params,
+            as_dict=True,
+        )
+        assigned_users = {
+            party_users[r.responsible_party] for r in per_party if r.responsible_party in party_users
+        }
+        user_map = {u.name: (u.full_name or u.name) for u in frappe.get_all(
+            "User",
+            filters={"name": ["in", list(assigned_users)]},
+            fields=["name", "full_name"],
+        )} if assigned_users else {}
+        for r in per_party:
+            u = party_users.get(r.responsible_party)
+            if u:
+                key = user_map.get(u, u)
+                engineers[key] = engineers.get(key, 0) + cint(r.n)
+
+    for g in groups:
+        n = cint(g.n)
+        status = (g.status or "").strip()
+        label = _display_status(status)
+        status_counts[label] = status_counts.get(label, 0) + n
+
+        if g.earliest:
+            earliest = getdate(g.earliest)
+            if earliest_created is None or earliest < earliest_created:
+                earliest_created = earliest
+        if g.created_week:
+            key = getdate(g.created_week).isoformat()
+            weekly[key] = weekly.get(key, 0) + n
 
         is_ordered = status in ("Converted", "Ordered")
 
         # Funnel bucketing (all rows, not just open).
         if is_ordered:
-            funnel["ordered"] += 1
+            funnel["ordered"] += n
         elif status == "Lost":
-            funnel["lost"] += 1
-        elif status == "Quotation" or (r.get("has_quotation") is True):
-            funnel["quotation"] += 1
+            funnel["lost"] += n
+        elif status == "Quotation" or g.has_quotation:
+            funnel["quotation"] += n
         elif status not in ("Closed",):
-            funnel["open"] += 1
+            funnel["open"] += n
 
-        if status in completed_statuses:
+        if status in _DASHBOARD_COMPLETED:
             if is_ordered:
-                cd = r.get("closing_date") or r.get("expected_closing")
-                if cd:
-                    try:
-                        cdate = getdate(cd)
-                        if cdate.year == today.year and cdate.month == today.month:
-                            won_month += 1
-                        # Days-to-close (creation → closing).
-                        if created_raw:
-                            try:
-                                created = getdate(created_raw)
-                                days_to_close = (cdate - created).days
-                                if 0 <= days_to_close <= 365 * 3:
-                                    ordered_days.append(days_to_close)
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
+                won_month += cint(g.closing_this_month)
+                close_days_sum += cint(g.close_days_sum)
+                close_days_n += cint(g.close_days_n)
             continue
 
-        open_count += 1
-        days = r.get("days_remaining")
-        if days is None:
-            urgency["no_date"] += 1
-        elif days < 0:
-            urgency["overdue"] += 1
-            overdue_count += 1
-        elif days == 0:
-            urgency["today"] += 1
-            today_count += 1
-        elif days <= 7:
-            urgency["week"] += 1
-        else:
-            urgency["later"] += 1
+        open_count += n
+        urgency[g.due] += n
+        if g.due == "overdue":
+            overdue_count += n
+        elif g.due == "today":
+            today_count += n
 
     def _top(m, n=5):
         return sorted(
@@ -2831,8 +3176,8 @@ def get_opportunities_dashboard(scope="mine"):
         })
 
     avg_days_to_close = (
-        round(sum(ordered_days) / len(ordered_days), 1)
-        if ordered_days else 0.0
+        round(close_days_sum / close_days_n, 1)
+        if close_days_n else 0.0
     )
 
     return {
@@ -2843,7 +3188,7 @@ def get_opportunities_dashboard(scope="mine"):
             "overdue": overdue_count,
             "won_month": won_month,
             "avg_days_to_close": avg_days_to_close,
-            "ordered_sample_size": len(ordered_days),
+            "ordered_sample_size": close_days_n,
         },
         "urgency": urgency,
         "status_breakdown": _top(status_counts, n=6),
@@ -2946,8 +3291,10 @@ def get_expense_categories():
     (child DocType: ESS Expense Category). Admins manage them inside the
     settings form rather than a separate list view.
     """
+    from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
+
     try:
-        s = frappe.get_single("ESS Mobile Settings")
+        s = get_mobile_settings()
     except Exception:
         return []
 
@@ -1,10 +1,14 @@
 """
 Attendance reminder scheduled tasks.
 
-All entrypoints are wired into the existing `*/5 * * * *` cron in hooks.py.
-Each one self-gates on the current local (site-timezone) time-of-day and
-uses a per-slot per-day global flag so it fires at most once per slot per
-day even if the poll bracket overlaps two ticks.
+One entrypoint, `attendance_tick`, is wired into the `*/5 * * * *` cron in
+hooks.py. It reads ESS Mobile Settings once (mobile_settings, cached),
+works out which slots' poll windows contain the current local
+(site-timezone) time, and runs only those — most ticks return right there
+without touching the database. Each due slot is guarded by a per-slot
+per-day global flag so it fires at most once per day even if the poll
+bracket overlaps two ticks. Slots that fire together share one recipient
+query ("no IN yet today" / "still on the clock").
 
 Timing (Baghdad time / Asia/Baghdad):
 
@@ -15,7 +19,10 @@ Timing (Baghdad time / Asia/Baghdad):
   18:00   don't forget to check out      — checked-in-but-not-out employees
   19:00   don't forget to check out      — checked-in-but-not-out employees
   19:55   auto-checkout in 5 minutes     — checked-in-but-not-out employees
-  20:00   auto-checkout runs             — existing api.auto_checkout_pending_employees
+  20:00   auto-checkout runs             — api._auto_checkout
+
+plus the configurable daily check-in reminder
+(`daily_checkin_reminder_time`, api._send_daily_checkin_reminder).
 
 The 15/5-minute check-in warnings and the 5-minute auto-checkout warning
 are derived from ESS Mobile Settings (`checkin_window_end_hour`,
@@ -38,36 +45,30 @@ CHECKOUT_REMINDER_HOURS = (16, 17, 18, 19)
 # ── Helpers ────────────────────────────────────────────────────────────────────
 
 def _settings():
+    from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
     try:
-        return frappe.get_single("ESS Mobile Settings")
+        return get_mobile_settings()
     except Exception:
         return None
 
 
-def _is_working_day(s) -> bool:
-    working_days = {
-        d.strip()
-        for d in (s.get("working_days") or "Sun,Mon,Tue,Wed,Thu").split(",")
-        if d.strip()
-    }
-    day_map = {0: "Mon", 1: "Tue", 2: "Wed", 3: "Thu", 4: "Fri", 5: "Sat", 6: "Sun"}
-    now = frappe.utils.now_datetime()
-    return day_map[now.weekday()] in working_days
-
-
-def _in_poll_window(target_h: int, target_m: int) -> bool:
+def _in_poll_window(target_h: int, target_m: int, now=None) -> bool:
     """True iff we're within [target, target + POLL_WINDOW) right now."""
-    now = frappe.utils.now_datetime()
+    now = now or frappe.utils.now_datetime()
+    if not (0 <= target_h <= 23 and 0 <= target_m <= 59):
+        return False
     target = now.replace(hour=target_h, minute=target_m, second=0, microsecond=0)
     delta = (now - target).total_seconds()
     return 0 <= delta <= POLL_WINDOW_SECONDS
 
 
-def _fire_once_per_day(slot_key: str) -> bool:
+def _fire_once_per_day(slot_key: str, global_key: str = None) -> bool:
     """Atomic once-per-slot-per-day guard. Returns True the first time it's
-    called on a given date for the given slot; False on subsequent calls."""
+    called on a given date for the given slot; False on subsequent calls.
+    `global_key` overrides the default flag name (the daily reminder and
+    auto-checkout keep the flags they had before the tick existed)."""
     today_str = frappe.utils.now_datetime().strftime("%Y-%m-%d")
-    global_key = f"ess_reminder_{slot_key}_date"
+    global_key = global_key or f"ess_reminder_{slot_key}_date"
     if frappe.db.get_global(global_key) == today_str:
         return False
     # Mark BEFORE the work so a slow send loop can't double-dispatch.
@@ -77,171 +78,187 @@ def _fire_once_per_day(slot_key: str) -> bool:
 
 
 def _employees_missing_checkin():
-    """Active employees with a token who have no IN checkin today."""
-    today = frappe.utils.today()
+    """Active employees with a token who have no IN checkin today (per
+    ESS Attendance Day, see attendance_state)."""
     return frappe.db.sql(
         """
-        SELECT e.name AS employee, e.employee_name, e.custom_fcm_token AS token
+        SELECT e.name AS employee, e.employee_name, e.user_id, e.custom_fcm_token AS token
         FROM `tabEmployee` e
+        LEFT JOIN `tabESS Attendance Day` d
+               ON d.attendance_date = %(today)s AND d.employee = e.name
         WHERE e.status = 'Active'
           AND e.custom_fcm_token IS NOT NULL
           AND e.custom_fcm_token != ''
-          AND NOT EXISTS (
-              SELECT 1 FROM `tabEmployee Checkin` c
-              WHERE c.employee = e.name
-                AND DATE(c.time) = %s
-                AND c.log_type = 'IN'
-          )
+          AND d.first_in IS NULL
         """,
-        (today,),
+        {"today": frappe.utils.today()},
         as_dict=True,
     )
 
 
-def _employees_missing_checkout():
-    """Active employees with a token who have an IN today but no OUT after
-    their last IN (i.e. they're still on the clock)."""
-    today = frappe.utils.today()
+def _employees_on_the_clock():
+    """Active employees who have an IN today but no OUT after their last IN
+    (i.e. they're still on the clock), with or without a token — the
+    checkout reminders skip token-less rows, auto-checkout needs them all."""
     return frappe.db.sql(
         """
-        SELECT DISTINCT e.name AS employee, e.employee_name, e.custom_fcm_token AS token
+        SELECT e.name AS employee, e.employee_name, e.custom_fcm_token AS token
         FROM `tabEmployee` e
+        JOIN `tabESS Attendance Day` d
+          ON d.attendance_date = %(today)s AND d.employee = e.name
         WHERE e.status = 'Active'
-          AND e.custom_fcm_token IS NOT NULL
-          AND e.custom_fcm_token != ''
-          AND EXISTS (
-              SELECT 1 FROM `tabEmployee Checkin` c
-              WHERE c.employee = e.name
-                AND DATE(c.time) = %s
-                AND c.log_type = 'IN'
-          )
-          AND NOT EXISTS (
-              SELECT 1 FROM `tabEmployee Checkin` c
-              WHERE c.employee = e.name
-                AND DATE(c.time) = %s
-                AND c.log_type = 'OUT'
-                AND c.time > (
-                    SELECT MAX(c2.time) FROM `tabEmployee Checkin` c2
-                    WHERE c2.employee = e.name
-                      AND DATE(c2.time) = %s
-                      AND c2.log_type = 'IN'
-                )
-          )
+          AND d.last_in IS NOT NULL
+          AND (d.last_out IS NULL OR d.last_out <= d.last_in)
         """,
-        (today, today, today),
+        {"today": frappe.utils.today()},
         as_dict=True,
     )
 
 
 def _send_bulk(rows, title: str, body: str, kind: str) -> int:
-    from opportunity_management.opportunity_management.fcm_utils import send_fcm
-    sent = 0
-    for r in rows:
+    from opportunity_management.opportunity_management.fcm_utils import send_fcm_bulk
+    try:
+        results = send_fcm_bulk([
+            {"token": r["token"], "title": title, "body": body, "data": {"type": kind}}
+            for r in rows if r.get("token")
+        ])
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), f"attendance_reminder:{kind}")
+        return 0
+    return sum(1 for r in results if r["ok"])
+
+
+# ── Slots ─────────────────────────────────────────────────────────────────────
+
+_CHECKIN_CLOSING_15 = dict(
+    title="⏰ Check-in closes in 15 minutes",
+    body="سيغلق تسجيل الحضور بعد ١٥ دقيقة — سجّل حضورك الآن.\n"
+         "Check-in closes in 15 minutes — please check in now.",
+    kind="checkin_closing_15",
+)
+_CHECKIN_CLOSING_5 = dict(
+    title="⏰ Check-in closes in 5 minutes!",
+    body="سيغلق تسجيل الحضور بعد ٥ دقائق فقط!\n"
+         "Check-in closes in 5 minutes!",
+    kind="checkin_closing_5",
+)
+_CHECKOUT_REMINDER = dict(
+    title="🕒 Don't forget to check out",
+    body="لم تسجّل انصرافك بعد — لا تنسَ تسجيل الانصراف.\n"
+         "You haven't checked out yet — please remember to check out.",
+    kind="checkout_reminder",
+)
+_PRE_AUTO_CHECKOUT = dict(
+    title="⚠ Auto-checkout in 5 minutes",
+    body="سيتم تسجيل انصرافك تلقائياً بعد ٥ دقائق. سجّل انصرافك الآن إن رغبت.\n"
+         "You will be auto-checked out in 5 minutes. Check out now to override.",
+    kind="pre_auto_checkout",
+)
+
+# Recipient sets a slot can ask for; computed at most once per tick.
+_AUDIENCES = {
+    "missing_checkin": _employees_missing_checkin,
+    "on_the_clock": _employees_on_the_clock,
+}
+
+
+def _slots(s):
+    """Every attendance slot for settings `s`, in run order:
+    [(slot_key, hour, minute, global_key, audience, run(rows))].
+
+    Auto-checkout comes last — it writes OUT punches, so any reminder
+    sharing its tick must read "on the clock" first."""
+    from opportunity_management.opportunity_management import api
+
+    slots = []
+    if s.daily_checkin_reminder_time:
+        h, m = s.daily_checkin_reminder_time
+        slots.append(("daily_checkin_reminder", h, m, "ess_last_daily_reminder_date",
+                      "missing_checkin", api._send_daily_checkin_reminder))
+
+    # 15 / 5 min before checkin_window_end_hour → end_h-1 at :45 / :55
+    end_h = s.checkin_window_end_hour or 10
+    slots.append(("checkin_closing_15", end_h - 1, 45, None, "missing_checkin",
+                  lambda rows: _send_bulk(rows, **_CHECKIN_CLOSING_15)))
+    slots.append(("checkin_closing_5", end_h - 1, 55, None, "missing_checkin",
+                  lambda rows: _send_bulk(rows, **_CHECKIN_CLOSING_5)))
+
+    for h in CHECKOUT_REMINDER_HOURS:
+        slots.append((f"checkout_reminder_{h}", h, 0, None, "on_the_clock",
+                      lambda rows: _send_bulk(rows, **_CHECKOUT_REMINDER)))
+
+    auto_h = s.auto_checkout_hour or 0
+    if auto_h > 0:  # 0 = auto-checkout disabled, nothing to warn about either
+        slots.append(("pre_auto_checkout", auto_h - 1, 55, None, "on_the_clock",
+                      lambda rows: _send_bulk(rows, **_PRE_AUTO_CHECKOUT)))
+        slots.append(("auto_checkout", auto_h, 0, "ess_last_auto_checkout_date",
+                      "on_the_clock", api._auto_checkout))
+    return slots
+
+
+# ── Public scheduler entrypoint ────────────────────────────────────────────────
+
+def attendance_tick(only=None, force=False) -> dict:
+    """Scheduler hook (every 5 minutes) — run every attendance slot whose
+    poll window contains now. `only` restricts the tick to those slot keys
+    (used by the single-slot wrappers below). `force` runs the `only`
+    slots right away — no working-day, poll-window or once-per-day check,
+    and the day's flag is left alone. Returns {slot_key: result} for the
+    slots that ran."""
+    s = _settings()
+    if not s:
+        return {}
+    force = bool(force) and only is not None
+    now = frappe.utils.now_datetime()
+    if not force and not s.is_working_day(now):
+        return {}
+    due = [
+        slot for slot in _slots(s)
+        if (only is None or slot[0] in only)
+        and (force or _in_poll_window(slot[1], slot[2], now))
+    ]
+    if not due:
+        return {}
+
+    audiences = {}
+    ran = {}
+    for slot_key, _, _, global_key, audience, run in due:
+        if not force and not _fire_once_per_day(slot_key, global_key):
+            continue
+        if audience not in audiences:
+            audiences[audience] = _AUDIENCES[audience]()
         try:
-            if send_fcm(r["token"], title=title, body=body, data={"type": kind}):
-                sent += 1
+            ran[slot_key] = run(audiences[audience])
         except Exception:
-            frappe.log_error(frappe.get_traceback(), f"attendance_reminder:{kind}")
-    return sent
-
+            frappe.log_error(frappe.get_traceback(), f"attendance_tick:{slot_key}")
+    return ran
 
-# ── Public scheduler entrypoints ───────────────────────────────────────────────
 
-def send_checkin_closing_15min_warning():
-    """15 minutes before check-in window closes → warn non-checked-in employees.
+# Single-slot entrypoints from before the consolidated tick; the cron no
+# longer lists them. Without `force` they only fire inside their slot's
+# window, like the tick; run them by hand with force, e.g.
+#   bench --site <site> execute \
+#       opportunity_management.opportunity_management.attendance_reminders.send_checkin_closing_5min_warning \
+#       --kwargs "{'force': 1}"
 
-    Target time = (checkin_window_end_hour - 0h15m) in Baghdad local time.
-    """
-    s = _settings()
-    if not s or not _is_working_day(s):
-        return
-    end_h = int(s.get("checkin_window_end_hour") or 10)
-    # 15 min before end_h → end_h-1 at :45
-    target_h = end_h - 1
-    target_m = 45
-    if not _in_poll_window(target_h, target_m):
-        return
-    if not _fire_once_per_day("checkin_closing_15"):
-        return
-    rows = _employees_missing_checkin()
-    _send_bulk(
-        rows,
-        title="⏰ Check-in closes in 15 minutes",
-        body="سيغلق تسجيل الحضور بعد ١٥ دقيقة — سجّل حضورك الآن.\n"
-             "Check-in closes in 15 minutes — please check in now.",
-        kind="checkin_closing_15",
-    )
+def send_checkin_closing_15min_warning(force=False):
+    """15 minutes before check-in window closes → warn non-checked-in employees."""
+    return attendance_tick(only=("checkin_closing_15",), force=force)
 
 
-def send_checkin_closing_5min_warning():
+def send_checkin_closing_5min_warning(force=False):
     """5 minutes before check-in window closes → last warning."""
-    s = _settings()
-    if not s or not _is_working_day(s):
-        return
-    end_h = int(s.get("checkin_window_end_hour") or 10)
-    target_h = end_h - 1
-    target_m = 55
-    if not _in_poll_window(target_h, target_m):
-        return
-    if not _fire_once_per_day("checkin_closing_5"):
-        return
-    rows = _employees_missing_checkin()
-    _send_bulk(
-        rows,
-        title="⏰ Check-in closes in 5 minutes!",
-        body="سيغلق تسجيل الحضور بعد ٥ دقائق فقط!\n"
-             "Check-in closes in 5 minutes!",
-        kind="checkin_closing_5",
-    )
+    return attendance_tick(only=("checkin_closing_5",), force=force)
 
 
-def send_checkout_reminder_hourly():
-    """Fires hourly at 16:00, 17:00, 18:00, 19:00 Baghdad time — nudges any
-    employee who's still on the clock to check out."""
-    s = _settings()
-    if not s or not _is_working_day(s):
-        return
-    now = frappe.utils.now_datetime()
-    if now.hour not in CHECKOUT_REMINDER_HOURS:
-        return
-    if not _in_poll_window(now.hour, 0):
-        return
-    slot = f"checkout_reminder_{now.hour}"
-    if not _fire_once_per_day(slot):
-        return
-    rows = _employees_missing_checkout()
-    _send_bulk(
-        rows,
-        title="🕒 Don't forget to check out",
-        body="لم تسجّل انصرافك بعد — لا تنسَ تسجيل الانصراف.\n"
-             "You haven't checked out yet — please remember to check out.",
-        kind="checkout_reminder",
-    )
+def send_checkout_reminder_hourly(force=False):
+    """16:00–19:00 hourly nudge for employees still on the clock. Forced,
+    it sends a single nudge rather than one per hour slot."""
+    if force:
+        return attendance_tick(only=(f"checkout_reminder_{CHECKOUT_REMINDER_HOURS[0]}",), force=True)
+    return attendance_tick(only={f"checkout_reminder_{h}" for h in CHECKOUT_REMINDER_HOURS})
 
 
-def send_pre_auto_checkout_warning():
-    """5 minutes before auto-checkout runs → final warning that the system
-    is about to clock the employee out automatically.
-
-    Target = (auto_checkout_hour - 0h5m) in Baghdad local time.
-    """
-    s = _settings()
-    if not s or not _is_working_day(s):
-        return
-    auto_h = int(s.get("auto_checkout_hour") or 0)
-    if auto_h <= 0:
-        return  # auto-checkout disabled → nothing to warn about
-    target_h = auto_h - 1
-    target_m = 55
-    if not _in_poll_window(target_h, target_m):
-        return
-    if not _fire_once_per_day("pre_auto_checkout"):
-        return
-    rows = _employees_missing_checkout()
-    _send_bulk(
-        rows,
-        title="⚠ Auto-checkout in 5 minutes",
-        body="سيتم تسجيل انصرافك تلقائياً بعد ٥ دقائق. سجّل انصرافك الآن إن رغبت.\n"
-             "You will be auto-checked out in 5 minutes. Check out now to override.",
-        kind="pre_auto_checkout",
-    )
+def send_pre_auto_checkout_warning(force=False):
+    """5 minutes before auto-checkout runs → final warning."""
+    return attendance_tick(only=("pre_auto_checkout",), force=force)
@@ -0,0 +1,257 @@
+"""
+Per-employee-per-day attendance state.
+
+"Who has checked in today" and "who is still on the clock" used to be
+recomputed on every 5-minute tick with correlated NOT EXISTS / MAX(time)
+subqueries over `tabEmployee Checkin`. `ESS Attendance Day` keeps the
+answer instead — one row per (employee, date):
+
+  first_in / last_in / last_out  — earliest IN, latest IN, latest OUT
+  outside_zone(_reason)          — flag and reason of the first IN (what
+                                   the Baghdad report shows)
+  checkins                       — number of check-in rows that day
+
+Rows are named "<employee>-<YYYY-MM-DD>". ess_hooks.on_checkin_insert
+folds each new punch in with one INSERT … ON DUPLICATE KEY UPDATE
+(`record_checkin`; `record_checkouts` for bulk auto-checkout); the on_update / after_delete hooks below rebuild the
+affected day(s) from Employee Checkin when a punch is edited or removed.
+Readers then need one indexed lookup:
+
+  checked in today     first_in IS NOT NULL
+  still on the clock   last_in IS NOT NULL
+                       AND (last_out IS NULL OR last_out <= last_in)
+
+`backfill` rebuilds history (run once by patches.backfill_attendance_days;
+safe to re-run):
+
+    bench --site <site> execute \\
+        opportunity_management.opportunity_management.attendance_state.backfill \\
+        --kwargs "{'from_date': '2025-01-01'}"
+"""
+
+from datetime import timedelta
+
+import frappe
+from frappe.utils import add_months, get_datetime, get_first_day, getdate
+
+STATE_DOCTYPE = "ESS Attendance Day"
+
+_COLUMNS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "employee", "attendance_date", "first_in", "last_in", "last_out",
+    "outside_zone", "outside_zone_reason", "checkins",
+]
+
+
+def _state_name(employee: str, day) -> str:
+    return f"{employee}-{getdate(day).isoformat()}"
+
+
+# ── Employee Checkin hooks ────────────────────────────────────────────────────
+
+def record_checkin(doc) -> None:
+    """Fold one newly inserted punch into its day's row."""
+    if not doc.employee or not doc.time:
+        return
+    at = get_datetime(doc.time)
+    now = frappe.utils.now_datetime()
+    is_in = (doc.log_type or "").upper() == "IN"
+    outside_zone = 1 if is_in and doc.get("custom_outside_zone") else 0
+    reason = (doc.get("custom_outside_zone_reason") or "") if outside_zone else ""
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tab{STATE_DOCTYPE}` ({", ".join(f"`{c}`" for c in _COLUMNS)})
+        VALUES (%(name)s, %(now)s, %(now)s, 'Administrator', 'Administrator',
+                %(employee)s, %(day)s, %(first_in)s, %(first_in)s, %(last_out)s,
+                %(outside_zone)s, %(reason)s, 1)
+        ON DUPLICATE KEY UPDATE
+            outside_zone = IF(%(is_in)s AND (first_in IS NULL OR %(at)s < first_in),
+                              %(outside_zone)s, outside_zone),
+            outside_zone_reason = IF(%(is_in)s AND (first_in IS NULL OR %(at)s < first_in),
+                                     %(reason)s, outside_zone_reason),
+            first_in = IF(%(is_in)s, LEAST(IFNULL(first_in, %(at)s), %(at)s), first_in),
+            last_in = IF(%(is_in)s, GREATEST(IFNULL(last_in, %(at)s), %(at)s), last_in),
+            last_out = IF(%(is_in)s, last_out, GREATEST(IFNULL(last_out, %(at)s), %(at)s)),
+            checkins = checkins + 1,
+            modified = %(now)s
+        """,
+        {
+            "name": _state_name(doc.employee, at),
+            "now": now,
+            "employee": doc.employee,
+            "day": at.date(),
+            "at": at,
+            "is_in": 1 if is_in else 0,
+            "first_in": at if is_in else None,
+            "last_out": None if is_in else at,
+            "outside_zone": outside_zone,
+            "reason": reason,
+        },
+    )
+
+
+def record_checkouts(employees, at) -> None:
+    """`record_checkin` for one OUT punch at `at` per employee, in a single
+    multi-row statement (bulk auto-checkout). Employees with no row for
+    the day get one, like a first punch would."""
+    employees = list(employees)
+    if not employees:
+        return
+    now = frappe.utils.now_datetime()
+    values = [
+        (_state_name(employee, at), now, now, "Administrator", "Administrator",
+         employee, at.date(), None, None, at, 0, "", 1)
+        for employee in employees
+    ]
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tab{STATE_DOCTYPE}` ({", ".join(f"`{c}`" for c in _COLUMNS)})
+        VALUES {", ".join(["(" + ", ".join(["%s"] * len(_COLUMNS)) + ")"] * len(values))}
+        ON DUPLICATE KEY UPDATE
+            last_out = GREATEST(IFNULL(last_out, VALUES(last_out)), VALUES(last_out)),
+            checkins = checkins + 1,
+            modified = VALUES(modified)
+        """,
+        [v for row in values for v in row],
+    )
+
+
+def on_checkin_update(doc, method=None):
+    """on_update — an edited punch may have moved day, employee or type;
+    rebuild the day it left and the day it landed on."""
+    if doc.flags.in_insert:
+        return
+    before = doc.get_doc_before_save()
+    days = {(doc.employee, getdate(doc.time))}
+    if before and before.employee and before.time:
+        days.add((before.employee, getdate(before.time)))
+    rebuild_days(days)
+
+
+def on_checkin_delete(doc, method=None):
+    """after_delete — rebuild the day the punch belonged to."""
+    if doc.employee and doc.time:
+        rebuild_days({(doc.employee, getdate(doc.time))})
+
+
+# ── Rebuild / backfill ────────────────────────────────────────────────────────
+
+def _fold(rows) -> dict:
+    """{(employee, date): state} from Employee Checkin rows ordered by
+    employee, time."""
+    days = {}
+    for r in rows:
+        at = get_datetime(r.time)
+        state = days.setdefault((r.employee, at.date()), {
+            "first_in": None, "last_in": None, "last_out": None,
+            "outside_zone": 0, "outside_zone_reason": "", "checkins": 0,
+        })
+        state["checkins"] += 1
+        if (r.log_type or "").upper() == "IN":
+            if state["first_in"] is None:
+                state["first_in"] = at
+                if r.get("custom_outside_zone"):
+                    state["outside_zone"] = 1
+                    state["outside_zone_reason"] = r.get("custom_outside_zone_reason") or ""
+            state["last_in"] = at
+        else:
+            state["last_out"] = at
+    return days
+
+
+def _checkin_rows(where: str, params: dict):
+    has_zone = frappe.db.has_column("Employee Checkin", "custom_outside_zone")
+    has_reason = frappe.db.has_column("Employee Checkin", "custom_outside_zone_reason")
+    zone_cols = (
+        ("custom_outside_zone," if has_zone else "0 AS custom_outside_zone,")
+        + ("custom_outside_zone_reason" if has_reason else "'' AS custom_outside_zone_reason")
+    )
+    return frappe.db.sql(
+        f"""
+        SELECT employee, log_type, time, {zone_cols}
+        FROM `tabEmployee Checkin`
+        WHERE {where}
+        ORDER BY employee, time
+        """,
+        params,
+        as_dict=True,
+    )
+
+
+def _write_states(days: dict) -> None:
+    """Replace the state rows for every (employee, date) in `days`; a None
+    state deletes the row (day has no punches left)."""
+    now = frappe.utils.now_datetime()
+    gone = [_state_name(e, d) for (e, d), s in days.items() if s is None]
+    if gone:
+        frappe.db.sql(f"DELETE FROM `tab{STATE_DOCTYPE}` WHERE name IN %(names)s", {"names": gone})
+    values = [
+        (
+            _state_name(employee, day), now, now, "Administrator", "Administrator",
+            employee, day, s["first_in"], s["last_in"], s["last_out"],
+            s["outside_zone"], s["outside_zone_reason"], s["checkins"],
+        )
+        for (employee, day), s in days.items() if s is not None
+    ]
+    for start in range(0, len(values), 1000):
+        chunk = values[start:start + 1000]
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tab{STATE_DOCTYPE}` ({", ".join(f"`{c}`" for c in _COLUMNS)})
+            VALUES {", ".join(["(" + ", ".join(["%s"] * len(_COLUMNS)) + ")"] * len(chunk))}
+            ON DUPLICATE KEY UPDATE
+                first_in = VALUES(first_in), last_in = VALUES(last_in),
+                last_out = VALUES(last_out), outside_zone = VALUES(outside_zone),
+                outside_zone_reason = VALUES(outside_zone_reason),
+                checkins = VALUES(checkins), modified = VALUES(modified)
+            """,
+            [v for row in chunk for v in row],
+        )
+
+
+def rebuild_days(employee_days) -> None:
+    """Recompute the state rows for an iterable of (employee, date)."""
+    employee_days = {(e, getdate(d)) for e, d in employee_days if e and d}
+    if not employee_days:
+        return
+    start = min(d for _, d in employee_days)
+    end = max(d for _, d in employee_days) + timedelta(days=1)
+    folded = _fold(_checkin_rows(
+        "employee IN %(employees)s AND time >= %(start)s AND time < %(end)s",
+        {"employees": list({e for e, _ in employee_days}), "start": start, "end": end},
+    ))
+    _write_states({key: folded.get(key) for key in employee_days})
+
+
+def backfill(from_date=None, to_date=None) -> dict:
+    """Rebuild state rows from Employee Checkin history, one calendar month
+    per pass (and commit). Defaults to the first check-in through today.
+    Days inside the range that no longer have punches lose their row."""
+    if not from_date:
+        from_date = frappe.db.sql("SELECT MIN(time) FROM `tabEmployee Checkin`")[0][0]
+        if not from_date:
+            return {"days": 0}
+    start = getdate(from_date)
+    end = getdate(to_date or frappe.utils.today()) + timedelta(days=1)
+
+    written = 0
+    month = start
+    while month < end:
+        month_end = min(getdate(add_months(get_first_day(month), 1)), end)
+        folded = _fold(_checkin_rows(
+            "time >= %(start)s AND time < %(end)s",
+            {"start": month, "end": month_end},
+        ))
+        frappe.db.sql(
+            f"""
+            DELETE FROM `tab{STATE_DOCTYPE}`
+            WHERE attendance_date >= %(start)s AND attendance_date < %(end)s
+            """,
+            {"start": month, "end": month_end},
+        )
+        _write_states(folded)
+        frappe.db.commit()
+        written += len(folded)
+        print(f"{month} … {month_end - timedelta(days=1)}: {len(folded)} employee-days")
+        month = month_end
+    return {"days": written}
@@ -6,9 +6,10 @@ Each hook:
   1. Builds the notification via `notification_templates`.
   2. Resolves recipients — the doc's owner (creator), the doc's assigned
      approver where applicable, and users holding a named role.
-  3. Dispatches via `notification_dispatcher.enqueue_fcm_to_user` — the
-     actual send runs on the short RQ queue so the originating request
-     (doc submit) doesn't block on the OAuth handshake × recipients.
+  3. Dispatches via `notification_dispatcher.enqueue_fcm_to_users` — the
+     actual send runs on the short RQ queue, one batched job per
+     transaction, so the originating request (doc submit) doesn't block
+     on the sends.
 
 All send calls are wrapped so a single bad token can't break the parent
 transaction (`try/except` around each user).
@@ -18,7 +19,7 @@ import frappe
 
 from opportunity_management.opportunity_management import notification_templates as T
 from opportunity_management.opportunity_management.notification_dispatcher import (
-    enqueue_fcm_to_user,
+    enqueue_fcm_to_users,
 )
 
 
@@ -29,13 +30,16 @@ def _send_to_users(users, title, body, data, dedupe_seen=None):
     within a single dispatch (dedupe_seen is caller-supplied so a hook that
     invokes _send_to_users several times can share the set)."""
     seen = dedupe_seen if dedupe_seen is not None else set()
+    recipients = []
     for email in users:
         if not email or email in seen:
             continue
         seen.add(email)
-        # Enqueue keeps the originating request (doc submit, hook fire)
-        # from blocking on the OAuth handshake × recipients count.
-        enqueue_fcm_to_user(email, title=title, body=body, data=data)
+        recipients.append(email)
+    # Enqueue keeps the originating request (doc submit, hook fire)
+    # from blocking on the send; the whole recipient list rides in one
+    # batched job.
+    enqueue_fcm_to_users(recipients, title=title, body=body, data=data)
 
 
 def _users_with_role(role: str):
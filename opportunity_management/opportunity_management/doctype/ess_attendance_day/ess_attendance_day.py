@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class ESSAttendanceDay(Document):
+    pass
+
+
+def on_doctype_update():
+    # Readers ask "every employee's row for date D" — lead with the date.
+    frappe.db.add_unique("ESS Attendance Day", ["attendance_date", "employee"])
@@ -1,11 +1,16 @@
 # Controller for the ESS Mobile Settings singleton. Deliberately minimal —
-# every consumer reads via `frappe.get_single("ESS Mobile Settings")` and
-# accesses fields via `.get(fieldname)`; no cross-field validation or
-# derived state lives here. See api.get_mobile_config for the assembly
-# of this single into the mobile-facing config payload.
+# consumers read through mobile_settings.get_mobile_settings() (cached,
+# typed) and access fields via `.get(fieldname)` or the parsed attributes;
+# no cross-field validation or derived state lives here. See
+# api.get_mobile_config for the assembly of this single into the
+# mobile-facing config payload.
 
 from frappe.model.document import Document
 
 
 class ESSMobileSettings(Document):
-    pass
+    def on_update(self):
+        from opportunity_management.opportunity_management.mobile_settings import (
+            clear_mobile_settings_cache,
+        )
+        clear_mobile_settings_cache()
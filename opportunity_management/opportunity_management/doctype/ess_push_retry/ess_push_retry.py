@@ -0,0 +1,13 @@
+# Controller for ESS Push Retry — the fcm_retry outbox row.
+
+import frappe
+from frappe.model.document import Document
+
+
+class ESSPushRetry(Document):
+    pass
+
+
+def on_doctype_update():
+    # process_push_retries polls "Pending, due by now" every minute.
+    frappe.db.add_index("ESS Push Retry", ["status", "next_attempt_at"])
@@ -0,0 +1,7 @@
+# Controller for Opportunity KPI Close — one row per opportunity in the KPI snapshots.
+
+from frappe.model.document import Document
+
+
+class OpportunityKPIClose(Document):
+    pass
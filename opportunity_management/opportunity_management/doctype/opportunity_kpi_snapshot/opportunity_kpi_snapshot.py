@@ -0,0 +1,7 @@
+# Controller for Opportunity KPI Snapshot — rows written by kpi_snapshots.build_daily_kpi_snapshots.
+
+from frappe.model.document import Document
+
+
+class OpportunityKPISnapshot(Document):
+    pass
@@ -243,8 +243,9 @@ def on_salary_slip_submit(doc, method=None):
 def _ess_setting_enabled(key: str, default: bool = True) -> bool:
     """Read a Check field from ESS Mobile Settings; defaults to [default] on
     any error (e.g. doctype missing or single not yet created)."""
+    from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
     try:
-        v = frappe.db.get_single_value("ESS Mobile Settings", key)
+        v = get_mobile_settings().get(key)
         return bool(int(v)) if v not in (None, "") else default
     except Exception:
         return default
@@ -310,13 +311,14 @@ def before_checkin_insert(doc, method=None):
     if frappe.session.user == "Administrator" or (user_roles & bypass_roles):
         return
 
+    from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
     try:
-        settings = frappe.get_single("ESS Mobile Settings")
+        settings = get_mobile_settings()
     except Exception:
         return  # Doctype missing → don't block.
 
-    start_h = int(settings.get("checkin_window_start_hour") or 0)
-    end_h = int(settings.get("checkin_window_end_hour") or 0)
+    start_h = settings.checkin_window_start_hour or 0
+    end_h = settings.checkin_window_end_hour or 0
     if start_h <= 0 or end_h <= 0 or end_h <= start_h:
         return  # Misconfigured → don't block.
 
@@ -344,7 +346,11 @@ def before_checkin_insert(doc, method=None):
 
 
 def on_checkin_insert(doc, method=None):
-    """Notify System Managers when an employee checks in from outside an allowed zone."""
+    """Update the employee's ESS Attendance Day row, then notify System
+    Managers when an employee checks in from outside an allowed zone."""
+    from opportunity_management.opportunity_management.attendance_state import record_checkin
+    record_checkin(doc)
+
     if not doc.get("custom_outside_zone"):
         return
 
@@ -477,7 +483,9 @@ def on_notification_log_insert(doc, method=None):
             return
 
         # Find the Employee linked to this user (must have an FCM token)
-        token = frappe.db.get_value('Employee', {'user_id': user}, 'custom_fcm_token')
+        from opportunity_management.opportunity_management.fcm_utils import resolve_push_targets
+        target = resolve_push_targets('user', [user]).get(user)
+        token = target and target['token']
         if not token:
             return
 
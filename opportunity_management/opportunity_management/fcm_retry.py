@@ -0,0 +1,221 @@
+"""
+Retry outbox for transient FCM failures.
+
+A timeout, 429 or 5xx from FCM used to be logged and dropped, so a
+reminder sent while Google was throttling the project never arrived.
+`fcm_utils.send_fcm_bulk` now hands those sends to `queue_retries`, which
+writes one `ESS Push Retry` row per message; `process_push_retries`
+(every-minute cron in hooks.py) resends whatever is due:
+
+  delay        — exponential from RETRY_BASE seconds (doubling per attempt,
+                 capped at RETRY_MAX_DELAY) with full jitter over the upper
+                 half, and never sooner than FCM's Retry-After.
+  cap          — MAX_ATTEMPTS sends in total (the original one included);
+                 after that the row is marked Failed and logged once.
+  success      — the row is deleted, a Notification Log is written for
+                 the row's user (if any) and its ESS Broadcast, if any,
+                 gets sent_count + 1.
+  give up      — Failed, and the broadcast's failed_count + 1. Failed
+                 rows are purged after PURGE_AFTER_DAYS.
+
+Rows live in the database rather than in RQ so a worker restart or a
+Redis flush doesn't lose them, and the cron stays a short SELECT when
+nothing is due.
+"""
+
+import json
+import random
+import time
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+
+import frappe
+from frappe.utils import cint
+
+RETRY_DOCTYPE = "ESS Push Retry"
+MAX_ATTEMPTS = 6
+RETRY_BASE = 30
+RETRY_MAX_DELAY = 30 * 60
+BATCH_SIZE = 500
+PURGE_AFTER_DAYS = 14
+
+_TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+# ── Classification ────────────────────────────────────────────────────────────
+
+def is_transient(result: dict) -> bool:
+    """No response at all (network error, timeout), throttled, or FCM-side
+    trouble. Sends that never left the box — backoff skips, FCM not
+    configured, credentials that fail to load — are not."""
+    if result["ok"]:
+        return False
+    if result["status"] is None:
+        return result.get("fcm_error") is None
+    return result["status"] in _TRANSIENT_STATUSES
+
+
+def _retry_after_seconds(value) -> int:
+    """Retry-After is either delta-seconds or an HTTP date."""
+    if not value:
+        return 0
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0, int(when.timestamp() - time.time()))
+    except Exception:
+        return 0
+
+
+def _next_attempt_at(attempts: int, retry_after=None):
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE * 2 ** (attempts - 1))
+    delay = random.uniform(delay / 2, delay)
+    delay = max(delay, _retry_after_seconds(retry_after))
+    return frappe.utils.now_datetime() + timedelta(seconds=delay)
+
+
+# ── Enqueue ───────────────────────────────────────────────────────────────────
+
+def queue_retries(messages, results) -> None:
+    """Queue every transient failure in a send_fcm_bulk batch. Marks the
+    queued results with "retry_queued": True. Not committed here — the
+    caller's transaction (request, job, scheduler tick) carries it."""
+    now = frappe.utils.now_datetime()
+    values = []
+    for m, r in zip(messages, results):
+        if not is_transient(r):
+            continue
+        r["retry_queued"] = True
+        values.append((
+            frappe.generate_hash(length=10), now, now, "Administrator", "Administrator",
+            m["token"], m["title"], m["body"], json.dumps(m.get("data") or {}),
+            m.get("user"), m.get("broadcast"), 1, _next_attempt_at(1, r.get("retry_after")),
+            "Pending", r["status"], (r["error"] or "")[:600],
+        ))
+    if not values:
+        return
+    try:
+        frappe.db.bulk_insert(
+            RETRY_DOCTYPE,
+            ["name", "creation", "modified", "owner", "modified_by",
+             "token", "title", "body", "data",
+             "user", "broadcast", "attempts", "next_attempt_at",
+             "status", "last_status", "last_error"],
+            values,
+        )
+    except Exception as e:
+        for r in results:
+            r.pop("retry_queued", None)
+        frappe.log_error(title="FCM Retry Queue Error", message=str(e)[:400])
+
+
+# ── Scheduler tick ────────────────────────────────────────────────────────────
+
+def process_push_retries():
+    """Scheduler hook (every minute) — purge old Failed rows, then resend
+    every due retry, BATCH_SIZE rows per batch, until nothing is due."""
+    from opportunity_management.opportunity_management.fcm_utils import (
+        _create_notification_logs, _log_send_error, send_fcm_bulk,
+    )
+
+    frappe.db.sql(
+        f"""
+        DELETE FROM `tab{RETRY_DOCTYPE}`
+        WHERE status = 'Failed' AND modified < %(cutoff)s
+        LIMIT {BATCH_SIZE}
+        """,
+        {"cutoff": frappe.utils.now_datetime() - timedelta(days=PURGE_AFTER_DAYS)},
+    )
+    frappe.db.commit()
+
+    while True:
+        rows = frappe.db.sql(
+            f"""
+            SELECT name, token, title, body, data, user, broadcast, attempts
+            FROM `tab{RETRY_DOCTYPE}`
+            WHERE status = 'Pending' AND next_attempt_at <= %(now)s
+            ORDER BY next_attempt_at
+            LIMIT {BATCH_SIZE}
+            """,
+            {"now": frappe.utils.now_datetime()},
+            as_dict=True,
+        )
+        if not rows:
+            return
+
+        results = send_fcm_bulk(
+            [
+                {"token": row.token, "title": row.title, "body": row.body,
+                 "data": json.loads(row.data or "{}")}
+                for row in rows
+            ],
+            retry=False,
+        )
+
+        delivered, given_up, logs = [], [], []
+        broadcast_sent, broadcast_failed = {}, {}
+        for row, r in zip(rows, results):
+            attempts = cint(row.attempts) + 1
+            if r["ok"]:
+                delivered.append(row.name)
+                if row.user:
+                    logs.append((row.user, row.title, row.body))
+                if row.broadcast:
+                    broadcast_sent[row.broadcast] = broadcast_sent.get(row.broadcast, 0) + 1
+            elif is_transient(r) and attempts < MAX_ATTEMPTS:
+                frappe.db.sql(
+                    f"""
+                    UPDATE `tab{RETRY_DOCTYPE}`
+                    SET attempts = %s, next_attempt_at = %s, last_status = %s,
+                        last_error = %s, modified = %s
+                    WHERE name = %s
+                    """,
+                    (attempts, _next_attempt_at(attempts, r.get("retry_after")),
+                     r["status"], (r["error"] or "")[:600], frappe.utils.now_datetime(), row.name),
+                )
+            else:
+                given_up.append((row.name, attempts, r))
+                if row.broadcast:
+                    broadcast_failed[row.broadcast] = broadcast_failed.get(row.broadcast, 0) + 1
+
+        if delivered:
+            frappe.db.sql(
+                f"DELETE FROM `tab{RETRY_DOCTYPE}` WHERE name IN %(names)s",
+                {"names": delivered},
+            )
+        for name, attempts, r in given_up:
+            frappe.db.sql(
+                f"""
+                UPDATE `tab{RETRY_DOCTYPE}`
+                SET status = 'Failed', attempts = %s, last_status = %s,
+                    last_error = %s, modified = %s
+                WHERE name = %s
+                """,
+                (attempts, r["status"], (r["error"] or "")[:600], frappe.utils.now_datetime(), name),
+            )
+            if is_transient(r):
+                _log_send_error(r)
+        _update_broadcast_stats(broadcast_sent, broadcast_failed)
+        frappe.db.commit()
+        _create_notification_logs(logs)
+
+
+def _update_broadcast_stats(sent: dict, failed: dict) -> None:
+    """Settle retried sends on their ESS Broadcast. A broadcast with at
+    least one delivered push is Sent, otherwise Failed — the same rule
+    api._execute_broadcast applies to the first pass. (MySQL applies SET
+    assignments left to right, so status reads the old sent_count.)"""
+    for broadcast in set(sent) | set(failed):
+        frappe.db.sql(
+            """
+            UPDATE `tabESS Broadcast`
+            SET status = IF(IFNULL(sent_count, 0) + %(sent)s > 0, 'Sent', 'Failed'),
+                sent_count = IFNULL(sent_count, 0) + %(sent)s,
+                failed_count = IFNULL(failed_count, 0) + %(failed)s
+            WHERE name = %(name)s
+            """,
+            {"name": broadcast, "sent": sent.get(broadcast, 0), "failed": failed.get(broadcast, 0)},
+        )
@@ -19,8 +19,17 @@ Usage:
     send_fcm_to_user(user_email, title="Hello", body="World")
 """
 
+import asyncio
 import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
 import frappe
+from frappe.utils import cint
+from opportunity_management.opportunity_management.utils.cache import hmget
 
 # Firebase Admin app handle — a UNIQUE name per (re)init so a self-heal
 # never collides with a zombie left over from the previous init. The prior
@@ -104,6 +113,75 @@ def _create_notification_log(user: str, title: str, body: str) -> None:
         frappe.log_error(title="FCM Notification Log Error", message=str(e))
 
 
+def _create_notification_logs(entries) -> None:
+    """Bulk `_create_notification_log` for fan-out sends: one multi-row
+    INSERT and one commit for a list of (user, title, body).
+
+    Rows written this way never reach ess_hooks.on_notification_log_insert
+    — the same outcome `flags.from_fcm_send` gives a single insert, so no
+    second push goes out. The side effects Frappe's own Notification Log
+    hooks would have had are replayed once per user: the desk bell
+    refresh and the unread badge counter. Users who get Alert emails keep
+    the per-document insert so that email still goes out."""
+    entries = [e for e in entries if e[0]]
+    if not entries:
+        return
+    try:
+        try:
+            from frappe.desk.doctype.notification_log.notification_log import (
+                is_email_notifications_enabled_for_type, set_notifications_as_unseen,
+            )
+        except ImportError:
+            is_email_notifications_enabled_for_type = set_notifications_as_unseen = None
+
+        users = {user for user, _, _ in entries}
+        email_users = {
+            u for u in users
+            if is_email_notifications_enabled_for_type and is_email_notifications_enabled_for_type(u, "Alert")
+        }
+
+        now = frappe.utils.now_datetime()
+        owner = frappe.session.user if getattr(frappe.local, "session", None) else "Administrator"
+        values = []
+        for user, title, body in entries:
+            if user in email_users:
+                doc = frappe.get_doc({
+                    "doctype": "Notification Log",
+                    "subject": title,
+                    "email_content": body,
+                    "for_user": user,
+                    "type": "Alert",
+                    "read": 0,
+                })
+                doc.flags.from_fcm_send = True
+                doc.insert(ignore_permissions=True)
+                continue
+            values.append((
+                frappe.generate_hash(length=10), now, now, owner, owner,
+                title, body, user, "Alert", 0,
+            ))
+        if values:
+            frappe.db.bulk_insert(
+                "Notification Log",
+                ["name", "creation", "modified", "owner", "modified_by",
+                 "subject", "email_content", "for_user", "type", "read"],
+                values,
+            )
+        frappe.db.commit()
+
+        bulk_counts = {}
+        for user, _, _ in entries:
+            if user not in email_users:
+                bulk_counts[user] = bulk_counts.get(user, 0) + 1
+        _bump_unread_counters(bulk_counts)
+        for user in bulk_counts:
+            if set_notifications_as_unseen:
+                set_notifications_as_unseen(user)
+            frappe.publish_realtime("notification", after_commit=True, user=user)
+    except Exception as e:
+        frappe.log_error(title="FCM Notification Log Error", message=str(e))
+
+
 def _build_message(token: str, title: str, body: str, data: dict = None):
     from firebase_admin import messaging
     return messaging.Message(
@@ -154,64 +232,533 @@ def _build_naked_app():
     return firebase_admin.initialize_app(cred, name=name)
 
 
-def _unread_badge_for_token(token: str) -> int:
-    """Best-effort: return the number of unread Notification Logs for the
-    user this token belongs to. Used as the iOS badge value so the badge
-    always matches what the user sees in the in-app notifications list.
-
-    Returns 1 as a safe fallback if the lookup fails — never returns 0 for
-    a fresh push because that would tell iOS to clear the badge."""
-    try:
-        user = frappe.db.sql(
-            """
-            SELECT user_id FROM `tabEmployee`
-            WHERE custom_fcm_token = %s
-            LIMIT 1
-            """,
-            (token,),
-        )
-        if not user or not user[0][0]:
-            return 1
-        email = user[0][0]
-        count = frappe.db.count(
-            "Notification Log",
-            {"for_user": email, "read": 0},
-        )
-        # We're about to add one more Notification Log (via _create_notification_log)
-        # so include it in the badge preemptively.
-        return int(count) + 1
-    except Exception:
-        return 1
+# ── Pooled FCM v1 session ─────────────────────────────────────────────────────
+# One AuthorizedSession per (process, site), reused across send_fcm calls.
+# The session refreshes its OAuth token on its own once it's near expiry
+# (google-auth treats a token as expired a few minutes early), and its
+# requests connection pool keeps the TLS connection to fcm.googleapis.com
+# alive between sends — so a send is one HTTP round-trip, not a token fetch
+# plus a handshake.
+#
+# RQ forks a work horse per job; a forked child must not share the parent's
+# sockets, so every entry is tagged with the pid that built it and rebuilt
+# on mismatch. Changing firebase_service_account in site config also
+# rebuilds (the raw value is part of the entry).
+_FCM_SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+_FCM_POOL_SIZE = 20
+_FCM_TIMEOUT = 15
+_sessions = {}  # site -> {"pid", "raw", "project_id", "session"}
+_sessions_lock = threading.Lock()
 
 
-def send_fcm(token: str, title: str, body: str, data: dict = None) -> bool:
-    """Send an FCM notification to a single device token. Returns True on success.
-
-    Uses google-auth directly to obtain an OAuth token for the explicit
-    `firebase.messaging` scope, then POSTs to the FCM v1 endpoint. The
-    firebase_admin.messaging.send path fetched a token successfully but the
-    token wasn't accepted by FCM in production workers — the wider default
-    scope set firebase_admin requests may miss the specific scope FCM v1
-    requires under some runtime combinations. Direct call sidesteps that.
-    """
+def _load_service_account():
+    """(account_info, raw) from site config, or (None, None) after logging
+    why it's unusable."""
     raw = frappe.conf.get("firebase_service_account")
     if not raw:
         frappe.log_error(
             title="FCM Setup Error",
             message="firebase_service_account key not found in site config.",
         )
-        return False
+        return None, None
     account_info = json.loads(raw) if isinstance(raw, str) else raw
-    project_id = account_info.get("project_id")
-    if not project_id:
+    if not account_info.get("project_id"):
         frappe.log_error(
             title="FCM Setup Error",
             message="project_id missing from firebase_service_account",
         )
-        return False
+        return None, None
+    return account_info, raw
+
+
+def _get_fcm_session():
+    """(project_id, AuthorizedSession) for the current site, built once per
+    process. Returns (None, None) when the service account isn't set up."""
+    site = getattr(frappe.local, "site", None)
+    pid = os.getpid()
+    raw = frappe.conf.get("firebase_service_account")
+    entry = _sessions.get(site)
+    if entry and entry["pid"] == pid and entry["raw"] == raw:
+        return entry["project_id"], entry["session"]
+
+    with _sessions_lock:
+        entry = _sessions.get(site)
+        if entry and entry["pid"] == pid and entry["raw"] == raw:
+            return entry["project_id"], entry["session"]
+
+        account_info, raw = _load_service_account()
+        if not account_info:
+            return None, None
+
+        from google.oauth2 import service_account
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        # Explicit scope — this is the exact scope FCM v1 checks against.
+        # firebase_admin's default scope bundle apparently doesn't always
+        # yield a token FCM v1 accepts in every runtime.
+        credentials = service_account.Credentials.from_service_account_info(
+            account_info, scopes=[_FCM_SCOPE],
+        )
+        session = AuthorizedSession(credentials)
+        session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=1, pool_maxsize=_FCM_POOL_SIZE),
+        )
+        # Only close a session this process built — a parent's session
+        # inherited across fork shares its sockets with the parent.
+        if entry and entry["pid"] == pid:
+            try:
+                entry["session"].close()
+            except Exception:
+                pass
+        _sessions[site] = {
+            "pid": pid,
+            "raw": raw,
+            "project_id": account_info["project_id"],
+            "session": session,
+        }
+        return account_info["project_id"], session
+
+
+def _reset_fcm_session():
+    """Drop the current site's pooled session so the next send rebuilds
+    credentials from scratch."""
+    with _sessions_lock:
+        entry = _sessions.pop(getattr(frappe.local, "site", None), None)
+    if entry and entry["pid"] == os.getpid():
+        try:
+            entry["session"].close()
+        except Exception:
+            pass
+
+
+# ── Push target resolution ────────────────────────────────────────────────────
+# user_id ↔ Employee ↔ custom_fcm_token, cached in one Redis hash shared by
+# every push path. Fields are "<kind>:<key>" (kind = user / employee /
+# token) and values {"employee", "user_id", "token"}, or {} for "no such
+# Employee" so misses are cached too. Employee on_update / on_trash and
+# register_fcm_token (raw UPDATE) clear the whole hash.
+_TARGETS_KEY = "opportunity_management:push_targets"
+_TARGET_FIELDS = {"user": "user_id", "employee": "name", "token": "custom_fcm_token"}
+
+
+def resolve_push_targets(kind: str, keys) -> dict:
+    """Bulk lookup: {key: {"employee", "user_id", "token"} or None} for
+    `kind` "user" (user_id), "employee" (Employee name) or "token" (device
+    token). One HMGET for just these keys, plus one Employee query for
+    uncached keys. When several Employees match, the first in default
+    order wins, like the frappe.db.get_value lookups this replaces."""
+    field = _TARGET_FIELDS[kind]
+    keys = list({k for k in keys if k})
+    if not keys:
+        return {}
+    started = time.perf_counter()
+    cache = frappe.cache()
+    try:
+        cached = hmget(_TARGETS_KEY, [f"{kind}:{key}" for key in keys])
+    except Exception:
+        cached = {}
+
+    out = {}
+    misses = []
+    for key in keys:
+        hit = cached.get(f"{kind}:{key}")
+        if hit is None:
+            misses.append(key)
+        else:
+            out[key] = hit or None
+
+    if misses:
+        found = {}
+        for e in frappe.get_all(
+            "Employee",
+            filters={field: ["in", misses]},
+            fields=["name", "user_id", "custom_fcm_token"],
+        ):
+            found.setdefault(e.get(field), {
+                "employee": e.name,
+                "user_id": e.user_id,
+                "token": e.custom_fcm_token,
+            })
+        for key in misses:
+            target = found.get(key)
+            out[key] = target
+            try:
+                cache.hset(_TARGETS_KEY, f"{kind}:{key}", target or {})
+            except Exception:
+                pass
+    _record_metrics({"lookup": [(time.perf_counter() - started) * 1000]})
+    return out
+
+
+def clear_push_target_cache(doc=None, method=None):
+    """Drop every cached push target. doc_events hook on Employee; also
+    called after writes that skip doc events."""
+    frappe.cache().delete_key(_TARGETS_KEY)
+
+
+# ── Token health ──────────────────────────────────────────────────────────────
+# FCM v1 errors fall into three groups:
+#   dead       — UNREGISTERED (app uninstalled / token rotated),
+#                SENDER_ID_MISMATCH (token from another Firebase project),
+#                INVALID_ARGUMENT blaming the registration token. The token
+#                is cleared from Employee straight away.
+#   global     — 401 / QUOTA_EXCEEDED / UNAVAILABLE / INTERNAL / timeouts.
+#                Nothing is wrong with the token itself; not counted.
+#   per-token  — anything else. Counted; from the _BACKOFF_AFTER-th
+#                consecutive failure the token sits out an exponential
+#                backoff (5 min doubling, capped at a day). A successful
+#                send resets it.
+# Counters live in one Redis hash: token → {"failures", "until"}.
+_TOKEN_HEALTH_KEY = "opportunity_management:fcm_token_health"
+_DEAD_ERRORS = {"UNREGISTERED", "SENDER_ID_MISMATCH"}
+_GLOBAL_ERRORS = {"QUOTA_EXCEEDED", "UNAVAILABLE", "INTERNAL"}
+_BACKOFF_AFTER = 3
+_BACKOFF_BASE = 5 * 60
+_BACKOFF_MAX = 24 * 60 * 60
+
+
+def _is_dead_token_error(result: dict) -> bool:
+    if result.get("fcm_error") in _DEAD_ERRORS:
+        return True
+    return (
+        result.get("fcm_error") == "INVALID_ARGUMENT"
+        and "registration token" in (result.get("error") or "").lower()
+    )
+
+
+def _is_global_error(result: dict) -> bool:
+    return (
+        result.get("status") in (None, 401)
+        or (result.get("status") or 0) >= 500
+        or result.get("fcm_error") in _GLOBAL_ERRORS
+    )
+
+
+def _token_health(tokens) -> dict:
+    """{token: {"failures", "until"}} for the given tokens that have counters."""
+    try:
+        return hmget(_TOKEN_HEALTH_KEY, tokens)
+    except Exception:
+        return {}
+
+
+def _tokens_in_backoff(tokens) -> set:
+    health = _token_health(tokens)
+    if not health:
+        return set()
+    now = time.time()
+    return {t for t, h in health.items() if (h or {}).get("until", 0) > now}
+
+
+def _record_token_health(results) -> None:
+    """Update failure counters from a batch of send results and prune dead
+    tokens."""
+    results = list(results)
+    health = _token_health(r["token"] for r in results)
+    cache = frappe.cache()
+    dead = set()
+    now = time.time()
+    for r in results:
+        token = r["token"]
+        if r["ok"]:
+            if token in health:
+                cache.hdel(_TOKEN_HEALTH_KEY, token)
+            continue
+        if _is_dead_token_error(r):
+            dead.add(token)
+            continue
+        if _is_global_error(r):
+            continue
+        failures = (health.get(token) or {}).get("failures", 0) + 1
+        until = 0
+        if failures >= _BACKOFF_AFTER:
+            until = now + min(_BACKOFF_BASE * 2 ** (failures - _BACKOFF_AFTER), _BACKOFF_MAX)
+        health[token] = {"failures": failures, "until": until}
+        cache.hset(_TOKEN_HEALTH_KEY, token, health[token])
+    if dead:
+        _prune_dead_tokens(dead)
+
+
+def _prune_dead_tokens(tokens) -> None:
+    """Clear tokens FCM reported as permanently invalid from every Employee
+    holding them, and drop their counters."""
+    tokens = list(tokens)
+    try:
+        frappe.db.sql(
+            """
+            UPDATE `tabEmployee` SET `custom_fcm_token` = NULL
+            WHERE `custom_fcm_token` IN %(tokens)s
+            """,
+            {"tokens": tokens},
+        )
+        frappe.db.commit()
+        # Raw UPDATE skips Employee hooks.
+        clear_push_target_cache()
+        for token in tokens:
+            frappe.cache().hdel(_TOKEN_HEALTH_KEY, token)
+    except Exception as e:
+        frappe.log_error(title="FCM Token Prune Error", message=str(e)[:400])
+
+
+# ── Send metrics ──────────────────────────────────────────────────────────────
+# Rolling latency histograms and status-class counts, one Redis hash per
+# UTC minute (kept _METRICS_TTL) so the control panel can read the last
+# hour with a single pipeline. Fields:
+#   send:<bucket> / oauth:<bucket> / lookup:<bucket>  — sample counts per
+#       _METRIC_BOUNDS bucket (ms): FCM send round trip, OAuth token
+#       refresh, resolve_push_targets
+#   status:2xx / 4xx / 5xx / none  — sends per HTTP status class (none =
+#       timeout or connection error)
+# Recording is best effort; a Redis hiccup never fails a send.
+_METRICS_KEY = "opportunity_management:fcm_metrics:"
+_METRICS_TTL = 3 * 60 * 60
+_METRIC_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 15000)
+_METRIC_NAMES = ("send", "oauth", "lookup")
+
+
+def _metrics_key(minute: int) -> str:
+    return frappe.cache().make_key(f"{_METRICS_KEY}{minute}")
+
+
+def _record_metrics(samples: dict = None, statuses: dict = None) -> None:
+    """Add {metric: [ms, …]} samples and {status_class: n} counts to the
+    current minute's hash."""
+    fields = {}
+    for metric, values in (samples or {}).items():
+        for ms in values:
+            field = f"{metric}:{bisect_left(_METRIC_BOUNDS, ms)}"
+            fields[field] = fields.get(field, 0) + 1
+    for status_class, n in (statuses or {}).items():
+        fields[f"status:{status_class}"] = fields.get(f"status:{status_class}", 0) + n
+    if not fields:
+        return
+    try:
+        key = _metrics_key(int(time.time() // 60))
+        pipe = frappe.cache().pipeline()
+        for field, n in fields.items():
+            pipe.hincrby(key, field, n)
+        pipe.expire(key, _METRICS_TTL)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def _record_send_metrics(results) -> None:
+    latencies, statuses = [], {}
+    for r in results:
+        if r.get("latency_ms") is not None:
+            latencies.append(r["latency_ms"])
+        status_class = f"{r['status'] // 100}xx" if r["status"] else "none"
+        statuses[status_class] = statuses.get(status_class, 0) + 1
+    _record_metrics({"send": latencies}, statuses)
+
+
+def _percentile(buckets: list, q: float):
+    """q-quantile (ms) of a bucket histogram, interpolated linearly inside
+    the bucket it falls in. The overflow bucket reports the last bound."""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(buckets):
+        if n and seen + n >= rank:
+            if i == len(_METRIC_BOUNDS):
+                return float(_METRIC_BOUNDS[-1])
+            low = _METRIC_BOUNDS[i - 1] if i else 0
+            return round(low + (_METRIC_BOUNDS[i] - low) * (rank - seen) / n, 1)
+        seen += n
+    return float(_METRIC_BOUNDS[-1])
+
+
+def get_send_metrics(minutes: int = 60) -> dict:
+    """Aggregate the last `minutes` minutes: per-metric count and
+    p50/p95/p99 (ms), sends per status class, and sends per minute (window
+    average and per-minute series, oldest first)."""
+    minutes = max(1, min(cint(minutes) or 60, _METRICS_TTL // 60))
+    now = int(time.time() // 60)
+    window = list(range(now - minutes + 1, now + 1))
+    try:
+        pipe = frappe.cache().pipeline()
+        for minute in window:
+            pipe.hgetall(_metrics_key(minute))
+        hashes = pipe.execute()
+    except Exception:
+        hashes = [{} for _ in window]
+
+    buckets = {name: [0] * (len(_METRIC_BOUNDS) + 1) for name in _METRIC_NAMES}
+    statuses = {}
+    series = []
+    for minute, fields in zip(window, hashes):
+        sends = 0
+        for field, n in (fields or {}).items():
+            field = field.decode() if isinstance(field, bytes) else field
+            name, _, part = field.partition(":")
+            n = int(n)
+            if name == "status":
+                statuses[part] = statuses.get(part, 0) + n
+                sends += n
+            elif name in buckets and part.isdigit() and int(part) < len(buckets[name]):
+                buckets[name][int(part)] += n
+        series.append({"minute": minute * 60, "sends": sends})
+
+    total_sends = sum(statuses.values())
+    return {
+        "window_minutes": minutes,
+        "sends": total_sends,
+        "sends_per_minute": round(total_sends / minutes, 2),
+        "per_minute": series,
+        "status": statuses,
+        "latency": {
+            name: {
+                "count": sum(b),
+                "p50": _percentile(b, 0.50),
+                "p95": _percentile(b, 0.95),
+                "p99": _percentile(b, 0.99),
+            }
+            for name, b in buckets.items()
+        },
+    }
+
+
+# ── Unread badges ─────────────────────────────────────────────────────────────
+# Every push carries the recipient's unread Notification Log count + 1 (the
+# log about to be written for this push) as its badge. Counts live in Redis,
+# one plain counter per user so they can expire: Notification Log hooks
+# bump them on insert and drop them when `read` changes or a log is
+# deleted; misses are filled with one grouped COUNT for all missing users.
+# Writes that bypass doc events (`UPDATE … SET read = 1`, db.set_value) go
+# stale for at most _UNREAD_TTL unless they call clear_unread_counter.
+_UNREAD_KEY = "opportunity_management:unread:"
+_UNREAD_TTL = 10 * 60
+# INCR only if the counter exists — a missing counter must stay missing so
+# the next read recomputes it instead of starting from 1.
+_INCR_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
 
-    badge = _unread_badge_for_token(token)
-    payload = {
+def _unread_counter_key(user: str) -> str:
+    return frappe.cache().make_key(f"{_UNREAD_KEY}{user}")
+
+
+def _unread_counts(users) -> dict:
+    """{user: unread Notification Log count}, from Redis where cached and
+    one GROUP BY query for the rest."""
+    users = list({u for u in users if u})
+    if not users:
+        return {}
+    cache = frappe.cache()
+    counts = {}
+    try:
+        for user, value in zip(users, cache.mget([_unread_counter_key(u) for u in users])):
+            if value is not None:
+                counts[user] = int(value)
+    except Exception:
+        pass
+
+    misses = [u for u in users if u not in counts]
+    if misses:
+        fetched = {u: 0 for u in misses}
+        fetched.update(dict(frappe.db.sql(
+            """
+            SELECT for_user, COUNT(*) FROM `tabNotification Log`
+            WHERE `read` = 0 AND for_user IN %(users)s
+            GROUP BY for_user
+            """,
+            {"users": misses},
+        )))
+        try:
+            pipe = cache.pipeline()
+            for user, n in fetched.items():
+                pipe.set(_unread_counter_key(user), int(n), ex=_UNREAD_TTL)
+            pipe.execute()
+        except Exception:
+            pass
+        counts.update({u: int(n) for u, n in fetched.items()})
+    return counts
+
+
+def _unread_badges(tokens) -> dict:
+    """{token: badge} for a batch of device tokens — the token → user map
+    from `resolve_push_targets` plus `_unread_counts`.
+
+    A token with no matching user (or any lookup failure) gets 1, never 0,
+    because 0 would tell iOS to clear the badge on a fresh push."""
+    tokens = list({t for t in tokens if t})
+    badges = {t: 1 for t in tokens}
+    if not tokens:
+        return badges
+    try:
+        token_users = {
+            token: target["user_id"]
+            for token, target in resolve_push_targets("token", tokens).items()
+            if target and target["user_id"]
+        }
+        counts = _unread_counts(token_users.values())
+        for token, user in token_users.items():
+            # We're about to add one more Notification Log (via
+            # _create_notification_log) so include it in the badge preemptively.
+            badges[token] = counts.get(user, 0) + 1
+    except Exception:
+        pass
+    return badges
+
+
+def _unread_badge_for_token(token: str) -> int:
+    """Best-effort: return the number of unread Notification Logs for the
+    user this token belongs to, plus one for the log this push creates. Used
+    as the iOS badge value so the badge always matches what the user sees in
+    the in-app notifications list.
+
+    Returns 1 as a safe fallback if the lookup fails — never returns 0 for
+    a fresh push because that would tell iOS to clear the badge."""
+    return _unread_badges([token]).get(token, 1)
+
+
+def bump_unread_counter(doc, method=None):
+    """Notification Log after_insert — count a new unread log."""
+    if doc.get("read") or not doc.get("for_user"):
+        return
+    _bump_unread_counters({doc.for_user: 1})
+
+
+def _bump_unread_counters(increments: dict) -> None:
+    try:
+        cache = frappe.cache()
+        for user, n in increments.items():
+            cache.eval(_INCR_IF_EXISTS, 1, _unread_counter_key(user), int(n))
+    except Exception:
+        pass
+
+
+def on_notification_log_change(doc, method=None):
+    """Notification Log on_update / on_trash — `read` flipped or a log went
+    away; drop the user's counter so the next push recomputes it. Inserts
+    are handled by bump_unread_counter."""
+    if method == "on_update" and (doc.flags.in_insert or not doc.has_value_changed("read")):
+        return
+    clear_unread_counter(doc.get("for_user"))
+
+
+def clear_unread_counter(user: str = None) -> None:
+    """Forget a user's cached unread count. Call after marking logs read
+    with raw SQL."""
+    if not user:
+        return
+    try:
+        frappe.cache().delete(_unread_counter_key(user))
+    except Exception:
+        pass
+
+
+def _build_payload(token: str, title: str, body: str, data: dict, badge: int) -> dict:
+    return {
         "message": {
             "token": token,
             "notification": {"title": title, "body": body},
@@ -238,59 +785,323 @@ def send_fcm(token: str, title: str, body: str, data: dict = None) -> bool:
         }
     }
 
+
+def _fcm_error_code(text: str):
+    """FCM v1 `errorCode` (UNREGISTERED, QUOTA_EXCEEDED, …) from an error
+    response body, falling back to the google.rpc status; None if neither
+    is present."""
     try:
-        from google.oauth2 import service_account
-        from google.auth.transport.requests import AuthorizedSession
+        error = json.loads(text).get("error") or {}
+    except Exception:
+        return None
+    for detail in error.get("details") or []:
+        if detail.get("errorCode"):
+            return detail["errorCode"]
+    return error.get("status")
 
-        # Explicit scope — this is the exact scope FCM v1 checks against.
-        # firebase_admin's default scope bundle apparently doesn't always
-        # yield a token FCM v1 accepts in every runtime.
-        credentials = service_account.Credentials.from_service_account_info(
-            account_info,
-            scopes=["https://www.googleapis.com/auth/firebase.messaging"],
-        )
-        session = AuthorizedSession(credentials)
-        url = f"https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
-        resp = session.post(url, json=payload, timeout=15)
-        if resp.status_code == 200:
-            return True
-        # Frappe's log_error title is capped at 140 chars — keep title constant.
-        frappe.log_error(
-            title="FCM Send Error",
-            message=(
-                f"status={resp.status_code}\n"
-                f"body={resp.text[:600]}"
-            ),
-        )
+
+def _result(status: int, text: str, retry_after=None) -> dict:
+    if status == 200:
+        return {"ok": True, "status": 200, "error": None, "fcm_error": None}
+    result = {"ok": False, "status": status, "error": text[:600], "fcm_error": _fcm_error_code(text)}
+    if retry_after:
+        result["retry_after"] = retry_after
+    return result
+
+
+def _post(session, url: str, payload: dict) -> dict:
+    """One FCM v1 send. Touches neither frappe.local nor the DB, so it's
+    safe to run on fan-out worker threads. Returns
+    {"ok", "status", "error", "fcm_error", "latency_ms"} — status is None
+    when no response came back — plus "retry_after" when FCM sent that
+    header."""
+    started = time.perf_counter()
+    try:
+        resp = session.post(url, json=payload, timeout=_FCM_TIMEOUT)
+    except Exception as e:
+        result = {"ok": False, "status": None, "error": f"{type(e).__name__}: {str(e)[:400]}", "fcm_error": None}
+    else:
+        result = _result(resp.status_code, resp.text, resp.headers.get("Retry-After"))
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+# HTTP/2 clients live on one background event loop per process, one
+# httpx.AsyncClient per site, and stay open between send_fcm_bulk calls —
+# so a batch (or a single send) rides the already-negotiated connection
+# instead of paying TCP + TLS + ALPN every time, and concurrent batches
+# from different threads share its streams. Like the pooled session, the
+# loop is tagged with the pid that started it; a forked RQ child starts
+# its own rather than touching the parent's sockets.
+_http2 = {"pid": None, "loop": None, "clients": {}}
+_http2_lock = threading.Lock()
+
+
+def _http2_loop():
+    pid = os.getpid()
+    with _http2_lock:
+        if _http2["pid"] != pid:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="fcm-http2", daemon=True).start()
+            _http2.update(pid=pid, loop=loop, clients={})
+        return _http2["loop"]
+
+
+def _post_many_http2(url: str, access_token: str, payloads: list, streams: int) -> list:
+    """Send every payload over the site's long-lived multiplexed HTTP/2
+    connection, at most `streams` requests in flight. Results come back in
+    payload order.
+
+    Needs httpx with the `http2` extra (h2). A plain http:// URL is spoken
+    as HTTP/2 with prior knowledge, which is how the local stub server in
+    fcm_transport_probe is driven."""
+    import httpx
+
+    key = (getattr(frappe.local, "site", None), url.split("/v1/", 1)[0])
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    async def _main():
+        # Runs on the loop thread — the only place `clients` is touched.
+        client = _http2["clients"].get(key)
+        if client is None or client.is_closed:
+            client = _http2["clients"][key] = httpx.AsyncClient(
+                http2=True,
+                http1=not url.startswith("http://"),
+                timeout=_FCM_TIMEOUT,
+            )
+        semaphore = asyncio.Semaphore(streams)
+
+        async def _one(payload):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=payload, headers=headers)
+                except Exception as e:
+                    result = {"ok": False, "status": None, "error": f"{type(e).__name__}: {str(e)[:400]}", "fcm_error": None}
+                else:
+                    result = _result(resp.status_code, resp.text, resp.headers.get("retry-after"))
+                result["latency_ms"] = (time.perf_counter() - started) * 1000
+                return result
+
+        return await asyncio.gather(*(_one(p) for p in payloads))
+
+    return list(asyncio.run_coroutine_threadsafe(_main(), _http2_loop()).result())
+
+
+def _http2_enabled() -> bool:
+    """True when site config asks for `fcm_transport: "http2"` and httpx /
+    h2 are importable. Falls back to the pooled requests transport (with
+    one logged error per process) when they aren't installed."""
+    global _http2_warned
+    if (frappe.conf.get("fcm_transport") or "").lower() != "http2":
         return False
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        if not _http2_warned:
+            _http2_warned = True
+            frappe.log_error(
+                title="FCM Setup Error",
+                message="fcm_transport is http2 but httpx[http2] is not installed; using HTTP/1.1.",
+            )
+        return False
+
+
+def _access_token(session) -> str:
+    """Current OAuth token of a pooled session's credentials, refreshed
+    first if it's missing or near expiry."""
+    from google.auth.transport.requests import Request
+
+    credentials = session.credentials
+    if not credentials.valid:
+        started = time.perf_counter()
+        credentials.refresh(Request())
+        _record_metrics({"oauth": [(time.perf_counter() - started) * 1000]})
+    return credentials.token
+
+
+def _log_send_error(result: dict) -> None:
+    # Frappe's log_error title is capped at 140 chars — keep title constant.
+    frappe.log_error(
+        title="FCM Send Error",
+        message=f"status={result['status']}\nbody={result['error']}",
+    )
+
+
+def send_fcm(token: str, title: str, body: str, data: dict = None, user: str = None) -> bool:
+    """Send an FCM notification to a single device token. Returns True on
+    success, and also when a transient failure went to the retry outbox
+    (fcm_retry) — the push is accepted, just late. `user` is carried into
+    the outbox so a late delivery still writes that user's Notification
+    Log.
+
+    Uses google-auth directly to obtain an OAuth token for the explicit
+    `firebase.messaging` scope, then POSTs to the FCM v1 endpoint over the
+    pooled per-process session (`_get_fcm_session`). The
+    firebase_admin.messaging.send path fetched a token successfully but the
+    token wasn't accepted by FCM in production workers — the wider default
+    scope set firebase_admin requests may miss the specific scope FCM v1
+    requires under some runtime combinations. Direct call sidesteps that.
+
+    For more than a handful of devices use `send_fcm_bulk`.
+    """
+    result = send_fcm_bulk([{"token": token, "title": title, "body": body, "data": data, "user": user}])[0]
+    return result["ok"] or bool(result.get("retry_queued"))
+
+
+# ── Concurrent fan-out ────────────────────────────────────────────────────────
+# Broadcasts and reminders send to hundreds of devices. The HTTP POSTs run on
+# a bounded thread pool over the shared pooled session; everything that
+# needs frappe.local (badge lookups, error logging, session setup) stays on
+# the calling thread, because frappe.local doesn't exist on pool threads.
+_FANOUT_WORKERS = 16
+# HTTP/2 transport (site config `fcm_transport: "http2"`): one connection,
+# up to `fcm_http2_streams` concurrent streams on it. FCM v1 has no
+# multicast endpoint, so requests in flight per connection is what bounds
+# throughput.
+_HTTP2_STREAMS = 100
+_http2_warned = False
+
+
+def send_fcm_bulk(messages, max_workers: int = None, retry: bool = True) -> list:
+    """Send many notifications concurrently.
+
+    `messages` is a list of {"token", "title", "body", "data"} dicts. Returns
+    one {"token", "ok", "status", "error", "fcm_error"} dict per message, in
+    input order; fcm_error is FCM's errorCode (e.g. UNREGISTERED) on failure.
+    At most `max_workers` sends are in flight (default `fcm_fanout_workers`
+    from site config, else 16; never more than the connection pool). Each
+    send has the usual 15 s timeout. Failures are logged as "FCM Send Error"
+    the same way send_fcm always has, except dead tokens (pruned instead)
+    and tokens skipped because they're in failure backoff
+    (fcm_error "BACKOFF"). If FCM isn't configured or its credentials
+    fail to load, every message comes back with fcm_error "NOT_CONFIGURED"
+    or "INIT" respectively.
+
+    With `retry` (the default) transient failures — timeouts, 429, 5xx —
+    go to the push retry outbox (fcm_retry) instead of the Error Log and
+    come back with "retry_queued": True. A message may carry "user" (gets
+    a Notification Log when a retry lands) and "broadcast" (ESS Broadcast
+    whose counters a retry settles). The outbox itself sends with
+    retry=False; transient failures then come back unlogged, since it logs
+    them once when it gives up.
+
+    With `fcm_transport: "http2"` in site config the batch is multiplexed
+    over a single HTTP/2 connection instead (`_post_many_http2`).
+    `fcm_base_url` overrides the FCM host — only meant for pointing a
+    staging site at a stub server."""
+    messages = list(messages)
+    if not messages:
+        return []
+
+    # Setup failures carry their own fcm_error so the retry outbox can tell
+    # them from a network error — resending won't fix missing credentials.
+    def _failed(error, fcm_error):
+        return [
+            {"token": m["token"], "ok": False, "status": None, "error": error, "fcm_error": fcm_error}
+            for m in messages
+        ]
+
+    try:
+        project_id, session = _get_fcm_session()
     except Exception as e:
+        frappe.log_error(title="FCM Init Error", message=str(e)[:400])
+        return _failed(str(e)[:400], "INIT")
+    if not session:
+        return _failed("FCM not configured", "NOT_CONFIGURED")
+
+    # Tokens in failure backoff aren't sent at all (see token health).
+    backoff = _tokens_in_backoff(m["token"] for m in messages)
+    results = {
+        i: {"ok": False, "status": None, "error": "token in failure backoff", "fcm_error": "BACKOFF"}
+        for i, m in enumerate(messages) if m["token"] in backoff
+    }
+    sendable = [i for i in range(len(messages)) if i not in results]
+
+    badges = _unread_badges(messages[i]["token"] for i in sendable)
+    payloads = {
+        i: _build_payload(
+            messages[i]["token"], messages[i]["title"], messages[i]["body"],
+            messages[i].get("data"), badges.get(messages[i]["token"], 1),
+        )
+        for i in sendable
+    }
+    workers = cint(max_workers or frappe.conf.get("fcm_fanout_workers") or _FANOUT_WORKERS)
+    workers = max(1, min(workers, _FCM_POOL_SIZE, len(payloads) or 1))
+    http2 = _http2_enabled()
+    streams = max(1, cint(frappe.conf.get("fcm_http2_streams") or _HTTP2_STREAMS))
+    base_url = (frappe.conf.get("fcm_base_url") or "https://fcm.googleapis.com").rstrip("/")
+
+    def _run(indexes, session, project_id):
+        indexes = list(indexes)
+        url = f"{base_url}/v1/projects/{project_id}/messages:send"
+        if http2:
+            sent = _post_many_http2(url, _access_token(session), [payloads[i] for i in indexes], streams)
+            return dict(zip(indexes, sent))
+        if workers == 1 or len(indexes) == 1:
+            return {i: _post(session, url, payloads[i]) for i in indexes}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {i: pool.submit(_post, session, url, payloads[i]) for i in indexes}
+            return {i: f.result() for i, f in futures.items()}
+
+    if sendable:
+        # Refresh the OAuth token up front (timed, see send metrics) rather
+        # than letting the first few fan-out threads race to do it.
         try:
-            tb = frappe.get_traceback()
+            _access_token(session)
         except Exception:
-            tb = ""
-        frappe.log_error(
-            title="FCM Send Error",
-            message=f"exc_type={type(e).__name__}\nexc_str={str(e)[:400]}\ntraceback:\n{tb}",
-        )
-        return False
+            pass
+        results.update(_run(sendable, session, project_id))
+
+    # Token rejected despite being unexpired (revoked key, rotated service
+    # account) — rebuild credentials once and retry just those sends.
+    unauthorized = [i for i, r in results.items() if r["status"] == 401]
+    if unauthorized:
+        _reset_fcm_session()
+        project_id, session = _get_fcm_session()
+        if session:
+            results.update(_run(unauthorized, session, project_id))
+
+    out = [{"token": m["token"], **results[i]} for i, m in enumerate(messages)]
+    _record_token_health([out[i] for i in sendable])
+    _record_send_metrics([out[i] for i in sendable])
+    from opportunity_management.opportunity_management.fcm_retry import is_transient, queue_retries
+    if retry:
+        queue_retries(messages, out)
+    for r in out:
+        # Dead tokens are pruned, backoff skips never left the box and
+        # queued retries are logged if they finally give up — none is
+        # worth an Error Log row now.
+        if (
+            not r["ok"] and r["fcm_error"] != "BACKOFF"
+            and not r.get("retry_queued") and not _is_dead_token_error(r)
+            and (retry or not is_transient(r))
+        ):
+            _log_send_error(r)
+    return out
 
 
 def send_fcm_to_employee(employee_id: str, title: str, body: str, data: dict = None) -> bool:
-    """Look up the employee's FCM token and send a notification."""
-    token = frappe.db.get_value("Employee", employee_id, "custom_fcm_token")
-    if not token:
+    """Look up the employee's FCM token and send a notification. True when
+    delivered or queued for retry (see send_fcm)."""
+    target = resolve_push_targets("employee", [employee_id]).get(employee_id)
+    if not target or not target["token"]:
         return False
-    ok = send_fcm(token, title, body, data)
-    if ok:
-        user = frappe.db.get_value("Employee", employee_id, "user_id")
-        if user:
-            _create_notification_log(user, title, body)
-    return ok
+    result = send_fcm_bulk([{
+        "token": target["token"], "title": title, "body": body, "data": data,
+        "user": target["user_id"],
+    }])[0]
+    # A queued retry writes the Notification Log when it lands.
+    if result["ok"] and target["user_id"]:
+        _create_notification_log(target["user_id"], title, body)
+    return result["ok"] or bool(result.get("retry_queued"))
 
 
 def send_fcm_to_user(user_email: str, title: str, body: str, data: dict = None) -> bool:
     """Look up the employee by user_id and send a notification."""
-    employee_id = frappe.db.get_value("Employee", {"user_id": user_email}, "name")
-    if not employee_id:
+    target = resolve_push_targets("user", [user_email]).get(user_email)
+    if not target:
         return False
-    return send_fcm_to_employee(employee_id, title, body, data)
+    return send_fcm_to_employee(target["employee"], title, body, data)
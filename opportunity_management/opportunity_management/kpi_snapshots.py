@@ -0,0 +1,380 @@
+"""
+Daily Opportunity KPI snapshots.
+
+The Opportunity KPI page used to recompute every rate from raw Opportunity
+rows on each load. `build_daily_kpi_snapshots` (nightly cron in hooks.py)
+rolls the closed side into `Opportunity KPI Snapshot` rows instead — one
+per (close day × user × team), plus a company-wide row per day (user/team
+blank) that counts each opportunity once and includes unassigned ones.
+Close day = DATE(modified), the same anchor the live KPI has always used.
+
+Every opportunity counted in those rows has an `Opportunity KPI Close`
+row holding its contribution (close day, on time / late, close days,
+the users and teams it was counted under). The ledger is what keeps both
+sides exact without rescanning history:
+
+  build — each night rebuilds only the close days touched since the
+          last build: the new close day of every opportunity modified
+          (or deleted) since, and the day its ledger row says it was
+          counted on before. An opportunity edited after closing moves
+          to its new day instead of being counted twice.
+  read  — `get_closed_kpi` sums Closed rows up to the last built day
+          (BUILT_THROUGH_KEY), takes back the ledger contribution of
+          every opportunity modified or deleted since, and aggregates
+          those opportunities live — the same numbers as the live query,
+          including today and any night the job didn't run.
+
+The first run on a site (no marker yet) builds everything once. Open /
+overdue figures on the page stay live — they're a single scan of the
+(bounded) open set.
+"""
+
+import json
+from datetime import timedelta
+
+import frappe
+from frappe.utils import getdate, nowdate, date_diff
+
+SNAPSHOT_DOCTYPE = "Opportunity KPI Snapshot"
+CLOSE_DOCTYPE = "Opportunity KPI Close"
+BUILT_THROUGH_KEY = "opportunity_kpi_snapshot_built_through"
+CLOSED_STATUSES = ["Converted", "Closed", "Lost"]
+
+
+# ── Aggregation ───────────────────────────────────────────────────────────────
+
+def _empty_counters():
+    return {
+        "closed": 0,
+        "closed_on_time": 0,
+        "closed_late": 0,
+        "histogram": {},
+    }
+
+
+def _merge_counters(into, other):
+    for k in ("closed", "closed_on_time", "closed_late"):
+        into[k] += other.get(k) or 0
+    for days, n in (other.get("histogram") or {}).items():
+        into["histogram"][int(days)] = into["histogram"].get(int(days), 0) + n
+    return into
+
+
+def _user_teams(assignment_map):
+    from opportunity_management.opportunity_management import api
+
+    users = set()
+    for assigned in assignment_map.values():
+        users.update(assigned)
+    return {u: p["team"] for u, p in api._get_user_profiles(users).items()}
+
+
+def _close_entries(opps):
+    """{name: entry} — what each closed opportunity row contributes:
+    {"day", "on_time", "late", "close_days", "assignees": [(user, team)]}."""
+    from opportunity_management.opportunity_management import api
+
+    assignment_map = api._get_assignment_map([o.name for o in opps])
+    teams = _user_teams(assignment_map)
+
+    entries = {}
+    for opp in opps:
+        on_time = late = 0
+        if opp.expected_closing and opp.modified:
+            if getdate(opp.modified) <= getdate(opp.expected_closing):
+                on_time = 1
+            else:
+                late = 1
+        entries[opp.name] = {
+            "day": getdate(opp.modified),
+            "on_time": on_time,
+            "late": late,
+            "close_days": date_diff(getdate(opp.modified), getdate(opp.creation)),
+            "assignees": [
+                (u, teams.get(u, "Unassigned")) for u in sorted(assignment_map.get(opp.name) or ())
+            ],
+        }
+    return entries
+
+
+def _bucket_entries(entries, sign=1):
+    """{(day, user, team): counters} for close entries; sign=-1 gives the
+    counters to take back. Company-wide totals live under (day, "", "")."""
+    buckets = {}
+    for e in entries:
+        keys = [(e["day"], "", "")]
+        keys += [(e["day"], user, team) for user, team in e["assignees"]]
+        for key in keys:
+            c = buckets.setdefault(key, _empty_counters())
+            c["closed"] += sign
+            c["closed_on_time"] += sign * e["on_time"]
+            c["closed_late"] += sign * e["late"]
+            c["histogram"][e["close_days"]] = c["histogram"].get(e["close_days"], 0) + sign
+    return buckets
+
+
+def _aggregate_closed(opps):
+    """{(day, user, team): counters} for closed opportunity rows."""
+    return _bucket_entries(_close_entries(opps).values())
+
+
+# ── Nightly job ───────────────────────────────────────────────────────────────
+
+def _insert_rows(buckets):
+    if not buckets:
+        return
+    now = frappe.utils.now_datetime()
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by",
+        "snapshot_date", "snapshot_type", "user", "team",
+        "closed", "closed_on_time", "closed_late", "close_days_histogram",
+    ]
+    values = []
+    for (day, user, team), c in buckets.items():
+        values.append((
+            frappe.generate_hash(length=12), now, now, "Administrator", "Administrator",
+            day, "Closed", user or None, team or None,
+            c["closed"], c["closed_on_time"], c["closed_late"],
+            json.dumps(c["histogram"]) if c["histogram"] else None,
+        ))
+    frappe.db.bulk_insert(SNAPSHOT_DOCTYPE, fields, values)
+
+
+def _insert_close_entries(entries):
+    if not entries:
+        return
+    now = frappe.utils.now_datetime()
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by",
+        "opportunity", "close_date", "closed_on_time", "closed_late",
+        "close_days", "assignees",
+    ]
+    values = [
+        (
+            name, now, now, "Administrator", "Administrator",
+            name, e["day"], e["on_time"], e["late"],
+            e["close_days"], json.dumps(e["assignees"]),
+        )
+        for name, e in entries.items()
+    ]
+    frappe.db.bulk_insert(CLOSE_DOCTYPE, fields, values)
+
+
+def _changed_since(day):
+    """Names of opportunities modified or deleted on or after `day`."""
+    names = set(frappe.get_all("Opportunity", filters={"modified": [">=", day]}, pluck="name"))
+    names.update(frappe.get_all(
+        "Deleted Document",
+        filters={"deleted_doctype": "Opportunity", "creation": [">=", day]},
+        pluck="deleted_name",
+    ))
+    return names
+
+
+def _ledger_entries(names):
+    """Close entries recorded for `names` in the ledger."""
+    if not names:
+        return []
+    return [
+        {
+            "day": getdate(r.close_date),
+            "on_time": r.closed_on_time,
+            "late": r.closed_late,
+            "close_days": r.close_days,
+            "assignees": [tuple(a) for a in json.loads(r.assignees or "[]")],
+        }
+        for r in frappe.get_all(
+            CLOSE_DOCTYPE,
+            filters={"name": ["in", list(names)]},
+            fields=["close_date", "closed_on_time", "closed_late", "close_days", "assignees"],
+        )
+    ]
+
+
+def build_daily_kpi_snapshots():
+    """Scheduler hook (nightly) — rebuild the Closed rows and ledger for
+    every close day before today touched since the last build."""
+    today = getdate(nowdate())
+    yesterday = today - timedelta(days=1)
+    previous = built_through()
+
+    if previous is None:
+        entries = _close_entries(_closed_opportunities({"modified": ["<", today]}))
+        frappe.db.delete(SNAPSHOT_DOCTYPE)
+        frappe.db.delete(CLOSE_DOCTYPE)
+        days = None
+    else:
+        # Days touched: where changed opportunities were counted before
+        # (ledger) and where they close now.
+        changed = _changed_since(previous + timedelta(days=1))
+        days = {e["day"] for e in _ledger_entries(changed)}
+        if changed:
+            days.update(getdate(o.modified) for o in _closed_opportunities({
+                "name": ["in", list(changed)],
+                "modified": ["<", today],
+            }))
+        entries = {}
+        if days:
+            entries = _close_entries(frappe.get_all(
+                "Opportunity",
+                filters={"status": ["in", CLOSED_STATUSES]},
+                or_filters=[["modified", "between", [d, d]] for d in sorted(days)],
+                fields=["name", "expected_closing", "modified", "creation"],
+            ))
+            frappe.db.delete(SNAPSHOT_DOCTYPE, {"snapshot_date": ["in", list(days)]})
+            frappe.db.delete(CLOSE_DOCTYPE, {"close_date": ["in", list(days)]})
+
+    closed = _bucket_entries(entries.values())
+    _insert_rows(closed)
+    _insert_close_entries(entries)
+    frappe.db.set_global(BUILT_THROUGH_KEY, str(yesterday))
+    frappe.db.commit()
+    return {
+        "rebuilt_days": "all" if days is None else len(days),
+        "closed_rows": len(closed),
+        "opportunities": len(entries),
+    }
+
+
+# ── Read side ─────────────────────────────────────────────────────────────────
+
+def built_through():
+    """Last close day the Closed rows and ledger cover, or None before the
+    nightly job has run (with the ledger) on this site."""
+    try:
+        marker = frappe.db.get_global(BUILT_THROUGH_KEY)
+        return getdate(marker) if marker else None
+    except Exception:
+        return None
+
+
+def _group_key(group_by, user, team):
+    if group_by == "user":
+        return user
+    if group_by == "team":
+        return team
+    return None
+
+
+def _fold(buckets, group_by, result):
+    """Sum {(day, user, team): counters} into `result` keyed by group —
+    company rows (blank user) when `group_by` is None, per-user rows
+    otherwise."""
+    for (day, user, team), c in buckets.items():
+        if bool(group_by) != bool(user):
+            continue
+        _merge_counters(result.setdefault(_group_key(group_by, user, team), _empty_counters()), c)
+    return result
+
+
+def _closed_opportunities(filters):
+    return frappe.get_all(
+        "Opportunity",
+        filters={"status": ["in", CLOSED_STATUSES], **filters},
+        fields=["name", "expected_closing", "modified", "creation"],
+    )
+
+
+def get_closed_kpi(from_date=None, to_date=None, since=None, group_by=None):
+    """Closed-opportunity counters for a date range.
+
+    `from_date`/`to_date` bound the close day inclusively; `since` is the
+    open-ended lower bound used by the legacy `date_range` argument.
+    `group_by` is None (company-wide → one counters dict), "user" or
+    "team" (→ {key: counters}).
+
+    Summed from snapshots up to `built_through()`, minus the ledger
+    contribution of every opportunity modified or deleted since, plus
+    those opportunities live. Before the nightly job has ever run the
+    whole range is aggregated live instead."""
+    lower = getdate(from_date) if from_date and to_date else (getdate(since) if since else None)
+    upper = getdate(to_date) if from_date and to_date else None
+    result = {}
+    watermark = built_through()
+
+    def _in_range(day):
+        return (not lower or day >= lower) and (not upper or day <= upper)
+
+    live_from = watermark + timedelta(days=1) if watermark else None
+    if watermark and (not lower or lower <= watermark):
+        upper_snap = min(upper, watermark) if upper else watermark
+        filters = {
+            "snapshot_type": "Closed",
+            "snapshot_date": ["between", [lower, upper_snap]] if lower else ["<=", upper_snap],
+            "user": ["is", "set"] if group_by else ["is", "not set"],
+        }
+        for r in frappe.get_all(
+            SNAPSHOT_DOCTYPE,
+            filters=filters,
+            fields=["user", "team", "closed", "closed_on_time", "closed_late", "close_days_histogram"],
+        ):
+            c = result.setdefault(_group_key(group_by, r.user, r.team), _empty_counters())
+            _merge_counters(c, {
+                "closed": r.closed,
+                "closed_on_time": r.closed_on_time,
+                "closed_late": r.closed_late,
+                "histogram": json.loads(r.close_days_histogram) if r.close_days_histogram else {},
+            })
+
+        # Opportunities changed since the build are counted live below,
+        # wherever they close now — take back what the snapshots hold.
+        stale = [e for e in _ledger_entries(_changed_since(live_from)) if _in_range(e["day"])]
+        _fold(_bucket_entries(stale, sign=-1), group_by, result)
+
+    # Anything modified after the watermark isn't in the snapshots — add it live.
+    if lower and (not live_from or lower > live_from):
+        live_from = lower
+    if not (live_from and upper and live_from > upper):
+        filters = {}
+        if live_from and upper:
+            filters["modified"] = ["between", [live_from, upper]]
+        elif live_from:
+            filters["modified"] = [">=", live_from]
+        _fold(_aggregate_closed(_closed_opportunities(filters)), group_by, result)
+
+    for c in result.values():
+        c["histogram"] = {days: n for days, n in c["histogram"].items() if n}
+    if not group_by:
+        return result.get(None) or _empty_counters()
+    return result
+
+
+def histogram_quantile(histogram, q):
+    """Quantile `q` (0–1) of the values a {value: count} histogram
+    represents, linearly interpolated between the two closest ranks —
+    identical to sorting the expanded list, without expanding it.
+
+    Histograms are the close-day sketch kept on every snapshot row; they
+    merge by adding counts (`_merge_counters`), so team and company
+    percentiles come from combining the per-user sketches."""
+    total = sum(histogram.values())
+    if not total:
+        return 0
+    position = q * (total - 1)
+    lower_rank = int(position)
+    upper_rank = min(lower_rank + 1, total - 1)
+    lower_value = upper_value = None
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if lower_value is None and lower_rank < seen:
+            lower_value = value
+        if upper_rank < seen:
+            upper_value = value
+            break
+    return lower_value + (upper_value - lower_value) * (position - lower_rank)
+
+
+def histogram_median(histogram):
+    """Exact median of a {value: count} histogram."""
+    return histogram_quantile(histogram, 0.5)
+
+
+def close_day_percentiles(histogram):
+    """p50 / p90 / p99 close days for a close-day histogram, rounded the
+    way the KPI payload rounds median_close_days."""
+    return {
+        "close_days_p50": round(histogram_quantile(histogram, 0.5), 1),
+        "close_days_p90": round(histogram_quantile(histogram, 0.9), 1),
+        "close_days_p99": round(histogram_quantile(histogram, 0.99), 1),
+    }
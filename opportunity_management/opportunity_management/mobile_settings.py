@@ -0,0 +1,147 @@
+"""
+Cached, typed access to the ESS Mobile Settings single.
+
+`frappe.get_single("ESS Mobile Settings")` used to run on every check-in
+(window guard), every pre-login `get_mobile_config` fetch and every
+attendance cron slot — a handful of queries each time for a document that
+changes a few times a year. `get_mobile_settings()` serves it from two
+layers instead:
+
+  Redis    — the single's field values (child rows included) under
+             _VALUES_KEY, plus a short content hash under _ETAG_KEY.
+  process  — the parsed MobileSettings per site, reused for as long as
+             _ETAG_KEY still holds its hash (one tiny Redis GET per call).
+
+The controller's on_update clears both keys, so a save is visible on the
+next call in every worker. Writes that bypass the document
+(frappe.db.set_single_value) must call `clear_mobile_settings_cache`.
+
+Hours and the reminder time are parsed once, and working_days becomes a
+set of weekday numbers. Unset numbers are None, so each caller keeps its
+own fallback. `.get(fieldname)` still works for everything else, so
+existing `s.get(...)` call sites read the same as before.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+import frappe
+
+SETTINGS_DOCTYPE = "ESS Mobile Settings"
+
+_VALUES_KEY = "opportunity_management:mobile_settings"
+_ETAG_KEY = "opportunity_management:mobile_settings:etag"
+_DEFAULT_WORKING_DAYS = "Sun,Mon,Tue,Wed,Thu"
+_WEEKDAYS = {"Mon": 0, "Tue": 1, "Wed": 2, "Thu": 3, "Fri": 4, "Sat": 5, "Sun": 6}
+
+_parsed = {}  # site -> MobileSettings
+
+
+@dataclass
+class MobileSettings:
+    values: dict
+    etag: str
+    working_days: frozenset
+    checkin_window_start_hour: Optional[int]
+    checkin_window_end_hour: Optional[int]
+    expected_checkin_hour: Optional[int]
+    late_checkin_threshold_minutes: Optional[int]
+    auto_checkout_hour: Optional[int]
+    daily_checkin_reminder_time: Optional[Tuple[int, int]]
+    default_leave_type_for_late_checkin: str
+    # Payloads derived from this version of the settings (e.g. the mobile
+    # config), built once by `derived` and dropped with the object.
+    _derived: dict = field(default_factory=dict, repr=False)
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def is_working_day(self, when=None) -> bool:
+        when = when or frappe.utils.now_datetime()
+        return when.weekday() in self.working_days
+
+    def derived(self, name: str, build):
+        """`build(self)`, computed once per settings version."""
+        if name not in self._derived:
+            self._derived[name] = build(self)
+        return self._derived[name]
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_hhmm(value):
+    value = (value or "").strip()
+    if ":" not in value:
+        return None
+    try:
+        h, m = (int(x) for x in value.split(":")[:2])
+    except (TypeError, ValueError):
+        return None
+    return (h, m) if 0 <= h <= 23 and 0 <= m <= 59 else None
+
+
+def _build(values: dict, etag: str) -> MobileSettings:
+    working_days = frozenset(
+        _WEEKDAYS[d.strip()]
+        for d in (values.get("working_days") or _DEFAULT_WORKING_DAYS).split(",")
+        if d.strip() in _WEEKDAYS
+    )
+    return MobileSettings(
+        values=values,
+        etag=etag,
+        working_days=working_days,
+        checkin_window_start_hour=_int_or_none(values.get("checkin_window_start_hour")),
+        checkin_window_end_hour=_int_or_none(values.get("checkin_window_end_hour")),
+        expected_checkin_hour=_int_or_none(values.get("expected_checkin_hour")),
+        late_checkin_threshold_minutes=_int_or_none(values.get("late_checkin_threshold_minutes")),
+        auto_checkout_hour=_int_or_none(values.get("auto_checkout_hour")),
+        daily_checkin_reminder_time=_parse_hhmm(values.get("daily_checkin_reminder_time")),
+        default_leave_type_for_late_checkin=(values.get("default_leave_type_for_late_checkin") or "").strip(),
+    )
+
+
+def _load_values():
+    """(values, etag) straight from the database."""
+    from opportunity_management import __version__
+
+    values = frappe.get_single(SETTINGS_DOCTYPE).as_dict(no_default_fields=True)
+    # The app version is part of the hash so a deploy that changes how the
+    # settings are presented (e.g. the mobile config shape) changes the
+    # ETag too.
+    digest = hashlib.sha1(
+        json.dumps([__version__, values], sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+    return values, digest
+
+
+def get_mobile_settings() -> MobileSettings:
+    """The current ESS Mobile Settings. Raises like frappe.get_single when
+    the DocType isn't installed."""
+    site = getattr(frappe.local, "site", None)
+    cache = frappe.cache()
+    etag = cache.get_value(_ETAG_KEY)
+    parsed = _parsed.get(site)
+    if etag and parsed and parsed.etag == etag:
+        return parsed
+
+    values = cache.get_value(_VALUES_KEY) if etag else None
+    if values is None:
+        values, etag = _load_values()
+        cache.set_value(_VALUES_KEY, values)
+        cache.set_value(_ETAG_KEY, etag)
+    parsed = _parsed[site] = _build(values, etag)
+    return parsed
+
+
+def clear_mobile_settings_cache(doc=None, method=None) -> None:
+    """Drop the cached settings in Redis (every worker re-reads on its next
+    call) and in this process."""
+    frappe.cache().delete_value([_VALUES_KEY, _ETAG_KEY])
+    _parsed.pop(getattr(frappe.local, "site", None), None)
@@ -1,5 +1,5 @@
 """
-Async FCM dispatch — pushes each send into the RQ short queue so the
+Async FCM dispatch — pushes sends into the RQ short queue so the
 originating request (doc submit, Notification Log insert, etc.) returns
 immediately instead of blocking on ~200-400ms per push.
 
@@ -11,60 +11,150 @@ submits at baseline speed; pushes still land within a few seconds.
 
 Public helpers mirror the direct fcm_utils functions:
   enqueue_fcm_to_user(email, title, body, data)
+  enqueue_fcm_to_users(emails, title, body, data)
   enqueue_fcm_to_employee(employee_id, title, body, data)
   enqueue_fcm(token, title, body, data)
 
+Sends are coalesced: every push queued during one transaction goes into a
+per-request outbox that is flushed after commit as a single
+`_worker_send_batch` job (split every BATCH_SIZE messages). A business
+event that notifies a role of 80 users is one job, not 80; the worker
+resolves every recipient's token in one bulk lookup
+(fcm_utils.resolve_push_targets) and sends through the
+concurrent fan-out path (fcm_utils.send_fcm_bulk). A rolled-back
+transaction drops its outbox, so no push goes out for work that never
+landed. Where the DB layer has no after-commit hook, each helper call
+enqueues its own batch job straight away.
+
 Worker entrypoints (`_worker_*`) are the RQ-invoked module-level jobs
 they enqueue; they exist as separate functions because `frappe.enqueue`
-serializes the target as a dotted path.
+serializes the target as a dotted path. The per-recipient `_worker_send_*`
+jobs are kept so jobs already sitting in the queue at deploy time still run.
 """
 
 import frappe
 
+BATCH_SIZE = 500
+
 
 # ── Public enqueue helpers ────────────────────────────────────────────────────
 
 def enqueue_fcm_to_user(user_email: str, title: str, body: str, data: dict = None) -> None:
     if not user_email:
         return
-    frappe.enqueue(
-        "opportunity_management.opportunity_management.notification_dispatcher._worker_send_to_user",
-        queue="short",
-        user_email=user_email,
-        title=title,
-        body=body,
-        data=data or {},
-    )
+    _queue([_message("user", user_email, title, body, data)])
+
+
+def enqueue_fcm_to_users(user_emails, title: str, body: str, data: dict = None) -> None:
+    """One push to every user in `user_emails` (duplicates dropped)."""
+    seen = set()
+    messages = []
+    for email in user_emails or ():
+        if email and email not in seen:
+            seen.add(email)
+            messages.append(_message("user", email, title, body, data))
+    _queue(messages)
 
 
 def enqueue_fcm_to_employee(employee_id: str, title: str, body: str, data: dict = None) -> None:
     if not employee_id:
         return
-    frappe.enqueue(
-        "opportunity_management.opportunity_management.notification_dispatcher._worker_send_to_employee",
-        queue="short",
-        employee_id=employee_id,
-        title=title,
-        body=body,
-        data=data or {},
-    )
+    _queue([_message("employee", employee_id, title, body, data)])
 
 
 def enqueue_fcm(token: str, title: str, body: str, data: dict = None) -> None:
     if not token:
         return
-    frappe.enqueue(
-        "opportunity_management.opportunity_management.notification_dispatcher._worker_send_raw",
-        queue="short",
-        token=token,
-        title=title,
-        body=body,
-        data=data or {},
-    )
+    _queue([_message("token", token, title, body, data)])
+
+
+# ── Outbox ────────────────────────────────────────────────────────────────────
+
+def _message(kind: str, target: str, title: str, body: str, data: dict) -> dict:
+    return {"kind": kind, "target": target, "title": title, "body": body, "data": data or {}}
+
+
+def _queue(messages) -> None:
+    if not messages:
+        return
+    outbox = getattr(frappe.local, "fcm_outbox", None)
+    if outbox is None:
+        db = getattr(frappe.local, "db", None)
+        after_commit = getattr(db, "after_commit", None)
+        after_rollback = getattr(db, "after_rollback", None)
+        if after_commit is None or after_rollback is None:
+            _enqueue_batch(messages)
+            return
+        outbox = frappe.local.fcm_outbox = []
+        after_commit.add(_flush_outbox)
+        after_rollback.add(_discard_outbox)
+    outbox.extend(messages)
+
+
+def _flush_outbox() -> None:
+    messages = getattr(frappe.local, "fcm_outbox", None) or []
+    frappe.local.fcm_outbox = None
+    _enqueue_batch(messages)
+
+
+def _discard_outbox() -> None:
+    frappe.local.fcm_outbox = None
+
+
+def _enqueue_batch(messages) -> None:
+    for start in range(0, len(messages), BATCH_SIZE):
+        frappe.enqueue(
+            "opportunity_management.opportunity_management.notification_dispatcher._worker_send_batch",
+            queue="short",
+            messages=messages[start:start + BATCH_SIZE],
+        )
 
 
 # ── Worker entrypoints (invoked by RQ) ────────────────────────────────────────
 
+def _resolve_batch(messages):
+    """[(message, token, user_for_log)] for every message whose recipient
+    has a token, resolved through the shared push-target cache. Mirrors the
+    direct helpers: user/employee sends write a Notification Log for the
+    employee's user on success, raw token sends don't."""
+    from opportunity_management.opportunity_management.fcm_utils import resolve_push_targets
+
+    by_user = resolve_push_targets("user", (m["target"] for m in messages if m["kind"] == "user"))
+    by_employee = resolve_push_targets("employee", (m["target"] for m in messages if m["kind"] == "employee"))
+
+    resolved = []
+    for m in messages:
+        if m["kind"] == "token":
+            resolved.append((m, m["target"], None))
+            continue
+        target = (by_user if m["kind"] == "user" else by_employee).get(m["target"])
+        if target and target["token"]:
+            resolved.append((m, target["token"], target["user_id"]))
+    return resolved
+
+
+def _worker_send_batch(messages) -> None:
+    from opportunity_management.opportunity_management.fcm_utils import (
+        _create_notification_logs, send_fcm_bulk,
+    )
+    try:
+        resolved = _resolve_batch(messages)
+        results = send_fcm_bulk([
+            {"token": token, "title": m["title"], "body": m["body"], "data": m["data"], "user": user}
+            for m, token, user in resolved
+        ])
+        _create_notification_logs([
+            (user, m["title"], m["body"])
+            for (m, _, user), result in zip(resolved, results)
+            if result["ok"] and user
+        ])
+    except Exception:
+        frappe.log_error(
+            title="FCM Enqueued Send Error",
+            message=f"batch of {len(messages)}\n{frappe.get_traceback()}",
+        )
+
+
 def _worker_send_to_user(user_email: str, title: str, body: str, data: dict) -> None:
     from opportunity_management.opportunity_management.fcm_utils import send_fcm_to_user
     try:
@@ -5,6 +5,7 @@ Helps determine who should receive opportunity notifications
 
 import frappe
 from frappe import _
+from opportunity_management.opportunity_management.utils.cache import hmget
 
 
 def get_department_managers(user_email):
@@ -135,83 +136,210 @@ def get_opportunity_recipients_for_notification(doc, method=None):
     return get_opportunity_notification_recipients(doc.name)
 
 
+# ── Party → user resolution cache ────────────────────────────────────────────
+# Resolving one party walks up to eight lookups (DocType check, Responsible
+# Party, Employee, Dynamic Link, Contact, User …) and every list endpoint /
+# scheduler does it per row. The result only changes when one of the
+# source records changes, so keep a site-wide Redis hash of
+# party → {user_id, email} and drop it from the doc_events of those
+# DocTypes (see hooks.py → clear_party_resolution_cache).
+_PARTY_CACHE_KEY = "opportunity_management:party_resolution"
+
+
 def _get_responsible_party_info(party_name):
-    """Resolve a Responsible Party/Employee/Shareholder to user_id/email."""
-    info = {"user_id": None, "email": None}
+    """Resolve a Responsible Party/Employee/Shareholder to user_id/email.
 
+    Served from the site-wide resolution cache; falls through to
+    `_resolve_responsible_party_info` on a miss and stores the result."""
     if not party_name:
-        return info
+        return {"user_id": None, "email": None}
 
-    # Preferred: Responsible Party doctype (standalone)
-    if frappe.db.exists("DocType", "Responsible Party") and frappe.db.exists("Responsible Party", party_name):
-        party = frappe.get_doc("Responsible Party", party_name)
+    cache = frappe.cache()
+    cached = cache.hget(_PARTY_CACHE_KEY, party_name)
+    if cached is not None:
+        return dict(cached)
 
-        user_id = getattr(party, "user_id", None)
-        employee = getattr(party, "employee", None)
-        shareholder = getattr(party, "shareholder", None)
-        email = getattr(party, "email", None)
+    info = _resolve_responsible_party_info(party_name)
+    cache.hset(_PARTY_CACHE_KEY, party_name, info)
+    return dict(info)
 
-        if user_id:
-            info["user_id"] = user_id
-        if email:
-            info["email"] = email
-
-        if not info["user_id"] and employee:
-            emp = frappe.db.get_value("Employee", employee, ["user_id", "prefered_email", "company_email", "personal_email"], as_dict=True)
-            if emp:
-                info["user_id"] = emp.user_id
-                info["email"] = info["email"] or emp.prefered_email or emp.company_email or emp.personal_email
-
-        if shareholder and not info["email"]:
-            contact = frappe.db.get_value(
-                "Dynamic Link",
-                {"link_doctype": "Shareholder", "link_name": shareholder, "parenttype": "Contact"},
-                "parent"
-            )
-            if contact:
-                info["email"] = frappe.db.get_value("Contact", contact, "email_id")
 
-        if info["user_id"] and not info["email"]:
-            info["email"] = frappe.db.get_value("User", info["user_id"], "email")
+def get_responsible_party_infos(party_names):
+    """Bulk variant of `_get_responsible_party_info`.
 
-        if not info["user_id"] and info["email"]:
-            user_from_email = frappe.db.get_value("User", {"email": info["email"]}, "name")
-            if user_from_email:
-                info["user_id"] = user_from_email
+    Returns {party_name: {"user_id", "email"}} for every non-empty name in
+    `party_names`. The requested fields of the cache hash are read in one
+    round-trip; only the misses are resolved against the database,
+    set-based."""
+    names = {p for p in (party_names or []) if p}
+    if not names:
+        return {}
 
-        return info
+    cache = frappe.cache()
+    cached = {key: dict(value) for key, value in hmget(_PARTY_CACHE_KEY, names).items()}
 
-    # Fallback: Employee ID directly
-    if frappe.db.exists("Employee", party_name):
-        emp = frappe.db.get_value("Employee", party_name, ["user_id", "prefered_email", "company_email", "personal_email"], as_dict=True)
-        if emp:
-            info["user_id"] = emp.user_id
-            info["email"] = emp.prefered_email or emp.company_email or emp.personal_email
-        return info
+    misses = names - set(cached)
+    if misses:
+        for party_name, info in _resolve_responsible_party_infos(misses).items():
+            cache.hset(_PARTY_CACHE_KEY, party_name, info)
+            cached[party_name] = dict(info)
+
+    return cached
+
+
+def clear_party_resolution_cache(doc=None, method=None):
+    """doc_events hook — drop the whole party resolution cache.
+
+    A single Employee / Contact / User edit can change the resolution of
+    any number of parties that link to it, so the hash is cleared as a
+    unit rather than chasing reverse links."""
+    frappe.cache().delete_key(_PARTY_CACHE_KEY)
+
+
+def _resolve_responsible_party_info(party_name):
+    """Uncached resolution of a Responsible Party/Employee/Shareholder to
+    user_id/email. Use `_get_responsible_party_info` instead."""
+    return _resolve_responsible_party_infos([party_name]).get(
+        party_name, {"user_id": None, "email": None}
+    )
+
+
+def _employee_email(emp):
+    return emp.prefered_email or emp.company_email or emp.personal_email
 
-    # Fallback: Shareholder ID directly
-    if frappe.db.exists("Shareholder", party_name):
-        contact = frappe.db.get_value(
+
+def _resolve_responsible_party_infos(party_names):
+    """Set-based, uncached resolution of many parties at once.
+
+    Same precedence as the per-party rules — Responsible Party first, then
+    Employee ID, then Shareholder ID, then legacy Responsible Engineer —
+    but each source is read with one `IN (...)` query for every party, so
+    the query count stays constant no matter how many parties are passed.
+    """
+    names = {p for p in (party_names or []) if p}
+    infos = {p: {"user_id": None, "email": None} for p in names}
+    if not names:
+        return infos
+
+    # 1. Responsible Party rows (standalone DocType, optional per site).
+    rp_rows = {}
+    if frappe.db.exists("DocType", "Responsible Party"):
+        rp_meta = frappe.get_meta("Responsible Party")
+        rp_fields = ["name"] + [
+            f for f in ("user_id", "employee", "shareholder", "email")
+            if rp_meta.has_field(f)
+        ]
+        rp_rows = {r.name: r for r in frappe.get_all(
+            "Responsible Party",
+            filters={"name": ["in", list(names)]},
+            fields=rp_fields,
+        )}
+
+    # 2. Legacy Responsible Engineer rows → their Employee link.
+    re_employee = {}
+    rest = names - set(rp_rows)
+    if rest and frappe.db.exists("DocType", "Responsible Engineer"):
+        re_employee = {r.name: r.employee for r in frappe.get_all(
+            "Responsible Engineer",
+            filters={"name": ["in", list(rest)]},
+            fields=["name", "employee"],
+        )}
+
+    # 3. Every Employee referenced directly or through 1./2.
+    employee_ids = set(rest)
+    employee_ids.update(r.get("employee") for r in rp_rows.values() if r.get("employee"))
+    employee_ids.update(e for e in re_employee.values() if e)
+    employees = {}
+    if employee_ids:
+        employees = {e.name: e for e in frappe.get_all(
+            "Employee",
+            filters={"name": ["in", list(employee_ids)]},
+            fields=["name", "user_id", "prefered_email", "company_email", "personal_email"],
+        )}
+
+    # 4. Shareholder IDs passed directly.
+    shareholders = set()
+    rest = rest - set(employees)
+    if rest:
+        shareholders = set(frappe.get_all(
+            "Shareholder", filters={"name": ["in", list(rest)]}, pluck="name",
+        ))
+
+    # Apply Responsible Party rules up to the point where a Contact or
+    # User lookup is needed; collect those lookups for the bulk queries.
+    for party, rp in rp_rows.items():
+        info = infos[party]
+        info["user_id"] = rp.get("user_id") or None
+        info["email"] = rp.get("email") or None
+        emp = employees.get(rp.get("employee")) if rp.get("employee") else None
+        if not info["user_id"] and emp:
+            info["user_id"] = emp.user_id
+            info["email"] = info["email"] or _employee_email(emp)
+
+    for party in names - set(rp_rows):
+        if party in employees:
+            emp = employees[party]
+            infos[party] = {"user_id": emp.user_id, "email": _employee_email(emp)}
+        elif party not in shareholders and re_employee.get(party) in employees:
+            emp = employees[re_employee[party]]
+            infos[party] = {"user_id": emp.user_id, "email": _employee_email(emp)}
+
+    # 5. Shareholder → Contact email (Dynamic Link + Contact, one query each).
+    shareholder_of = {p: p for p in shareholders}
+    for party, rp in rp_rows.items():
+        if rp.get("shareholder") and not infos[party]["email"]:
+            shareholder_of[party] = rp.get("shareholder")
+    if shareholder_of:
+        contact_of_shareholder = {}
+        for link in frappe.get_all(
             "Dynamic Link",
-            {"link_doctype": "Shareholder", "link_name": party_name, "parenttype": "Contact"},
-            "parent"
-        )
-        if contact:
-            info["email"] = frappe.db.get_value("Contact", contact, "email_id")
-        return info
-
-    # Legacy: Responsible Engineer as child table entry
-    if frappe.db.exists("Responsible Engineer", party_name):
-        engineer = frappe.get_doc("Responsible Engineer", party_name)
-        employee = getattr(engineer, "employee", None)
-        if employee:
-            emp = frappe.db.get_value("Employee", employee, ["user_id", "prefered_email", "company_email", "personal_email"], as_dict=True)
-            if emp:
-                info["user_id"] = emp.user_id
-                info["email"] = emp.prefered_email or emp.company_email or emp.personal_email
-        return info
-
-    return info
+            filters={
+                "link_doctype": "Shareholder",
+                "link_name": ["in", list(set(shareholder_of.values()))],
+                "parenttype": "Contact",
+            },
+            fields=["link_name", "parent"],
+        ):
+            contact_of_shareholder.setdefault(link.link_name, link.parent)
+        contact_email = {}
+        if contact_of_shareholder:
+            contact_email = {c.name: c.email_id for c in frappe.get_all(
+                "Contact",
+                filters={"name": ["in", list(set(contact_of_shareholder.values()))]},
+                fields=["name", "email_id"],
+            )}
+        for party, shareholder in shareholder_of.items():
+            contact = contact_of_shareholder.get(shareholder)
+            if contact:
+                infos[party]["email"] = contact_email.get(contact)
+
+    # 6. User fill-ins — Responsible Party path only, as before.
+    need_email = {p: i["user_id"] for p, i in infos.items()
+                  if p in rp_rows and i["user_id"] and not i["email"]}
+    if need_email:
+        user_email = {u.name: u.email for u in frappe.get_all(
+            "User",
+            filters={"name": ["in", list(set(need_email.values()))]},
+            fields=["name", "email"],
+        )}
+        for party, user_id in need_email.items():
+            infos[party]["email"] = user_email.get(user_id)
+
+    need_user = {p: i["email"] for p, i in infos.items()
+                 if p in rp_rows and not i["user_id"] and i["email"]}
+    if need_user:
+        user_by_email = {}
+        for u in frappe.get_all(
+            "User",
+            filters={"email": ["in", list(set(need_user.values()))]},
+            fields=["name", "email"],
+        ):
+            user_by_email.setdefault(u.email, u.name)
+        for party, email in need_user.items():
+            if user_by_email.get(email):
+                infos[party]["user_id"] = user_by_email[email]
+
+    return infos
 
 
 def _get_user_from_responsible_engineer(engineer_name):
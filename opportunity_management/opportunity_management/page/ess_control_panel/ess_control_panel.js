@@ -33,6 +33,12 @@ class ESSControlPanel {
                     <div id="ess-firebase-body">Loading…</div>
                 </div>
 
+                <!-- FCM Send Metrics -->
+                <div class="card" style="margin-bottom: 24px; padding: 16px;">
+                    <h5 style="margin-bottom: 12px;">📈 FCM Send Metrics <small style="color:#888">(last 60 min)</small></h5>
+                    <div id="ess-fcm-metrics">Loading…</div>
+                </div>
+
                 <!-- Broadcast Notification -->
                 <div class="card" style="margin-bottom: 24px; padding: 16px;">
                     <h5 style="margin-bottom: 12px;">📢 Broadcast Notification</h5>
@@ -153,6 +159,7 @@ class ESSControlPanel {
         this.load_checkins();
         this.load_error_log();
         this.load_settings();
+        this.load_fcm_metrics();
     }
 
     load_stats() {
@@ -210,6 +217,49 @@ class ESSControlPanel {
         });
     }
 
+    load_fcm_metrics() {
+        frappe.call({
+            method: `${this.METHOD}.get_fcm_metrics`,
+            args: { minutes: 60 },
+            callback: (r) => {
+                if (!r.message) return;
+                const d = r.message;
+                const labels = { send: 'FCM send', oauth: 'OAuth refresh', lookup: 'Token lookup' };
+                const ms = (v) => (v === null || v === undefined) ? '—' : `${v} ms`;
+                const rows = Object.keys(labels).map(k => {
+                    const l = d.latency[k] || {};
+                    return `
+                        <tr>
+                            <td>${labels[k]}</td>
+                            <td>${l.count || 0}</td>
+                            <td>${ms(l.p50)}</td>
+                            <td>${ms(l.p95)}</td>
+                            <td>${ms(l.p99)}</td>
+                        </tr>`;
+                }).join('');
+                const status = ['2xx', '4xx', '5xx', 'none'].map(c => {
+                    const color = c === '2xx' ? 'green' : (c === '4xx' ? 'blue' : 'orange');
+                    return this._stat_card(c === 'none' ? 'No response' : c, d.status[c] || 0, color);
+                }).join('');
+                const peak = Math.max(0, ...d.per_minute.map(m => m.sends));
+
+                this.page.main.find('#ess-fcm-metrics').html(`
+                    <div class="row">
+                        ${this._stat_card('Sends / minute', d.sends_per_minute, 'blue')}
+                        ${this._stat_card('Peak minute', peak, 'blue')}
+                        ${status}
+                    </div>
+                    <table class="table table-bordered table-sm" style="max-width: 600px;">
+                        <thead style="background:#f5f5f5;">
+                            <tr><th>Metric</th><th>Samples</th><th>p50</th><th>p95</th><th>p99</th></tr>
+                        </thead>
+                        <tbody>${rows}</tbody>
+                    </table>
+                `);
+            }
+        });
+    }
+
     load_employees() {
         frappe.call({
             method: `${this.METHOD}.get_employees_fcm_status`,
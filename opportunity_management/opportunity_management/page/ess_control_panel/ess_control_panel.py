@@ -39,18 +39,18 @@ def get_dashboard_stats():
     with_token = frappe.db.count("Employee", {"status": "Active", "custom_fcm_token": ["!=", ""]})
     without_token = total_employees - with_token
 
-    today = frappe.utils.today()
     # Excluded employees do not contribute to the checkin count either —
     # keeps the number consistent with the recent-checkins feed below.
+    # Per-day counts come from ESS Attendance Day (attendance_state).
     excluded = _excluded_employee_ids()
     checkins_today = frappe.db.sql(
         """
-        SELECT COUNT(*)
-        FROM `tabEmployee Checkin`
-        WHERE DATE(time) = %(today)s
+        SELECT IFNULL(SUM(checkins), 0)
+        FROM `tabESS Attendance Day`
+        WHERE attendance_date = %(today)s
           AND employee NOT IN %(excluded)s
         """,
-        {"today": today, "excluded": excluded},
+        {"today": frappe.utils.today(), "excluded": excluded},
     )[0][0]
 
     pending_leaves = frappe.db.count("Leave Application", {"status": "Open"})
@@ -92,21 +92,18 @@ def send_test_notification(employee_id, title, body):
 @frappe.whitelist()
 def broadcast_notification(title, body):
     """Send an FCM notification to all active employees with a token."""
-    from opportunity_management.opportunity_management.fcm_utils import send_fcm
+    from opportunity_management.opportunity_management.fcm_utils import send_fcm_bulk
     employees = frappe.db.get_all(
         "Employee",
         filters={"status": "Active", "custom_fcm_token": ["!=", ""]},
         fields=["name", "custom_fcm_token"],
     )
-    sent = 0
-    failed = 0
-    for emp in employees:
-        ok = send_fcm(emp["custom_fcm_token"], title=title, body=body, data={"type": "broadcast"})
-        if ok:
-            sent += 1
-        else:
-            failed += 1
-    return {"sent": sent, "failed": failed}
+    results = send_fcm_bulk([
+        {"token": emp["custom_fcm_token"], "title": title, "body": body, "data": {"type": "broadcast"}}
+        for emp in employees
+    ])
+    sent = sum(1 for r in results if r["ok"])
+    return {"sent": sent, "failed": len(results) - sent}
 
 
 @frappe.whitelist()
@@ -171,3 +168,12 @@ def get_notification_log(limit=30):
         limit=int(limit),
     )
     return logs
+
+
+@frappe.whitelist()
+def get_fcm_metrics(minutes=60):
+    """Return FCM send metrics for the last `minutes` minutes — latency
+    percentiles (send / OAuth refresh / token lookup), status classes and
+    sends per minute. See fcm_utils "Send metrics"."""
+    from opportunity_management.opportunity_management.fcm_utils import get_send_metrics
+    return get_send_metrics(int(minutes))
@@ -144,6 +144,12 @@ function render_overall_kpi(page, kpi) {
                     <p style="margin: 5px 0 0 0;">Median Close Days</p>
                 </div>
             </div>
+            <div class="col-md-3">
+                <div class="kpi-card" style="background: #6610f2; color: white; padding: 20px; border-radius: 8px; text-align: center;">
+                    <h2 style="margin: 0; font-size: 36px;">${kpi.close_days_p90 || 0} / ${kpi.close_days_p99 || 0}</h2>
+                    <p style="margin: 5px 0 0 0;">P90 / P99 Close Days</p>
+                </div>
+            </div>
         </div>
     `;
     
@@ -176,6 +182,7 @@ function render_kpi_breakdown(page, data, viewType) {
                     <th style="text-align: center;">Late</th>
                     <th style="text-align: center;">Open</th>
                     <th style="text-align: center;">On-Time Rate</th>
+                    <th style="text-align: center;">Close Days (P50 / P90)</th>
                 </tr>
             </thead>
             <tbody>
@@ -199,6 +206,7 @@ function render_kpi_breakdown(page, data, viewType) {
                         ${item.on_time_rate}%
                     </div>
                 </td>
+                <td style="text-align: center;">${item.close_days_p50 || 0} / ${item.close_days_p90 || 0}</td>
             </tr>
         `;
     });
@@ -1,7 +1,8 @@
 """Daily Attendance — Baghdad
 
-One row per active Baghdad-Branch employee for the selected date. Pulls the
-real check-in/out times directly from Employee Checkin (the authoritative
+One row per active Baghdad-Branch employee for the selected date. Reads the
+first check-in / last check-out from ESS Attendance Day (the per-day state
+attendance_state keeps in step with Employee Checkin, the authoritative
 source the mobile app writes to), determines status, and shows the reason if
 the check-in was made outside the approved zone.
 
@@ -32,27 +33,19 @@ def execute(filters=None):
 
 	emp_ids = [e["name"] for e in employees]
 
-	checkins = _get_checkins(emp_ids, date)
+	days = _get_attendance_days(emp_ids, date)
 	leaves = _get_leaves(emp_ids, date)
 
 	rows = []
 	for emp in employees:
 		emp_id = emp["name"]
-		emp_checkins = checkins.get(emp_id, [])
+		day = days.get(emp_id) or {}
 		on_leave = emp_id in leaves
 
-		in_time = None
-		out_time = None
-		outside_zone = 0
-		outside_zone_reason = ""
-		for c in emp_checkins:
-			if c["log_type"] == "IN" and in_time is None:
-				in_time = c["time"]
-				outside_zone = max(outside_zone, c.get("custom_outside_zone") or 0)
-				if c.get("custom_outside_zone_reason"):
-					outside_zone_reason = c["custom_outside_zone_reason"]
-			elif c["log_type"] == "OUT":
-				out_time = c["time"]  # use latest OUT
+		in_time = day.get("first_in")
+		out_time = day.get("last_out")  # use latest OUT
+		outside_zone = day.get("outside_zone") or 0
+		outside_zone_reason = day.get("outside_zone_reason") or ""
 
 		# Status
 		if on_leave:
@@ -122,19 +115,16 @@ def _get_baghdad_employees():
 	""", as_dict=True)
 
 
-def _get_checkins(emp_ids, date):
+def _get_attendance_days(emp_ids, date):
+	"""{employee: ESS Attendance Day row} for the given date."""
 	if not emp_ids:
 		return {}
 	rows = frappe.db.sql("""
-		SELECT employee, log_type, time, custom_outside_zone, custom_outside_zone_reason
-		FROM `tabEmployee Checkin`
-		WHERE employee IN %(emps)s AND DATE(time) = %(date)s
-		ORDER BY time
+		SELECT employee, first_in, last_out, outside_zone, outside_zone_reason
+		FROM `tabESS Attendance Day`
+		WHERE attendance_date = %(date)s AND employee IN %(emps)s
 	""", {"emps": tuple(emp_ids), "date": date}, as_dict=True)
-	grouped = {}
-	for r in rows:
-		grouped.setdefault(r["employee"], []).append(r)
-	return grouped
+	return {r["employee"]: r for r in rows}
 
 
 def _get_leaves(emp_ids, date):
@@ -152,10 +142,12 @@ def _get_leaves(emp_ids, date):
 
 
 def _get_late_cutoff():
+	from opportunity_management.opportunity_management.mobile_settings import get_mobile_settings
+
 	try:
-		s = frappe.get_single("ESS Mobile Settings")
-		h = int(s.get("expected_checkin_hour") or _DEFAULT_EXPECTED_HOUR)
-		m = int(s.get("late_checkin_threshold_minutes") or _DEFAULT_THRESHOLD_MIN)
+		s = get_mobile_settings()
+		h = s.expected_checkin_hour or _DEFAULT_EXPECTED_HOUR
+		m = s.late_checkin_threshold_minutes or _DEFAULT_THRESHOLD_MIN
 		return h, m
 	except Exception:
 		return _DEFAULT_EXPECTED_HOUR, _DEFAULT_THRESHOLD_MIN
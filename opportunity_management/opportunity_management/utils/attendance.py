@@ -0,0 +1,27 @@
+"""
+Attendance query helpers.
+
+Most per-day questions (who checked in, who is still on the clock) are
+answered from ESS Attendance Day — see attendance_state. When Employee
+Checkin itself has to be filtered by calendar day, don't wrap the column
+as `DATE(time) = %s`: that hides it from every index and scans the whole
+table. Filter on `day_bounds` instead:
+
+    WHERE c.time >= %(day_start)s AND c.time < %(day_end)s
+
+which the (employee, log_type, time) index added by
+patches.add_employee_checkin_time_index answers with a range seek.
+"""
+
+from datetime import datetime, time, timedelta
+
+import frappe
+from frappe.utils import getdate
+
+
+def day_bounds(day=None):
+    """(start, end) datetimes of the half-open interval covering `day`
+    (date or "YYYY-MM-DD"; defaults to today in site time)."""
+    day = getdate(day or frappe.utils.today())
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
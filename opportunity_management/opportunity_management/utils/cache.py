@@ -0,0 +1,24 @@
+"""
+Redis cache helpers.
+
+The site-wide lookup hashes (party resolution, push targets, token health)
+grow to one field per party / employee / device. Callers usually need two
+or three of them, so read just those fields with HMGET rather than pulling
+the whole hash through `frappe.cache().hgetall`.
+"""
+
+import pickle
+
+import frappe
+
+
+def hmget(name: str, fields) -> dict:
+    """{field: value} for the given fields of a hash written with
+    `frappe.cache().hset` — one HMGET round-trip. Fields not in the hash
+    are left out."""
+    fields = list(dict.fromkeys(f for f in fields if f))
+    if not fields:
+        return {}
+    cache = frappe.cache()
+    values = cache.hmget(cache.make_key(name), fields)
+    return {f: pickle.loads(v) for f, v in zip(fields, values) if v is not None}
@@ -0,0 +1,29 @@
+"""Index Employee Checkin for the per-day attendance queries.
+
+The reminder crons, auto-checkout and the ESS control panel look up
+check-ins by employee, log type and a half-open time range for one day
+(see utils.attendance.day_bounds). Two indexes
+cover them:
+
+  employee_log_type_time  (employee, log_type, time) — the per-employee
+                          EXISTS / MAX(time) probes seek straight to one
+                          employee's IN or OUT rows for the day.
+  time                    (time) — the control panel's "check-ins today"
+                          count, which isn't per employee.
+"""
+
+import frappe
+
+
+def execute():
+    if not frappe.db.table_exists("Employee Checkin"):
+        return
+
+    frappe.db.add_index(
+        "Employee Checkin", ["employee", "log_type", "time"], "employee_log_type_time"
+    )
+    if not frappe.db.sql(
+        "SHOW INDEX FROM `tabEmployee Checkin` WHERE Column_name = 'time' AND Seq_in_index = 1"
+    ):
+        frappe.db.add_index("Employee Checkin", ["time"], "time")
+    frappe.db.commit()
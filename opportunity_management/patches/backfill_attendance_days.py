@@ -0,0 +1,19 @@
+"""Fill ESS Attendance Day from existing Employee Checkin history.
+
+The reminder crons, auto-checkout, the control panel and the Baghdad
+attendance report read per-day state from ESS Attendance Day instead of
+scanning Employee Checkin; rows for punches made before the Employee
+Checkin hooks existed come from this one-off backfill.
+"""
+
+import frappe
+
+
+def execute():
+    if not frappe.db.table_exists("Employee Checkin"):
+        return
+
+    from opportunity_management.opportunity_management.attendance_state import backfill
+
+    frappe.reload_doc("opportunity_management", "doctype", "ess_attendance_day")
+    backfill()
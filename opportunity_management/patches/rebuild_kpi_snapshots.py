@@ -0,0 +1,20 @@
+"""Rebuild Opportunity KPI snapshots together with their per-opportunity ledger.
+
+Snapshots built before `Opportunity KPI Close` existed have no ledger
+rows, so the read side couldn't take back opportunities edited since the
+build. Dropping the built-through marker makes the job rebuild everything
+once (and drops the Open rows nothing reads any more).
+"""
+
+import frappe
+
+
+def execute():
+    from opportunity_management.opportunity_management.kpi_snapshots import (
+        BUILT_THROUGH_KEY, build_daily_kpi_snapshots,
+    )
+
+    frappe.reload_doc("opportunity_management", "doctype", "opportunity_kpi_snapshot")
+    frappe.reload_doc("opportunity_management", "doctype", "opportunity_kpi_close")
+    frappe.db.set_global(BUILT_THROUGH_KEY, "")
+    build_daily_kpi_snapshots()
@@ -0,0 +1,51 @@
+"""Query-count regression check for api.get_team_opportunities_for_user.
+
+    bench --site <site> execute opportunity_management.team_opportunities_probe.run
+
+Calls the team view for one manager per department (open and completed) and
+counts the SQL statements issued. The batched implementation issues a fixed
+number of queries per call, so the count must not grow with the number of
+opportunities returned — a rising count is a reintroduced N+1.
+"""
+
+import time
+
+import frappe
+
+from opportunity_management.assignment_map_probe import _QueryCounter
+
+
+def run():
+    from opportunity_management.opportunity_management import api, notification_utils
+
+    managers = frappe.db.sql(
+        """
+        SELECT department, MIN(user_id) AS user_id
+        FROM `tabEmployee`
+        WHERE status = 'Active' AND IFNULL(user_id, '') != '' AND IFNULL(department, '') != ''
+        GROUP BY department
+        """,
+        as_dict=True,
+    )
+    print(f"{'department':<30} {'completed':>9} {'opps':>6} {'queries':>8} {'ms':>9}")
+    results = []
+    for m in managers:
+        for include_completed in (0, 1):
+            notification_utils.clear_party_resolution_cache()
+            started = time.perf_counter()
+            with _QueryCounter() as counter:
+                rows = api.get_team_opportunities_for_user(m.user_id, include_completed)
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"{m.department[:30]:<30} {include_completed:>9} {len(rows):>6} {counter.count:>8} {elapsed:>9.1f}")
+            results.append({
+                "department": m.department,
+                "include_completed": include_completed,
+                "opportunities": len(rows),
+                "queries": counter.count,
+                "ms": round(elapsed, 1),
+            })
+
+    query_counts = {r["queries"] for r in results if r["opportunities"]}
+    if len(query_counts) > 1:
+        print(f"WARNING: query count varies with result size: {sorted(query_counts)}")
+    return results